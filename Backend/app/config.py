@@ -1,5 +1,5 @@
 import os
-from typing import List, Optional
+from typing import Dict, List, Optional
 from pydantic import BaseSettings, Field
 
 class Settings(BaseSettings):
@@ -25,6 +25,41 @@ class Settings(BaseSettings):
     INVOICE_NUMBER_ACCURACY: float = 0.95  # 95% accuracy for invoice number extraction
     TOTAL_MATH_ACCURACY: float = 1.0  # 100% accuracy for total calculations
     MAX_WORKERS: int = Field(default=2, env="MAX_WORKERS")  # can be increased to 5
+    EXTRACTION_PROCESSES: int = Field(default=2, env="EXTRACTION_PROCESSES")  # 0 = extract on the event loop
+    EXTRACTION_CHUNK_SIZE: int = Field(default=16, env="EXTRACTION_CHUNK_SIZE")  # pages per worker round trip
+    PARSE_CACHE_SIZE: int = Field(default=8192, env="PARSE_CACHE_SIZE")  # LRU entries for date/amount parsing
+    STATE_DB_PATH: str = Field(default="/tmp/invoice_state/state.sqlite3", env="STATE_DB_PATH")  # survives Redis flushes
+    EXTRACTION_CACHE_TTL: int = Field(default=7 * 86400, env="EXTRACTION_CACHE_TTL")  # seconds
+    EXTRACTION_CACHE_SIZE: int = Field(default=1024, env="EXTRACTION_CACHE_SIZE")  # in-process entries
+    EXTRACTION_CACHE_MAX_BYTES: int = Field(default=256 * 1024, env="EXTRACTION_CACHE_MAX_BYTES")  # per entry
+    TEMPLATE_MATCH_THRESHOLD: float = Field(default=0.6, env="TEMPLATE_MATCH_THRESHOLD")  # min vendor fingerprint score
+    ANOMALY_MIN_SAMPLES: int = Field(default=20, env="ANOMALY_MIN_SAMPLES")  # vendor invoices before statistics apply
+    ANOMALY_Z_THRESHOLD: float = Field(default=3.0, env="ANOMALY_Z_THRESHOLD")
+    ANOMALY_QUANTILE: float = Field(default=0.99, env="ANOMALY_QUANTILE")  # outliers also lie beyond this tail
+    DUPLICATE_DATE_WINDOW: int = Field(default=3, env="DUPLICATE_DATE_WINDOW")  # days either side for fuzzy duplicates
+    INGEST_PROCESSES: int = Field(default=2, env="INGEST_PROCESSES")  # PDF decode workers; 0 = decode on threads
+    INGEST_MEMORY_BUDGET: int = Field(default=256 * 1024 * 1024, env="INGEST_MEMORY_BUDGET")  # decoded bytes not yet consumed
+    RASTER_PROCESSES: int = Field(default=os.cpu_count() or 1, env="RASTER_PROCESSES")  # 0 = render PDFs in one thread
+    RASTER_SHARD_PAGES: int = Field(default=8, env="RASTER_SHARD_PAGES")  # max pages per worker round trip
+    RASTER_INLINE_PAGES: int = Field(default=2, env="RASTER_INLINE_PAGES")  # smaller PDFs skip the pool
+    RASTER_DPI: int = Field(default=72, env="RASTER_DPI")
+    RASTER_COLORSPACE: str = Field(default="rgb", env="RASTER_COLORSPACE")  # rgb or gray
+    MAX_PAGES_PER_JOB: int = Field(default=2000, env="MAX_PAGES_PER_JOB")  # larger jobs are refused at upload
+    BULK_JOB_PAGES: int = Field(default=200, env="BULK_JOB_PAGES")  # larger jobs go to the bulk queue
+    BULK_JOB_CONCURRENCY: int = Field(default=1, env="BULK_JOB_CONCURRENCY")
+    VISION_COST_PER_PAGE: float = Field(default=0.0015, env="VISION_COST_PER_PAGE")  # USD, for estimates
+    DOCAI_COST_PER_PAGE: float = Field(default=0.01, env="DOCAI_COST_PER_PAGE")  # USD, for estimates
+    OCR_BACKEND: str = Field(default="vision", env="OCR_BACKEND")  # vision, tesseract or fake
+    OCR_FALLBACK_BACKEND: str = Field(default="", env="OCR_FALLBACK_BACKEND")  # when OCR fails, e.g. tesseract; empty for none
+    OCR_BULK_BACKEND: str = Field(default="", env="OCR_BULK_BACKEND")  # for bulk-queue jobs; empty for OCR_BACKEND
+    OCR_PROJECT_BACKENDS: Dict[str, str] = Field(default={}, env="OCR_PROJECT_BACKENDS")  # JSON, project ID -> backend
+    TESSERACT_PROCESSES: int = Field(default=os.cpu_count() or 1, env="TESSERACT_PROCESSES")
+    TESSERACT_LANG: str = Field(default="eng", env="TESSERACT_LANG")
+    GOOGLE_CASSETTE_MODE: str = Field(default="off", env="GOOGLE_CASSETTE_MODE")  # off, record or replay
+    GOOGLE_CASSETTE_PATH: str = Field(default="/tmp/invoice_state/google_cassette.sqlite3", env="GOOGLE_CASSETTE_PATH")
+    GOOGLE_REPLAY_LATENCY: str = Field(default="recorded", env="GOOGLE_REPLAY_LATENCY")  # see cassette.LatencyModel
+    GOOGLE_REPLAY_ERROR_RATE: float = Field(default=0.0, env="GOOGLE_REPLAY_ERROR_RATE")  # injected failures on replay
+    GOOGLE_REPLAY_SEED: int = Field(default=0, env="GOOGLE_REPLAY_SEED")
 
     # Output Configuration
     OUTPUT_FORMATS: List[str] = Field(default=["csv", "excel"])
@@ -12,13 +12,21 @@ import os
 import uuid
 import shutil
 import secrets
+import time
 import logging
 from app.config import settings
 from datetime import date
-from app.utils.file_handler import FileHandler
+from app.utils.file_handler import FileHandler, FileProcessingError, UnsupportedFileTypeError, UploadTooLargeError
 from app.utils.ocr_engine import ocr_engine
 from app.utils.ocr_engine import initialize_ocr_engine, cleanup_ocr_engine
-from app.utils.validator import invoice_validator, flag_anomalies
+from app.utils.validator import annotate_invoices
+from app.utils.duplicate_index import duplicate_index
+from app.utils.anomaly_engine import anomaly_engine
+from app.utils.pipeline import InvoiceSet
+from app.utils.upload_registry import upload_digest, upload_registry
+from app.utils.preflight import BULK_QUEUE, QuotaExceededError, admit, inspect_uploads, job_queues, throughput
+from app.utils.ocr_backends import resolve_ocr_backend, shutdown_ocr_backends
+from app.utils.rasterizer import pdf_rasterizer
 from app.utils.exporter import export_invoices
 from app.models import Invoice, ProcessingStatus
 from app.utils.data_extractor import data_extractor, extract_invoice_data
@@ -56,6 +64,7 @@ file_handler = FileHandler()
 # Define models
 class ProcessingRequest(BaseModel):
     task_id: str
+    estimate: Optional[Dict[str, Any]] = None
 
 class ProcessingResponse(BaseModel):
     task_id: str
@@ -76,8 +85,85 @@ def get_file_type(filename):
     elif ext == '.zip':
         return "application/zip"
     return None
+
+async def extract_uploads(file_paths: List[str], spool_dir: str, on_progress,
+                          ocr_backend: Optional[str] = None, ocr_pages: Optional[Dict[str, int]] = None,
+                          project_id: Optional[int] = None) -> InvoiceSet:
+    """
+    OCR and extract every page of the uploads into an InvoiceSet, with the
+    named OCR backend (OCR_BACKEND by default); ocr_pages, when given, counts
+    the pages each backend actually OCRed, fallbacks included. Vendor
+    templates are the project's. Pages are
+    rendered a few ahead of OCR and extracted one document at a time, so only
+    the pages in flight and the current document's OCR results are in memory.
+    on_progress(progress, message) reports 0-60%. Time spent per stage feeds
+    the pre-flight estimates.
+    """
+    invoice_set = InvoiceSet()
+    progress = 0
+
+    async def extract(document, ocr_results):
+        started = time.perf_counter()
+        invoice_set.add(document.source, await ocr_engine.extract_pages(ocr_results, project_id))
+        throughput.record('extract', len(ocr_results), time.perf_counter() - started)
+
+    for file_index, file_path in enumerate(file_paths):
+        document, ocr_results = None, []
+        waiting = time.perf_counter()
+        async for page, image in file_handler.render_pages(file_handler.iter_pages(file_path, spool_dir)):
+            # Render time is what OCR waited for the page, not the CPU time spent rendering it
+            started = time.perf_counter()
+            throughput.record('render', 1, started - waiting)
+            if document is not None and page.path != document.path:
+                await extract(document, ocr_results)
+                ocr_results = []
+                started = time.perf_counter()
+            document = page
+            ocr_results.append(await ocr_engine.process_page(page.filename, image, ocr_backend))
+            if ocr_pages is not None:
+                used = ocr_results[-1]['ocr_backend']
+                ocr_pages[used] = ocr_pages.get(used, 0) + 1
+            throughput.record('ocr', 1, time.perf_counter() - started)
+            
+            # ZIP members restart the page count, so progress only ever moves forward
+            progress = max(progress, int((file_index + page.page_number / page.total_pages) / len(file_paths) * 60))
+            on_progress(progress, f'Processed page {page.page_number}/{page.total_pages} of {page.source}')
+            waiting = time.perf_counter()
+        if ocr_results:
+            await extract(document, ocr_results)
+        logger.info(f"File processed: {file_path}")
+    return invoice_set
+
+async def run_queued(queue: str, process, task_id: str, *args):
+    """Run a processing function once its queue has a slot for it."""
+    async with job_queues.slot(queue):
+        await process(task_id, *args)
+
+def reuse_upload(digest: str, project_id: Optional[int] = None) -> Optional[str]:
+    """
+    Task ID to answer an identical re-upload to the same project with, or
+    None to process it: the task still running on it, or the one that
+    already processed it. Uploads to another project are processed again,
+    so their flags come from that project's history.
+    """
+    match = upload_registry.lookup(digest, project_id)
+    if match is None:
+        return None
+    if match.result is None:
+        logger.info(f"Upload {digest[:12]} joins running task {match.task_id}")
+        return match.task_id
     
-async def process_file_directly(task_id: str, file_path: str, temp_dir: str, project_id: Optional[int] = None):
+    # Restored after a restart, which empties the in-memory task tables
+    status_info = ProcessingStatus(status="Completed", progress=100, message="Processing completed (reused earlier results)")
+    if project_id:
+        status_info.project_id = project_id
+    processing_tasks[match.task_id] = status_info
+    direct_results[match.task_id] = match.result
+    logger.info(f"Upload {digest[:12]} answered with the results of task {match.task_id}")
+    return match.task_id
+    
+async def process_file_directly(task_id: str, file_path: str, temp_dir: str, project_id: Optional[int] = None,
+                                digest: Optional[str] = None, ocr_backend: Optional[str] = None):
     logger.info(f"Starting direct processing for task {task_id}" + 
                 (f" associated with project {project_id}" if project_id else ""))
     
@@ -88,37 +174,22 @@ async def process_file_directly(task_id: str, file_path: str, temp_dir: str, pro
             status_info.project_id = project_id
         processing_tasks[task_id] = status_info
         
-        # Process file
-        processed_files = await file_handler.process_upload(file_path)
-        logger.info(f"File processed: {file_path}")
-        
-        # Update progress to 20% (preserve project_id)
-        status_info = ProcessingStatus(status="Processing", progress=20, message="File processed")
-        if project_id:
-            status_info.project_id = project_id
-        processing_tasks[task_id] = status_info
-        
-        all_extracted_data = []
-        total_files = len(processed_files)
-        
-        for i, file_batch in enumerate(processed_files):
-            ocr_results = await ocr_engine.process_documents([file_batch])
-            batch_data = [Invoice.parse_obj(result) for result in ocr_results.values()]
-            all_extracted_data.extend(batch_data)
-            
-            # Calculate progress between 20% and 60%
-            progress = 20 + ((i + 1) / total_files * 40)
-            
+        def update_progress(progress: int, message: str):
             # Update progress (preserve project_id)
-            status_info = ProcessingStatus(
-                status="Processing", 
-                progress=int(progress), 
-                message=f'Processed {i+1}/{total_files} files'
-            )
+            status_info = ProcessingStatus(status="Processing", progress=progress, message=message)
             if project_id:
                 status_info.project_id = project_id
             processing_tasks[task_id] = status_info
         
+        # Pages are rendered and OCRed as they are read; ZIP members are spooled next to the upload
+        spool_dir = tempfile.mkdtemp(dir=temp_dir)
+        ocr_pages = {}
+        try:
+            invoice_set = await extract_uploads([file_path], spool_dir, update_progress, ocr_backend, ocr_pages,
+                                                project_id)
+        finally:
+            shutil.rmtree(spool_dir, ignore_errors=True)
+        
         logger.info("OCR and Data extraction completed")
         
         # Update progress to 60% (preserve project_id)
@@ -127,9 +198,8 @@ async def process_file_directly(task_id: str, file_path: str, temp_dir: str, pro
             status_info.project_id = project_id
         processing_tasks[task_id] = status_info
         
-        validation_results = invoice_validator.validate_invoices(all_extracted_data)
-        validated_data = [invoice for invoice, _, _ in validation_results]
-        validation_warnings = {invoice.invoice_number: warnings for invoice, _, warnings in validation_results}
+        # Warnings and flags go to side tables; the invoices themselves are never copied again
+        annotate_invoices(invoice_set, project_id, task_id)
         
         logger.info("Validation completed")
         
@@ -145,18 +215,10 @@ async def process_file_directly(task_id: str, file_path: str, temp_dir: str, pro
             status_info.project_id = project_id
         processing_tasks[task_id] = status_info
         
-        flagged_invoices = flag_anomalies(validated_data)
+        validation_results, anomalies = invoice_set.results()
         
-        export_data = []
-        for invoice in validated_data:
-            invoice_data = invoice.dict()
-            invoice_data['validation_warnings'] = validation_warnings.get(invoice.invoice_number, [])
-            invoice_data['anomaly_flags'] = [flag for flagged in flagged_invoices if flagged['invoice_number'] == invoice.invoice_number for flag in flagged['flags']]
-            export_data.append(invoice_data)
-        
-        invoices = [Invoice.parse_obj(data) for data in export_data]
-        csv_output = await export_invoices(invoices, 'csv')
-        excel_output = await export_invoices(invoices, 'excel')
+        csv_output = await export_invoices(invoice_set.batch, 'csv')
+        excel_output = await export_invoices(invoice_set.batch, 'excel')
         
         csv_path = os.path.join(temp_dir, f"{task_id}_invoices.csv")
         excel_path = os.path.join(temp_dir, f"{task_id}_invoices.xlsx")
@@ -166,6 +228,18 @@ async def process_file_directly(task_id: str, file_path: str, temp_dir: str, pro
         with open(excel_path, 'wb') as f:
             f.write(excel_output.getvalue())
         
+        # Only saved results enter the duplicate index and the vendor statistics, so a failed run cannot flag
+        # its own retry; invoices an earlier run already registered are not counted again
+        new_rows = None
+        try:
+            new_rows = duplicate_index.register(invoice_set, project_id, task_id)
+        except Exception as e:
+            logger.error(f"Could not update the duplicate index for task {task_id}: {str(e)}")
+        try:
+            anomaly_engine.register(invoice_set.batch, project_id, new_rows)
+        except Exception as e:
+            logger.error(f"Could not update the vendor statistics for task {task_id}: {str(e)}")
+        
         logger.info(f"Processing completed for task {task_id}")
         
         # Create result dictionary with project_id if provided
@@ -174,12 +248,16 @@ async def process_file_directly(task_id: str, file_path: str, temp_dir: str, pro
             'message': 'Processing completed',
             'csv_path': csv_path,
             'excel_path': excel_path,
-            'total_invoices': len(validated_data),
-            'flagged_invoices': len(flagged_invoices),
+            'total_invoices': len(invoice_set),
+            'flagged_invoices': len(anomalies),
             'status': 'Completed',
             'temp_dir': temp_dir,
-            'validation_results': validation_warnings,
-            'anomalies': flagged_invoices
+            # The backends that actually ran, by page count, so fallback use is visible
+            'ocr_backend': ocr_backend or settings.OCR_BACKEND,
+            'ocr_pages': ocr_pages,
+            # Keyed by invoice ID (file plus page), so missing or repeated invoice numbers cannot collide
+            'validation_results': validation_results,
+            'anomalies': anomalies
         }
         
         # Add project_id to result if provided
@@ -193,6 +271,8 @@ async def process_file_directly(task_id: str, file_path: str, temp_dir: str, pro
         processing_tasks[task_id] = status_info
         
         direct_results[task_id] = result
+        if digest:
+            upload_registry.finish(digest, task_id, project_id, result)
         
         return result
         
@@ -211,9 +291,12 @@ async def process_file_directly(task_id: str, file_path: str, temp_dir: str, pro
             error_result['project_id'] = project_id
         
         direct_results[task_id] = error_result
+        if digest:
+            upload_registry.abandon(digest, task_id, project_id)
         raise
 
-async def process_multiple_files_directly(task_id: str, file_paths: List[str], temp_dir: str, project_id: Optional[int] = None):
+async def process_multiple_files_directly(task_id: str, file_paths: List[str], temp_dir: str, project_id: Optional[int] = None,
+                                          digest: Optional[str] = None, ocr_backend: Optional[str] = None):
     logger.info(f"Starting direct processing for multiple files, task {task_id}" + 
                 (f" associated with project {project_id}" if project_id else ""))
     
@@ -224,43 +307,21 @@ async def process_multiple_files_directly(task_id: str, file_paths: List[str], t
             status_info.project_id = project_id
         processing_tasks[task_id] = status_info
         
-        processed_files = []
-        for idx, file_path in enumerate(file_paths):
-            processed_files.extend(await file_handler.process_upload(file_path))
-            # Calculate progress up to 20%
-            progress = ((idx + 1) / len(file_paths) * 20)
-            logger.info(f"Processed file {idx + 1} of {len(file_paths)}: {file_path}")
-            
+        def update_progress(progress: int, message: str):
             # Update progress (preserve project_id)
-            status_info = ProcessingStatus(
-                status="Processing", 
-                progress=int(progress), 
-                message=f'Processed {idx + 1} of {len(file_paths)} files'
-            )
+            status_info = ProcessingStatus(status="Processing", progress=progress, message=message)
             if project_id:
                 status_info.project_id = project_id
             processing_tasks[task_id] = status_info
         
-        all_extracted_data = []
-        total_batches = len(processed_files)
-        
-        for i, file_batch in enumerate(processed_files):
-            ocr_results = await ocr_engine.process_documents([file_batch])
-            batch_data = [Invoice.parse_obj(result) for result in ocr_results.values()]
-            all_extracted_data.extend(batch_data)
-            
-            # Calculate progress between 20% and 60%
-            progress = 20 + ((i + 1) / total_batches * 40)
-            
-            # Update progress (preserve project_id)
-            status_info = ProcessingStatus(
-                status="Processing", 
-                progress=int(progress), 
-                message=f'Processed {i+1}/{total_batches} batches'
-            )
-            if project_id:
-                status_info.project_id = project_id
-            processing_tasks[task_id] = status_info
+        # Pages are rendered and OCRed as they are read; ZIP members are spooled next to the upload
+        spool_dir = tempfile.mkdtemp(dir=temp_dir)
+        ocr_pages = {}
+        try:
+            invoice_set = await extract_uploads(file_paths, spool_dir, update_progress, ocr_backend, ocr_pages,
+                                                project_id)
+        finally:
+            shutil.rmtree(spool_dir, ignore_errors=True)
         
         logger.info("OCR and Data extraction completed")
         
@@ -270,9 +331,8 @@ async def process_multiple_files_directly(task_id: str, file_paths: List[str], t
             status_info.project_id = project_id
         processing_tasks[task_id] = status_info
         
-        validation_results = invoice_validator.validate_invoices(all_extracted_data)
-        validated_data = [invoice for invoice, _, _ in validation_results]
-        validation_warnings = {invoice.invoice_number: warnings for invoice, _, warnings in validation_results}
+        # Warnings and flags go to side tables; the invoices themselves are never copied again
+        annotate_invoices(invoice_set, project_id, task_id)
         
         logger.info("Validation completed")
         
@@ -288,18 +348,10 @@ async def process_multiple_files_directly(task_id: str, file_paths: List[str], t
             status_info.project_id = project_id
         processing_tasks[task_id] = status_info
         
-        flagged_invoices = flag_anomalies(validated_data)
-        
-        export_data = []
-        for invoice in validated_data:
-            invoice_data = invoice.dict()
-            invoice_data['validation_warnings'] = validation_warnings.get(invoice.invoice_number, [])
-            invoice_data['anomaly_flags'] = [flag for flagged in flagged_invoices if flagged['invoice_number'] == invoice.invoice_number for flag in flagged['flags']]
-            export_data.append(invoice_data)
+        validation_results, anomalies = invoice_set.results()
         
-        invoices = [Invoice.parse_obj(data) for data in export_data]
-        csv_output = await export_invoices(invoices, 'csv')
-        excel_output = await export_invoices(invoices, 'excel')
+        csv_output = await export_invoices(invoice_set.batch, 'csv')
+        excel_output = await export_invoices(invoice_set.batch, 'excel')
         
         csv_path = os.path.join(temp_dir, f"{task_id}_invoices.csv")
         excel_path = os.path.join(temp_dir, f"{task_id}_invoices.xlsx")
@@ -309,6 +361,18 @@ async def process_multiple_files_directly(task_id: str, file_paths: List[str], t
         with open(excel_path, 'wb') as f:
             f.write(excel_output.getvalue())
         
+        # Only saved results enter the duplicate index and the vendor statistics, so a failed run cannot flag
+        # its own retry; invoices an earlier run already registered are not counted again
+        new_rows = None
+        try:
+            new_rows = duplicate_index.register(invoice_set, project_id, task_id)
+        except Exception as e:
+            logger.error(f"Could not update the duplicate index for task {task_id}: {str(e)}")
+        try:
+            anomaly_engine.register(invoice_set.batch, project_id, new_rows)
+        except Exception as e:
+            logger.error(f"Could not update the vendor statistics for task {task_id}: {str(e)}")
+        
         logger.info(f"Processing completed for task {task_id}")
         
         # Create result dictionary with project_id if provided
@@ -317,12 +381,16 @@ async def process_multiple_files_directly(task_id: str, file_paths: List[str], t
             'message': 'Processing completed',
             'csv_path': csv_path,
             'excel_path': excel_path,
-            'total_invoices': len(validated_data),
-            'flagged_invoices': len(flagged_invoices),
+            'total_invoices': len(invoice_set),
+            'flagged_invoices': len(anomalies),
             'status': 'Completed',
             'temp_dir': temp_dir,
-            'validation_results': validation_warnings,
-            'anomalies': flagged_invoices
+            # The backends that actually ran, by page count, so fallback use is visible
+            'ocr_backend': ocr_backend or settings.OCR_BACKEND,
+            'ocr_pages': ocr_pages,
+            # Keyed by invoice ID (file plus page), so missing or repeated invoice numbers cannot collide
+            'validation_results': validation_results,
+            'anomalies': anomalies
         }
         
         # Add project_id to result if provided
@@ -336,6 +404,8 @@ async def process_multiple_files_directly(task_id: str, file_paths: List[str], t
         processing_tasks[task_id] = status_info
         
         direct_results[task_id] = result
+        if digest:
+            upload_registry.finish(digest, task_id, project_id, result)
         
         return result
         
@@ -354,6 +424,8 @@ async def process_multiple_files_directly(task_id: str, file_paths: List[str], t
             error_result['project_id'] = project_id
         
         direct_results[task_id] = error_result
+        if digest:
+            upload_registry.abandon(digest, task_id, project_id)
         raise
 
 # API Endpoints
@@ -361,6 +433,8 @@ async def process_multiple_files_directly(task_id: str, file_paths: List[str], t
 async def upload_files(
     files: List[UploadFile] = File(...), 
     project_id: Optional[int] = None,  # Add project_id parameter
+    force: bool = False,  # process again even if identical uploads were processed before
+    ocr_backend: Optional[str] = None,  # vision, tesseract or fake; by default the project's or OCR_BACKEND
     background_tasks: BackgroundTasks = BackgroundTasks()
 ):
     task_id = str(uuid.uuid4())
@@ -376,6 +450,7 @@ async def upload_files(
     
     temp_dir = tempfile.mkdtemp()
     file_paths = []
+    file_hashes = []
 
     try:
         for file in files:
@@ -385,35 +460,78 @@ async def upload_files(
                 logger.warning(f"Unsupported file type: {file_type}")
                 raise HTTPException(status_code=400, detail=f"Unsupported file type: {file_type}")
             
-            file_path = os.path.join(temp_dir, file.filename)
+            # Streamed to disk in chunks, hashed and sniffed on the way; never held whole in memory
             try:
-                with open(file_path, "wb") as buffer:
-                    content = await file.read()
-                    buffer.write(content)
-                file_paths.append(file_path)
-                logger.info(f"File saved successfully: {file_path}")
-            except IOError as e:
+                upload = await file_handler.spool_upload(file, temp_dir)
+                file_paths.append(upload.path)
+                file_hashes.append((upload.filename, upload.sha256))
+                logger.info(f"File saved successfully: {upload.path} ({upload.size} bytes, {upload.content_type}, "
+                            f"sha256 {upload.sha256})")
+            except UploadTooLargeError as e:
+                raise HTTPException(status_code=413, detail=str(e))
+            except UnsupportedFileTypeError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            except (IOError, FileProcessingError) as e:
                 logger.error(f"Error saving file {file.filename}: {str(e)}")
                 raise HTTPException(status_code=500, detail=f"Error saving file {file.filename}")
 
+        # Identical uploads are answered from the task that processed them, or join it while it runs
+        digest = upload_digest(file_hashes)
+        if force:
+            upload_registry.record('forced')
+        else:
+            reused_task_id = reuse_upload(digest, project_id)
+            if reused_task_id:
+                del processing_tasks[task_id]
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                return ProcessingRequest(task_id=reused_task_id)
+
+        # Pages are counted without rendering anything; jobs over quota are refused before any API call
+        try:
+            report = await asyncio.to_thread(inspect_uploads, file_paths)
+            admit(report)
+        except QuotaExceededError as e:
+            del processing_tasks[task_id]
+            raise HTTPException(status_code=413, detail=str(e))
+        except FileProcessingError as e:
+            del processing_tasks[task_id]
+            raise HTTPException(status_code=400, detail=str(e))
+        try:
+            backend = resolve_ocr_backend(ocr_backend, project_id, report.queue)
+        except ValueError as e:
+            del processing_tasks[task_id]
+            raise HTTPException(status_code=400, detail=str(e))
+        report.price(backend)
+        logger.info(f"Task {task_id}: {report.pages} pages, about {report.seconds:.0f}s, {report.queue} queue, "
+                    f"{backend} OCR")
+        upload_registry.start(digest, task_id, project_id)
+        
         # Pass project_id to the processing functions
         if len(files) == 1:
             logger.info(f"Processing single file directly: {file_paths[0]}")
             # Update the process_file_directly function call to include project_id
-            background_tasks.add_task(process_file_directly, task_id, file_paths[0], temp_dir, project_id)
+            background_tasks.add_task(run_queued, report.queue, process_file_directly,
+                                      task_id, file_paths[0], temp_dir, project_id, digest, backend)
         else:
             logger.info(f"Processing multiple files directly: {file_paths}")
             # Update the process_multiple_files_directly function call to include project_id
-            background_tasks.add_task(process_multiple_files_directly, task_id, file_paths, temp_dir, project_id)
+            background_tasks.add_task(run_queued, report.queue, process_multiple_files_directly,
+                                      task_id, file_paths, temp_dir, project_id, digest, backend)
         
-        processing_tasks[task_id] = ProcessingStatus(status="Processing", progress=0, message="Processing started")
+        if report.queue == BULK_QUEUE:
+            processing_tasks[task_id] = ProcessingStatus(status="Queued", progress=0, message="Waiting for a bulk processing slot")
+        else:
+            processing_tasks[task_id] = ProcessingStatus(status="Processing", progress=0, message="Processing started")
         if project_id:
             # Preserve the project_id in the updated status
             processing_tasks[task_id].project_id = project_id
             
         logger.info(f"Task {task_id} started for direct processing")
         
-        return ProcessingRequest(task_id=task_id)
+        return ProcessingRequest(task_id=task_id, estimate=report.to_dict())
+    except HTTPException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
     except Exception as e:
         logger.error(f"Unexpected error during file upload: {str(e)}", exc_info=True)
         shutil.rmtree(temp_dir)
@@ -438,16 +556,17 @@ async def download_results(task_id: str, format: str = "csv"):
     
     result = direct_results[task_id]
     
+    # Paths from the result, not the task ID: reused results live under the task that produced them
     if format.lower() == "csv":
-        file_path = os.path.join(result.get('temp_dir', tempfile.gettempdir()), f"{task_id}_invoices.csv")
+        file_path = result.get('csv_path')
         media_type = "text/csv"
     elif format.lower() == "excel":
-        file_path = os.path.join(result.get('temp_dir', tempfile.gettempdir()), f"{task_id}_invoices.xlsx")
+        file_path = result.get('excel_path')
         media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     else:
         raise HTTPException(status_code=400, detail="Invalid format specified")
     
-    if not os.path.exists(file_path):
+    if not file_path or not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="Result file not found")
     
     return FileResponse(file_path, media_type=media_type, filename=os.path.basename(file_path))
@@ -505,6 +624,36 @@ def check_task(task_id: str):
 async def health_check():
     return {"status": "healthy"}
 
+@app.post("/estimate/")
+async def estimate_upload(files: List[UploadFile] = File(...), project_id: Optional[int] = None,
+                          ocr_backend: Optional[str] = None):
+    """Pages, API calls, cost and completion time the uploads would take, without processing them."""
+    temp_dir = tempfile.mkdtemp()
+    try:
+        file_paths = []
+        for file in files:
+            try:
+                upload = await file_handler.spool_upload(file, temp_dir)
+                file_paths.append(upload.path)
+            except UploadTooLargeError as e:
+                raise HTTPException(status_code=413, detail=str(e))
+            except UnsupportedFileTypeError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        try:
+            report = await asyncio.to_thread(inspect_uploads, file_paths)
+            report.price(resolve_ocr_backend(ocr_backend, project_id, report.queue))
+        except (FileProcessingError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        estimate = report.to_dict()
+        estimate['within_quota'] = report.pages <= settings.MAX_PAGES_PER_JOB
+        return estimate
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+@app.get("/metrics")
+async def get_metrics():
+    return {"upload_dedup": upload_registry.stats(), "throughput": throughput.snapshot()}
+
 @app.get("/")
 async def root():
     return RedirectResponse(url="/")  # Redirect to Django's home page
@@ -538,6 +687,10 @@ async def shutdown_event():
     logger.info("Application is shutting down")
     await cleanup_ocr_engine()  
     await cleanup_data_extractor()
+    # Worker processes of the spawn pools would otherwise outlive the app on reload
+    file_handler.shutdown()
+    pdf_rasterizer.shutdown()
+    shutdown_ocr_backends()
     
 if __name__ == "__main__":
     import uvicorn
@@ -37,6 +37,7 @@ class Invoice(BaseModel):
     grand_total: Optional[Decimal] = None  # Changed from default=Decimal('0') to None
     taxes: Optional[Decimal] = None  # Changed from default=Decimal('0') to None
     final_total: Optional[Decimal] = None  # Changed from default=Decimal('0') to None
+    currency: Optional[str] = None  # ISO 4217 code of the amounts, when the document shows one
     items: List[InvoiceItem] = []
     pages: int = Field(default=1, ge=1)
 
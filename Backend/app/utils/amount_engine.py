@@ -0,0 +1,336 @@
+import re
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+import numpy as np
+from price_parser import Price
+
+# Locales whose invoices write amounts as 1.234,56
+COMMA_DECIMAL_LOCALES = {'de', 'fr', 'es', 'pt', 'it', 'nl', 'pl', 'tr', 'ru', 'id', 'da', 'sv', 'nb', 'fi'}
+
+CURRENCY_SYMBOLS = {
+    '$': 'USD', 'US$': 'USD', 'C$': 'CAD', 'CA$': 'CAD', 'A$': 'AUD', 'AU$': 'AUD', 'NZ$': 'NZD',
+    'HK$': 'HKD', 'S$': 'SGD', 'R$': 'BRL', 'MX$': 'MXN', '€': 'EUR', '£': 'GBP', '¥': 'JPY',
+    '₹': 'INR', '₩': 'KRW', '₺': 'TRY', '₽': 'RUB', '₪': 'ILS', '₱': 'PHP', '฿': 'THB', 'zł': 'PLN',
+}
+CURRENCY_CODES = {
+    'USD', 'EUR', 'GBP', 'JPY', 'CHF', 'CAD', 'AUD', 'NZD', 'CNY', 'HKD', 'SGD', 'INR', 'BRL', 'MXN',
+    'SEK', 'NOK', 'DKK', 'PLN', 'CZK', 'HUF', 'RON', 'ZAR', 'KRW', 'TRY', 'RUB', 'ILS', 'AED', 'SAR',
+    'THB', 'PHP', 'IDR', 'MYR',
+}
+
+_CURRENCY = '|'.join(re.escape(mark) for mark in sorted(CURRENCY_CODES | set(CURRENCY_SYMBOLS), key=len, reverse=True))
+
+NEGATIVE_SIGNS = ('-', '−')
+# Thousands separators besides . and , (apostrophes, spaces, no-break spaces)
+GROUPING = "'’ \u00a0\u202f"
+THOUSANDS_ONLY = str.maketrans('', '', GROUPING)
+DOT_DECIMAL = str.maketrans('', '', ',' + GROUPING)
+COMMA_DECIMAL = str.maketrans({'.': None, ',': '.', **{char: None for char in GROUPING}})
+INTEGER_ONLY = str.maketrans('', '', '.,' + GROUPING)
+DECIMAL_TABLES = {'.': DOT_DECIMAL, ',': COMMA_DECIMAL, None: INTEGER_ONLY}
+
+# An amount token is one number (digits with . , and GROUPING separators)
+# between affixes that may only hold a sign, parentheses and a currency
+AMOUNT_SPLIT_RE = re.compile(r"(\D*?)(\d(?:[\d.,'’ \u00a0\u202f]*\d)?)(\D*)")
+# The same split for a whole newline-joined batch in one findall; lines that are
+# not amount-shaped land in the last group
+BATCH_SPLIT_RE = re.compile(r"^(?:([^\d\n]*)(\d[\d.,'’ \u00a0\u202f]*)([^\n]*)|([^\n]*))$", re.MULTILINE)
+NUMBER_TRAILER = ".,'’ \u00a0\u202f"
+PREFIX_RE = re.compile(rf"\s*([-−(])?\s*({_CURRENCY})?\s*([-−])?\s*")
+SUFFIX_RE = re.compile(rf"\s*({_CURRENCY})?\s*([-−)])?\s*")
+
+# Unambiguous evidence for a convention, counted over a whole document with one
+# C-level scan each: a separator followed by one or two final digits can only be
+# the decimal mark, and a separator repeated between digit triples ("1.234.567")
+# can only be grouping. A lone separator before three digits ("1,234") is
+# ambiguous and votes for neither.
+DECIMAL_EVIDENCE_RE = re.compile(r"\d([.,])\d\d?(?![\d.,])")
+GROUPING_EVIDENCE_RE = re.compile(r"\d([.,])\d{3}\1\d{3}(?!\d)")
+# Candidate currency marks anywhere on the page; non-currency words ("VAT") map to None
+CURRENCY_SCAN_RE = re.compile(r"(?<![A-Za-z])(?:[A-Z]{1,3}\$|[A-Z]{3}(?![A-Za-z])|zł)|[$€£¥₹₩₺₽₪₱฿]")
+
+# Batches at least this large take the vectorized path; below it NumPy's fixed
+# per-call cost outweighs the per-token loop
+VECTORIZE_MIN_TOKENS = 64
+MAX_VECTOR_LENGTH = 32
+NO_MARK, DOT_MARK, COMMA_MARK = 0, 1, 2
+
+
+class Amount(NamedTuple):
+    value: Decimal
+    currency: Optional[str] = None
+
+
+class AmountConvention(NamedTuple):
+    """How one document writes money: its decimal mark and dominant currency."""
+    decimal: str = '.'
+    currency: Optional[str] = None
+
+
+DEFAULT_CONVENTION = AmountConvention()
+
+
+def decimal_separator_for_locale(locale: Optional[str]) -> Optional[str]:
+    if not locale:
+        return None
+    return ',' if locale.split('_')[0].lower() in COMMA_DECIMAL_LOCALES else '.'
+
+
+def currency_code(token: Optional[str]) -> Optional[str]:
+    if not token:
+        return None
+    return token if token in CURRENCY_CODES else CURRENCY_SYMBOLS.get(token)
+
+
+# Convention detection
+
+def _evidence_votes(text: str) -> Tuple[int, int]:
+    """(dot, comma) decimal-mark votes of the numbers in `text`."""
+    decimals = DECIMAL_EVIDENCE_RE.findall(text)
+    groupings = GROUPING_EVIDENCE_RE.findall(text)
+    return decimals.count('.') + groupings.count(','), decimals.count(',') + groupings.count('.')
+
+
+def _decide(dot_votes: int, comma_votes: int, locale: Optional[str]) -> str:
+    if dot_votes != comma_votes:
+        return '.' if dot_votes > comma_votes else ','
+    return decimal_separator_for_locale(locale) or '.'
+
+
+def detect_decimal_separator(text: str, locale: Optional[str] = None) -> str:
+    """
+    Majority vote of the unambiguous numbers in `text`; the label locale breaks
+    ties, and '.' is the default.
+    """
+    return _decide(*_evidence_votes(text), locale)
+
+
+def detect_currency(text: str) -> Optional[str]:
+    counts = Counter(code for code in map(currency_code, CURRENCY_SCAN_RE.findall(text)) if code)
+    return counts.most_common(1)[0][0] if counts else None
+
+
+def detect_convention(text: str, locale: Optional[str] = None) -> AmountConvention:
+    """Detect once per document, then normalize every amount candidate with the result."""
+    return AmountConvention(detect_decimal_separator(text, locale), detect_currency(text))
+
+
+# Single tokens
+
+@lru_cache(maxsize=1024)
+def _affixes(prefix: str, suffix: str) -> Optional[Tuple[bool, Optional[str]]]:
+    """(negative, currency) of the text around a number, or None if it is not amount decoration."""
+    before = PREFIX_RE.fullmatch(prefix)
+    after = SUFFIX_RE.fullmatch(suffix)
+    if before is None or after is None:
+        return None
+    opening, pre, sign = before.groups()
+    post, closing = after.groups()
+    negative = bool(sign) or opening in NEGATIVE_SIGNS or closing in NEGATIVE_SIGNS or (opening, closing) == ('(', ')')
+    return negative, currency_code(pre or post)
+
+
+def _split_amount(token: str) -> Optional[Tuple[str, bool, Optional[str]]]:
+    """(number, negative, currency) of a decorated amount token."""
+    match = AMOUNT_SPLIT_RE.fullmatch(token)
+    if match is None:
+        return None
+    prefix, number, suffix = match.groups()
+    affixes = _affixes(prefix, suffix) if prefix or suffix else (False, None)
+    return (number,) + affixes if affixes is not None else None
+
+
+def _decimal_mark(number: str, decimal: str) -> Optional[str]:
+    """Which of . and , is the decimal mark of `number`, if any; `decimal` decides ambiguous cases."""
+    last_dot, last_comma = number.rfind('.'), number.rfind(',')
+    if last_dot >= 0 and last_comma >= 0:
+        return '.' if last_dot > last_comma else ','
+    if last_dot < 0 and last_comma < 0:
+        return None
+    mark, position = ('.', last_dot) if last_dot >= 0 else (',', last_comma)
+    if number.find(mark) != position:
+        return None
+    if len(number) - position != 4 or number[:position].translate(THOUSANDS_ONLY) == '0':
+        return mark
+    return mark if mark == decimal else None
+
+
+def _to_decimal(number: str, decimal: str) -> Optional[Decimal]:
+    try:
+        return Decimal(number.translate(DECIMAL_TABLES[_decimal_mark(number, decimal)]))
+    except InvalidOperation:
+        return None
+
+
+def normalize_amount(token: Optional[str], convention: Optional[AmountConvention] = None) -> Optional[Amount]:
+    convention = convention or DEFAULT_CONVENTION
+    token = token.strip() if token else ''
+    if not token:
+        return None
+    split = _split_amount(token)
+    if split is None:
+        return _normalize_with_price_parser(token, convention)
+    number, negative, currency = split
+    value = _to_decimal(number, convention.decimal)
+    if value is None:
+        return None
+    return Amount(-value if negative else value, currency or convention.currency)
+
+
+def _normalize_with_price_parser(token: str, convention: AmountConvention) -> Optional[Amount]:
+    """Amounts embedded in other text ("Total due: 1.234,56 EUR incl. VAT"): price_parser finds the number, we read it."""
+    try:
+        price = Price.fromstring(token)
+    except Exception:
+        return None
+    # Guard against recursing on text the token grammar cannot read either
+    if not price.amount_text or _split_amount(price.amount_text.strip()) is None:
+        return None
+    amount = normalize_amount(price.amount_text, convention)
+    return amount._replace(currency=currency_code(price.currency) or amount.currency) if amount else None
+
+
+# Batches
+
+class NumberMatrix(NamedTuple):
+    """
+    Bare numbers ("1.234,56", "1 200", "40.00") of a batch as a (numbers x chars)
+    code-point matrix, reduced column-wise to each number's decimal mark and the
+    batch's decimal-mark votes.
+    """
+    numbers: Sequence[str]
+    fits: np.ndarray         # non-empty and short enough for the matrix
+    mark: np.ndarray         # DOT_MARK / COMMA_MARK when the number itself settles its decimal mark
+    ambiguous: np.ndarray    # mark of "1,234"-style numbers that only the convention can settle
+    dot_count: np.ndarray
+    comma_count: np.ndarray
+    dot_votes: int
+    comma_votes: int
+
+    @classmethod
+    def scan(cls, numbers: Sequence[str]) -> 'NumberMatrix':
+        width = max(1, min(max(map(len, numbers), default=1), MAX_VECTOR_LENGTH))
+        chars = np.array([number if len(number) <= width else '' for number in numbers], dtype=f'U{width}')
+        codes = chars.view(np.uint32).reshape(len(numbers), width)
+
+        dot, comma = codes == 46, codes == 44
+        length = np.count_nonzero(codes, axis=1)
+        dot_count, comma_count = np.count_nonzero(dot, axis=1), np.count_nonzero(comma, axis=1)
+        has_dot, has_comma = dot_count > 0, comma_count > 0
+        last_dot = np.where(has_dot, width - 1 - dot[:, ::-1].argmax(axis=1), -1)
+        last_comma = np.where(has_comma, width - 1 - comma[:, ::-1].argmax(axis=1), -1)
+
+        # The later of two different separators is the decimal mark
+        both = has_dot & has_comma
+        mark = np.where(both, np.where(last_dot > last_comma, DOT_MARK, COMMA_MARK), NO_MARK)
+        # A lone separator settles itself unless exactly three digits follow a
+        # non-zero head ("1,234" vs "0,125"); repeated, it is grouping
+        single_dot = (dot_count == 1) & ~has_comma
+        single_comma = (comma_count == 1) & ~has_dot
+        position = np.maximum(last_dot, last_comma)
+        tail = length - position - 1
+        settled = (tail != 3) | ((codes[:, 0] == 48) & (position == 1))
+        mark = np.where(single_dot & settled, DOT_MARK, mark)
+        mark = np.where(single_comma & settled, COMMA_MARK, mark)
+        ambiguous = np.where(single_dot & ~settled, DOT_MARK, np.where(single_comma & ~settled, COMMA_MARK, NO_MARK))
+
+        # Votes mirror DECIMAL_EVIDENCE_RE and GROUPING_EVIDENCE_RE
+        fits = length > 0
+        short_tail = both | (tail <= 2)
+        dot_votes = int((fits & (((mark == DOT_MARK) & short_tail) | ((comma_count > 1) & ~has_dot))).sum())
+        comma_votes = int((fits & (((mark == COMMA_MARK) & short_tail) | ((dot_count > 1) & ~has_comma))).sum())
+
+        return cls(numbers, fits, mark, ambiguous, dot_count, comma_count, dot_votes, comma_votes)
+
+    def values(self, decimal: str) -> List[Optional[Decimal]]:
+        """
+        Values under `decimal`, from one translate of the joined batch. Numbers
+        whose own mark disagrees with the convention come back as None for the
+        per-token path.
+        """
+        preferred, other = (DOT_MARK, COMMA_MARK) if decimal == '.' else (COMMA_MARK, DOT_MARK)
+        preferred_count = self.dot_count if decimal == '.' else self.comma_count
+        resolved = np.where(self.mark != NO_MARK, self.mark, np.where(self.ambiguous == preferred, preferred, NO_MARK))
+        readable = self.fits & (resolved != other) & (preferred_count <= 1) & ((resolved == preferred) | (preferred_count == 0))
+        table = DOT_DECIMAL if decimal == '.' else COMMA_DECIMAL
+        translated = '\n'.join(self.numbers).translate(table).split('\n')
+        return [Decimal(text) if ok else None for text, ok in zip(translated, readable.tolist())]
+
+
+class AmountBatch(NamedTuple):
+    values: List[Optional[Decimal]]
+    currency: Optional[str]   # the batch's dominant currency
+    convention: AmountConvention
+
+
+def _split_batch(strings: List[str]) -> Tuple[List[str], List[int], List[int], Counter]:
+    """
+    Bare numbers of a batch of stripped tokens in one findall over the joined
+    batch, plus the indices of negative and of non amount-shaped tokens and the
+    currencies seen.
+    """
+    numbers, negative, unreadable, currencies = [], [], [], Counter()
+    # Tokens hold no line breaks (see normalize_amounts), so every line is one token
+    parts = BATCH_SPLIT_RE.findall('\n'.join(strings))
+    for idx, (prefix, number, suffix, other) in enumerate(parts):
+        if other or not number:
+            numbers.append('')
+            if other:
+                unreadable.append(idx)
+            continue
+        if number[-1] in NUMBER_TRAILER:
+            # The greedy number ran into trailing separators or spaces ("12,50 €")
+            trimmed = number.rstrip(NUMBER_TRAILER)
+            number, suffix = trimmed, number[len(trimmed):] + suffix
+        if prefix or suffix:
+            affixes = _affixes(prefix, suffix)
+            if affixes is None:
+                numbers.append('')
+                unreadable.append(idx)
+                continue
+            if affixes[0]:
+                negative.append(idx)
+            if affixes[1]:
+                currencies[affixes[1]] += 1
+        numbers.append(number)
+    return numbers, negative, unreadable, currencies
+
+
+def normalize_amounts(tokens: Sequence[Optional[str]], convention: Optional[AmountConvention] = None,
+                      locale: Optional[str] = None) -> AmountBatch:
+    """
+    Normalize a batch of amount strings in one pass. Without a `convention` it
+    is detected from the batch itself, so the tokens of one document settle
+    their decimal mark and currency together. Large batches are read
+    column-wise with NumPy.
+    """
+    strings = [token.strip().replace('\n', ' ') if token else '' for token in tokens]
+    if not strings:
+        return AmountBatch([], convention.currency if convention else None, convention or DEFAULT_CONVENTION)
+    numbers, negative, unreadable, currencies = _split_batch(strings)
+
+    matrix = NumberMatrix.scan(numbers) if len(numbers) >= VECTORIZE_MIN_TOKENS else None
+    if convention is None:
+        if matrix is not None:
+            dot_votes, comma_votes = matrix.dot_votes, matrix.comma_votes
+        else:
+            dot_votes, comma_votes = _evidence_votes(' '.join(numbers))
+        convention = AmountConvention(_decide(dot_votes, comma_votes, locale),
+                                      currencies.most_common(1)[0][0] if currencies else None)
+
+    if matrix is not None:
+        values = matrix.values(convention.decimal)
+        for idx, value in enumerate(values):
+            if value is None and numbers[idx]:
+                values[idx] = _to_decimal(numbers[idx], convention.decimal)
+    else:
+        values = [_to_decimal(number, convention.decimal) if number else None for number in numbers]
+    for idx in negative:
+        if values[idx] is not None:
+            values[idx] = -values[idx]
+    for idx in unreadable:
+        amount = _normalize_with_price_parser(strings[idx], convention)
+        values[idx] = amount.value if amount else None
+    return AmountBatch(values, convention.currency, convention)
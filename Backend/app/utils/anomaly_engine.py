@@ -0,0 +1,339 @@
+import re
+import math
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Sequence
+import numpy as np
+from app.config import settings
+from app.models import Invoice
+from app.utils.invoice_batch import InvoiceBatch
+from app.utils.state_store import StateStore, get_state_store
+
+logger = logging.getLogger(__name__)
+
+STATS_NAMESPACE = 'vendor_stats'
+METRICS = ('final_total', 'tax_ratio', 'item_count')
+METRIC_LABELS = {'final_total': 'Total', 'tax_ratio': 'Tax ratio', 'item_count': 'Number of line items'}
+
+SKETCH_ACCURACY = 0.01
+SKETCH_MAX_BINS = 512
+# Values at or below this go to the sketch's zero bin (zero items, credit notes)
+SKETCH_MIN_VALUE = 1e-9
+
+
+class RunningStats:
+    """Welford mean and variance: O(1) per value, mergeable with Chan's formula."""
+
+    __slots__ = ('count', 'mean', 'm2')
+
+    def __init__(self, count: int = 0, mean: float = 0.0, m2: float = 0.0):
+        self.count, self.mean, self.m2 = count, mean, m2
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def add_many(self, values: np.ndarray):
+        if not len(values):
+            return
+        mean = float(values.mean())
+        self.merge(RunningStats(len(values), mean, float(((values - mean) ** 2).sum())))
+
+    def merge(self, other: 'RunningStats'):
+        if not other.count:
+            return
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta * delta * self.count * other.count / total
+        self.mean += delta * other.count / total
+        self.count = total
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def to_list(self) -> List[float]:
+        return [self.count, self.mean, self.m2]
+
+
+class QuantileSketch:
+    """
+    Log-bucketed quantile sketch with relative accuracy SKETCH_ACCURACY: a
+    value x lands in bucket ceil(log_gamma(x)), so any quantile comes back
+    within 1% of the true value. Adding is O(1); past SKETCH_MAX_BINS buckets
+    the lowest ones are merged, which only blurs the low tail.
+    """
+
+    __slots__ = ('bins', 'zero', 'count')
+
+    gamma = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+    log_gamma = math.log(gamma)
+
+    def __init__(self, bins: Optional[Dict[int, int]] = None, zero: int = 0):
+        self.bins: Dict[int, int] = dict(bins or {})
+        self.zero = zero
+        self.count = zero + sum(self.bins.values())
+
+    def add(self, value: float):
+        self.count += 1
+        if value <= SKETCH_MIN_VALUE:
+            self.zero += 1
+            return
+        key = math.ceil(math.log(value) / self.log_gamma)
+        self.bins[key] = self.bins.get(key, 0) + 1
+        self._collapse()
+
+    def add_many(self, values: np.ndarray):
+        if not len(values):
+            return
+        positive = values[values > SKETCH_MIN_VALUE]
+        self.zero += len(values) - len(positive)
+        self.count += len(values)
+        keys, counts = np.unique(np.ceil(np.log(positive) / self.log_gamma).astype(np.int64), return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            self.bins[key] = self.bins.get(key, 0) + count
+        self._collapse()
+
+    def merge(self, other: 'QuantileSketch'):
+        self.zero += other.zero
+        self.count += other.count
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        self._collapse()
+
+    def _collapse(self):
+        if len(self.bins) <= SKETCH_MAX_BINS:
+            return
+        keys = sorted(self.bins)
+        overflow = keys[:len(keys) - SKETCH_MAX_BINS + 1]
+        self.bins[overflow[-1]] = sum(self.bins.pop(key) for key in overflow[:-1]) + self.bins[overflow[-1]]
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if rank < seen:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+    def to_dict(self) -> Dict:
+        return {'bins': {str(key): count for key, count in self.bins.items()}, 'zero': self.zero}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'QuantileSketch':
+        return cls({int(key): count for key, count in data.get('bins', {}).items()}, data.get('zero', 0))
+
+
+@dataclass
+class MetricProfile:
+    stats: RunningStats = field(default_factory=RunningStats)
+    sketch: QuantileSketch = field(default_factory=QuantileSketch)
+
+    def add_many(self, values: np.ndarray):
+        self.stats.add_many(values)
+        self.sketch.add_many(values)
+
+    def merge(self, other: 'MetricProfile'):
+        self.stats.merge(other.stats)
+        self.sketch.merge(other.sketch)
+
+    def outlier(self, value: float) -> Optional[str]:
+        """
+        Why `value` is an outlier, or None. It has to be both far from the mean
+        (|z| above ANOMALY_Z_THRESHOLD) and outside the central quantile range,
+        so skewed distributions do not flag their own long tail.
+        """
+        if self.stats.count < settings.ANOMALY_MIN_SAMPLES or self.stats.std == 0:
+            return None
+        z = (value - self.stats.mean) / self.stats.std
+        if abs(z) <= settings.ANOMALY_Z_THRESHOLD:
+            return None
+        tail = settings.ANOMALY_QUANTILE
+        if z > 0:
+            bound = self.sketch.quantile(tail)
+            return f"above the vendor's {tail:.0%} quantile {bound:,.2f} (z={z:.1f})" if value > bound else None
+        bound = self.sketch.quantile(1 - tail)
+        return f"below the vendor's {1 - tail:.0%} quantile {bound:,.2f} (z={z:.1f})" if value < bound else None
+
+    def to_dict(self) -> Dict:
+        return {'stats': self.stats.to_list(), 'sketch': self.sketch.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'MetricProfile':
+        return cls(RunningStats(*data['stats']), QuantileSketch.from_dict(data['sketch']))
+
+
+@dataclass
+class VendorProfile:
+    metrics: Dict[str, MetricProfile] = field(default_factory=lambda: {metric: MetricProfile() for metric in METRICS})
+
+    @property
+    def samples(self) -> int:
+        return self.metrics['item_count'].stats.count
+
+    def merge(self, other: 'VendorProfile'):
+        for metric, profile in other.metrics.items():
+            self.metrics[metric].merge(profile)
+
+    def to_dict(self) -> Dict:
+        return {metric: profile.to_dict() for metric, profile in self.metrics.items()}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'VendorProfile':
+        profile = cls()
+        for metric, metric_data in data.items():
+            if metric in profile.metrics:
+                profile.metrics[metric] = MetricProfile.from_dict(metric_data)
+        return profile
+
+
+class StatisticalFlags(NamedTuple):
+    flags: List[List[str]]
+    # Rows whose vendor had enough history to be judged statistically
+    profiled: np.ndarray
+
+
+@lru_cache(maxsize=4096)
+def vendor_key(name: Optional[str]) -> Optional[str]:
+    key = re.sub(r'[^a-z0-9]+', ' ', (name or '').lower()).strip()
+    return key or None
+
+
+def _metric_columns(batch: InvoiceBatch) -> Dict[str, np.ndarray]:
+    grand_total, taxes = batch.amounts['grand_total'], batch.amounts['taxes']
+    final_total = np.where(np.isnan(batch.amounts['final_total']), grand_total + taxes, batch.amounts['final_total'])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tax_ratio = np.where(grand_total > 0, taxes / grand_total, np.nan)
+    return {'final_total': final_total, 'tax_ratio': tax_ratio, 'item_count': batch.item_count.astype(np.float64)}
+
+
+class AnomalyEngine:
+    """
+    Rolling per-(project, vendor) statistics over totals, tax ratio and item
+    count, and outlier flags against them.
+
+    Every profile keeps Welford mean/variance and a quantile sketch per metric,
+    a few hundred bytes of JSON in the state store. flag_batch scores a whole
+    batch against the statistics as they stand; register folds a batch in
+    once its results are saved, so a failed or repeated run never counts its
+    invoices twice. observe does both for one invoice at a time (streaming).
+
+    Nothing is cached between calls: profiles are read for each batch, and
+    register merges the batch's statistics into the stored ones (Chan's
+    combine) inside one state store transaction, so workers updating the
+    same vendor never overwrite each other's counts.
+    """
+
+    def __init__(self, state_store: Optional[StateStore] = None):
+        self._state_store = state_store
+
+    @property
+    def state_store(self) -> StateStore:
+        if self._state_store is None:
+            self._state_store = get_state_store()
+        return self._state_store
+
+    @staticmethod
+    def profile_key(project_id: Optional[int], vendor: str) -> str:
+        return f"{project_id or 0}:{vendor}"
+
+    @staticmethod
+    def _load(key: str, data: Optional[Dict]) -> VendorProfile:
+        try:
+            return VendorProfile.from_dict(data) if data else VendorProfile()
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Discarding unreadable vendor statistics {key}: {str(e)}")
+            return VendorProfile()
+
+    def profile(self, key: str) -> VendorProfile:
+        return self._load(key, self.state_store.get(STATS_NAMESPACE, key))
+
+    def _groups(self, batch: InvoiceBatch, project_id: Optional[int]) -> Dict[str, List[int]]:
+        groups: Dict[str, List[int]] = defaultdict(list)
+        for row, name in enumerate(batch.vendor_name.tolist()):
+            key = vendor_key(name)
+            if key:
+                groups[self.profile_key(project_id, key)].append(row)
+        return groups
+
+    def _score(self, profile: VendorProfile, values: Dict[str, float]) -> List[str]:
+        flags = []
+        for metric in METRICS:
+            value = values[metric]
+            if math.isnan(value):
+                continue
+            reason = profile.metrics[metric].outlier(value)
+            if reason:
+                flags.append(f"{METRIC_LABELS[metric]} {value:,.2f} is {reason}")
+        return flags
+
+    def flag_batch(self, batch: InvoiceBatch, project_id: Optional[int] = None, update: bool = False) -> StatisticalFlags:
+        """Flags against the stored statistics; update=True also folds the batch in, as register does."""
+        flags: List[List[str]] = [[] for _ in range(len(batch))]
+        profiled = np.zeros(len(batch), dtype=bool)
+        groups = self._groups(batch, project_id)
+        if not groups:
+            return StatisticalFlags(flags, profiled)
+
+        columns = _metric_columns(batch)
+        stored = self.state_store.get_many(STATS_NAMESPACE, list(groups))
+        for key, rows in groups.items():
+            profile = self._load(key, stored.get(key))
+            if profile.samples >= settings.ANOMALY_MIN_SAMPLES:
+                profiled[rows] = True
+                for row in rows:
+                    flags[row] = self._score(profile, {metric: float(columns[metric][row]) for metric in METRICS})
+        if update:
+            self.register(batch, project_id)
+        return StatisticalFlags(flags, profiled)
+
+    def register(self, batch: InvoiceBatch, project_id: Optional[int] = None, rows: Optional[Sequence[int]] = None):
+        """Fold a batch whose results were saved into its vendors' statistics (only `rows`, when given)."""
+        groups = self._groups(batch, project_id)
+        if rows is not None:
+            included = set(rows)
+            groups = {key: [row for row in group if row in included] for key, group in groups.items()}
+            groups = {key: group for key, group in groups.items() if group}
+        if not groups:
+            return
+        columns = _metric_columns(batch)
+        deltas = {}
+        for key, rows in groups.items():
+            delta = deltas[key] = VendorProfile()
+            for metric in METRICS:
+                values = columns[metric][np.asarray(rows)]
+                delta.metrics[metric].add_many(values[~np.isnan(values)])
+
+        def merge(stored: Dict[str, Dict]) -> Dict[str, Dict]:
+            merged = {}
+            for key, delta in deltas.items():
+                profile = self._load(key, stored.get(key))
+                profile.merge(delta)
+                merged[key] = profile.to_dict()
+            return merged
+
+        self.state_store.update_many(STATS_NAMESPACE, list(deltas), merge)
+
+    def observe(self, invoice: Invoice, project_id: Optional[int] = None) -> List[str]:
+        """Streaming mode: flag one invoice against its vendor's statistics, then fold it in."""
+        result = self.flag_batch(InvoiceBatch([invoice]), project_id, update=True)
+        return result.flags[0]
+
+    def forget(self, project_id: Optional[int], vendor: str):
+        self.state_store.delete(STATS_NAMESPACE, self.profile_key(project_id, vendor_key(vendor) or ''))
+
+    def forget_project(self, project_id: int):
+        """Drop a deleted project's vendor statistics."""
+        self.state_store.delete_prefix(STATS_NAMESPACE, self.profile_key(project_id, ''))
+
+
+anomaly_engine = AnomalyEngine()
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+from app.config import settings
+from app.models import Invoice, Vendor, Address
+from app.utils.spatial_index import boxes_to_array
+
+logger = logging.getLogger(__name__)
+
+# Only what layout extraction reads; protos and image bytes stay in the parent
+COMPACT_PAGE_KEYS = ('filename', 'text', 'words', 'tables', 'key_value_pairs', 'num_pages', 'is_multipage')
+
+
+def compact_page(ocr_result: Dict) -> Dict:
+    """Picklable page payload: text, words and an (n, 4) float32 box array."""
+    page = {key: ocr_result[key] for key in COMPACT_PAGE_KEYS if key in ocr_result}
+    boxes = ocr_result.get('box_array')
+    if boxes is None:
+        boxes = ocr_result.get('boxes') or []
+    page['box_array'] = boxes_to_array(boxes)
+    if ocr_result.get('is_multipage'):
+        page['pages'] = [compact_page(sub_page) for sub_page in ocr_result.get('pages', [])]
+    return page
+
+
+def _empty_invoice(filename: str) -> Invoice:
+    return Invoice(filename=filename or 'unknown', vendor=Vendor(address=Address()))
+
+
+# Worker side
+
+_worker_extractor = None
+
+
+def _init_worker():
+    global _worker_extractor
+    from app.utils.data_extractor import DataExtractor
+    _worker_extractor = DataExtractor()
+
+
+async def _extract_pages(pages: List[Dict]) -> List[Invoice]:
+    results = []
+    for page in pages:
+        try:
+            results.append(await _worker_extractor.extract_invoice_data(page))
+        except Exception as e:
+            logger.error(f"Error extracting {page.get('filename', '')} in worker: {str(e)}")
+            results.append(_empty_invoice(page.get('filename', '')))
+    return results
+
+
+def _extract_chunk(pages: List[Dict]) -> List[Invoice]:
+    return asyncio.run(_extract_pages(pages))
+
+
+class BatchExtractor:
+    """
+    Layout extraction for many pages on a process pool.
+
+    Regex, NumPy and parsing work is CPU-bound and holds the GIL, so it runs in
+    worker processes instead of on the event loop. Pages are shipped as compact
+    payloads in chunks (one pickle round trip per chunk) and come back as
+    Invoices in input order; unpickling a model does not re-validate it. With EXTRACTION_PROCESSES = 0 extraction runs
+    inline, as before.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, chunk_size: Optional[int] = None):
+        self.max_workers = settings.EXTRACTION_PROCESSES if max_workers is None else max_workers
+        self.chunk_size = max(chunk_size or settings.EXTRACTION_CHUNK_SIZE, 1)
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: forked children would inherit the parent's thread pools without their threads
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+            )
+        return self._pool
+
+    async def extract(self, ocr_results: List[Dict]) -> List[Invoice]:
+        if not ocr_results:
+            return []
+        if self.max_workers <= 0:
+            from app.utils.data_extractor import data_extractor
+            return [await data_extractor.extract_invoice_data(result) for result in ocr_results]
+
+        pages = [compact_page(result) for result in ocr_results]
+        # Enough chunks to keep every worker busy, but never more than chunk_size pages each
+        chunk_size = min(self.chunk_size, max(-(-len(pages) // self.max_workers), 1))
+        chunks = [pages[start:start + chunk_size] for start in range(0, len(pages), chunk_size)]
+
+        loop = asyncio.get_event_loop()
+        chunk_results = await asyncio.gather(
+            *[loop.run_in_executor(self.pool, _extract_chunk, chunk) for chunk in chunks],
+            return_exceptions=True
+        )
+
+        results = []
+        for chunk, chunk_result in zip(chunks, chunk_results):
+            if isinstance(chunk_result, Exception):
+                logger.error(f"Extraction chunk of {len(chunk)} pages failed: {str(chunk_result)}")
+                results.extend(_empty_invoice(page.get('filename', '')) for page in chunk)
+            else:
+                results.extend(chunk_result)
+        return results
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+
+batch_extractor = BatchExtractor()
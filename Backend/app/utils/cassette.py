@@ -0,0 +1,223 @@
+import os
+import time
+import zlib
+import random
+import hashlib
+import sqlite3
+import threading
+import logging
+from typing import Any, Callable, Dict, Optional, Tuple
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_MODES = ('off', 'record', 'replay')
+
+
+class CassetteMissError(KeyError):
+    pass
+
+
+def vision_request_key(image, **kwargs) -> bytes:
+    return image.content
+
+
+def docai_request_key(request=None, **kwargs) -> bytes:
+    # By content, not processor name, so a cassette works against any processor
+    return request.raw_document.mime_type.encode('utf-8') + b'\0' + request.raw_document.content
+
+
+def _vision_response():
+    from google.cloud import vision
+    return vision.AnnotateImageResponse
+
+
+def _docai_response():
+    from google.cloud import documentai_v1 as documentai
+    return documentai.ProcessResponse
+
+
+# service -> method -> (request key, response message type)
+SERVICES: Dict[str, Dict[str, Tuple[Callable[..., bytes], Callable[[], Any]]]] = {
+    'vision': {'document_text_detection': (vision_request_key, _vision_response)},
+    'docai': {'process_document': (docai_request_key, _docai_response)},
+}
+
+
+class Cassette:
+    """
+    Recorded Google API responses in one SQLite file: the serialized
+    protobuf of each response, zlib-compressed, keyed by service and the
+    SHA-256 of the request content, with the latency it was recorded at.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or settings.GOOGLE_CASSETTE_PATH
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "service TEXT NOT NULL, key TEXT NOT NULL, response BLOB NOT NULL, latency REAL NOT NULL, "
+            "PRIMARY KEY (service, key))"
+        )
+
+    @staticmethod
+    def key(content: bytes) -> str:
+        return hashlib.sha256(content).hexdigest()
+
+    def get(self, service: str, key: str) -> Optional[Tuple[bytes, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, latency FROM responses WHERE service = ? AND key = ?", (service, key)
+            ).fetchone()
+        return (zlib.decompress(row[0]), row[1]) if row else None
+
+    def put(self, service: str, key: str, response: bytes, latency: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (service, key, response, latency) VALUES (?, ?, ?, ?)",
+                (service, key, zlib.compress(response, 9), latency)
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class LatencyModel:
+    """
+    Synthetic latency of a replayed call, from a spec:
+
+        recorded                 as long as the live call took (the default)
+        constant:S               S seconds
+        uniform:LOW,HIGH         uniform between LOW and HIGH seconds
+        lognormal:MEDIAN,SIGMA   lognormal around MEDIAN seconds, the usual shape of API latency
+        none                     no delay
+
+    Draws come from a seeded generator, so a replay is reproducible.
+    """
+
+    def __init__(self, spec: str = 'recorded', seed: int = 0):
+        self.spec = spec
+        self.kind, _, args = spec.partition(':')
+        self.args = [float(arg) for arg in args.split(',') if arg]
+        expected = {'recorded': 0, 'none': 0, 'constant': 1, 'uniform': 2, 'lognormal': 2}
+        if expected.get(self.kind) != len(self.args):
+            raise ValueError(f"Invalid latency spec: {spec}")
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self, recorded: float) -> float:
+        with self._lock:
+            if self.kind == 'recorded':
+                return recorded
+            if self.kind == 'constant':
+                return self.args[0]
+            if self.kind == 'uniform':
+                return self._random.uniform(*self.args)
+            if self.kind == 'lognormal':
+                median, sigma = self.args
+                return median * self._random.lognormvariate(0, sigma)
+            return 0.0
+
+    def fails(self, error_rate: float) -> bool:
+        with self._lock:
+            return error_rate > 0 and self._random.random() < error_rate
+
+
+class CassetteClient:
+    """
+    Stands in for a Google API client with the same blocking methods.
+
+    record: calls the live client and stores each response in the cassette.
+    replay: answers from the cassette after a synthetic latency, without
+    creating a live client, so no credentials or network are needed. A
+    request that was never recorded raises CassetteMissError; error_rate
+    fails that share of calls with ServiceUnavailable, as a degraded API
+    would, to exercise retries and fallbacks.
+    """
+
+    def __init__(self, service: str, factory: Callable[[], Any], cassette: Cassette, mode: str,
+                 latency: Optional[LatencyModel] = None, error_rate: float = 0.0):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"Invalid cassette mode: {mode}")
+        self.service = service
+        self.cassette = cassette
+        self.mode = mode
+        self.latency = latency or LatencyModel()
+        self.error_rate = error_rate
+        self._factory = factory
+        self._live = None
+        self._lock = threading.Lock()
+
+    @property
+    def live(self):
+        with self._lock:
+            if self._live is None:
+                self._live = self._factory()
+        return self._live
+
+    def __getattr__(self, method: str):
+        if method.startswith('_') or method not in SERVICES[self.service]:
+            raise AttributeError(method)
+        request_key, response_type = SERVICES[self.service][method]
+
+        def call(*args, **kwargs):
+            key = Cassette.key(request_key(*args, **kwargs))
+            if self.mode == 'record':
+                return self._record(method, key, response_type(), *args, **kwargs)
+            return self._replay(key, response_type())
+        return call
+
+    def _record(self, method: str, key: str, response_type, *args, **kwargs):
+        started = time.perf_counter()
+        response = getattr(self.live, method)(*args, **kwargs)
+        self.cassette.put(self.service, key, response_type.serialize(response), time.perf_counter() - started)
+        return response
+
+    def _replay(self, key: str, response_type):
+        entry = self.cassette.get(self.service, key)
+        if entry is None:
+            raise CassetteMissError(f"No recorded {self.service} response for request {key[:12]}")
+        response, recorded = entry
+        # Blocking, like the real client, so replayed calls hold their executor thread as long
+        time.sleep(self.latency.draw(recorded))
+        if self.latency.fails(self.error_rate):
+            from google.api_core.exceptions import ServiceUnavailable
+            raise ServiceUnavailable(f"Injected {self.service} failure")
+        return response_type.deserialize(response)
+
+
+_cassette: Optional[Cassette] = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette() -> Cassette:
+    global _cassette
+    with _cassette_lock:
+        if _cassette is None:
+            _cassette = Cassette()
+        return _cassette
+
+
+def google_client(service: str, factory: Callable[[], Any]):
+    """
+    The client a Google service is called through: the live one from
+    factory(), or a CassetteClient over it when GOOGLE_CASSETTE_MODE is
+    record or replay.
+    """
+    mode = settings.GOOGLE_CASSETTE_MODE
+    if mode not in CASSETTE_MODES:
+        raise ValueError(f"Invalid cassette mode: {mode}")
+    if mode == 'off':
+        return factory()
+    logger.info(f"{service} calls {'recorded to' if mode == 'record' else 'replayed from'} {settings.GOOGLE_CASSETTE_PATH}")
+    latency = LatencyModel(settings.GOOGLE_REPLAY_LATENCY, settings.GOOGLE_REPLAY_SEED)
+    return CassetteClient(service, factory, get_cassette(), mode, latency, settings.GOOGLE_REPLAY_ERROR_RATE)
@@ -7,29 +7,58 @@ from decimal import Decimal, InvalidOperation
 import logging
 from google.cloud import vision
 from app.models import Invoice, Vendor, Address, InvoiceItem
+from app.utils.docai_adapter import DocAIFields, DocAIField
+from app.utils.date_engine import scan_dates, fallback_windows, parse_date_string
+from app.utils.parsing_service import parsing_service
+from app.utils.amount_engine import AmountConvention, detect_convention, normalize_amounts
+from app.utils.spatial_index import SpatialIndex, is_amount_token, is_identifier_token
+from app.utils.table_engine import reconstruct_table
+from app.utils.template_store import template_store, VendorFingerprint, same_vendor
+from app.utils.label_automaton import LabelTable, scan_labels
+from app.utils.extraction_cache import ExtractionCache
+from app.utils.batch_extraction import batch_extractor
 from app.config import settings
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
-import dateparser
-from price_parser import Price
 import time
 from tenacity import retry, stop_after_attempt, wait_exponential
 import aioredis
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
+# Label-table fields (see label_automaton.LANGUAGE_PACKS) read by each extractor
+TOTALS_FIELDS = (('subtotal', 'grand_total'), ('tax', 'taxes'), ('total', 'final_total'))
+HEADER_FIELDS = (('header_description', 'description'), ('header_quantity', 'quantity'),
+                 ('header_unit_price', 'unit_price'), ('header_total', 'total'))
+TABLE_STOP_FIELDS = ('subtotal', 'tax', 'total')
+DOCAI_TOTALS_FIELDS = (('net_amount', 'grand_total'), ('total_tax_amount', 'taxes'), ('total_amount', 'final_total'))
+# Value text right after a label found in the flat page text
+IDENTIFIER_AFTER_LABEL_RE = re.compile(r'[\s:#.\-°º№]*([A-Za-z0-9][A-Za-z0-9\-/]{4,})')
+AMOUNT_AFTER_LABEL_RE = re.compile(
+    r'[\s:]*(?:\(?\d+(?:[.,]\d+)?\s*%\)?[\s:]*)?(?:[A-Z]{3}\s?)?[^\w\s]{0,3}\s?'
+    r'(-?(?:\d{1,3}(?:[ \u00a0\u202f]\d{3})+(?:[.,]\d+)?|\d(?:[\d,.]*\d)?))(?![\d,.]|\s*%)'
+)
+INVOICE_TITLE_RE = re.compile(r'(?i)^\s*(tax\s+)?invoice\b')
+
 class DataExtractor:
     def __init__(self):
         self.executor = ThreadPoolExecutor(max_workers=settings.MAX_WORKERS)
         self.redis = None
+        self.cache = ExtractionCache()
 
     async def initialize(self):
         self.redis = await aioredis.from_url(settings.REDIS_URL)
+        self.cache.redis = self.redis
+        try:
+            template_store.load()
+        except Exception as e:
+            logger.error(f"Could not load vendor templates: {str(e)}")
     
     async def extract_data(self, ocr_results: List[Dict]) -> List[Invoice]:
         try:
             start_time = time.time()
-            results = await asyncio.gather(*[self._extract_single_result(result) for result in ocr_results])
+            results = await self.extract_batch(ocr_results)
             end_time = time.time()
             logger.info(f"Extracted data for {len(ocr_results)} documents in {end_time - start_time:.2f} seconds")
             return results
@@ -37,253 +66,88 @@ class DataExtractor:
             logger.error(f"Error extracting data: {str(e)}")
             return [Invoice(filename=result.get("filename", "")) for result in ocr_results]
     
-    async def _extract_date(self, text: str, entities: Optional[List[str]] = None) -> Optional[date]:
+    async def extract_batch(self, ocr_results: List[Dict]) -> List[Invoice]:
+        """Invoices for many pages; cache misses are extracted on the process pool in chunks."""
+        cached = [await self.get_cached_invoice(result) for result in ocr_results]
+        misses = [idx for idx, invoice in enumerate(cached) if invoice is None]
+        extracted = await batch_extractor.extract([ocr_results[idx] for idx in misses])
+        
+        results = list(cached)
+        for idx, invoice in zip(misses, extracted):
+            results[idx] = invoice
+            await self.cache_invoice(ocr_results[idx], invoice)
+        return results
+    
+    async def _extract_date(self, text: str, entities: Optional[List[str]] = None,
+                            labels: Optional[LabelTable] = None) -> Optional[date]:
         if entities:
             entity_date = await self._extract_date_from_entities(entities)
             if entity_date:
                 return entity_date
         
-        date_patterns = [
-            r'\b(\d{1,2}[/\.-]\d{1,2}[/\.-]\d{2,4})\b',
-            r'\b(\d{4}[/\.-]\d{1,2}[/\.-]\d{1,2})\b',
-            r'\b(\d{8})\b',
-            r'\b(\d{1,2}\s+[A-Za-z]{3,9}\.?\s+\d{2,4})\b',
-            r'\b([A-Za-z]{3,9}\.?\s+\d{1,2},?\s+\d{2,4})\b',
-            r'\b([A-Za-z]{3}\.?\s+[A-Za-z]{3}\.?\s+\d{2,4})\b',
-            r'\b(\d{1,2}\.\d{1,2}\.\d{2,4})\b',
-            r'\b(\d{1,2}-\d{1,2}-\d{2,4})\b',
-            r'\b(\d{1,2}\s+\d{1,2}\s+\d{2,4})\b',
-            r'\b(\d{4}\d{2}\d{2})\b',
-            r'\b(\d{2}\d{2}\d{4})\b'
-        ]
-        
-        date_keywords = [
-            'date', 'invoice date', 'issue date', 'dated', 'invoice', 
-            'issued', 'due date', 'billing date', 'transaction date',
-            'document date', 'statement date', 'posting date'
-        ]
-        
-        for keyword in date_keywords:
-            keyword_pattern = rf'(?i){re.escape(keyword)}[:\s]*(.{{0,50}})'
-            keyword_matches = re.finditer(keyword_pattern, text)
-            
-            for match in keyword_matches:
-                nearby_text = match.group(1)
-                
-                for pattern in date_patterns:
-                    date_matches = re.finditer(pattern, nearby_text)
-                    for date_match in date_matches:
-                        date_str = date_match.group(0)
-                        
-                        for date_order in ['DMY', 'MDY', 'YMD']:
-                            try:
-                                parsed_date = await asyncio.to_thread(
-                                    dateparser.parse,
-                                    date_str,
-                                    settings={
-                                        'DATE_ORDER': date_order,
-                                        'PREFER_DAY_OF_MONTH': 'first',
-                                        'RELATIVE_BASE': datetime.now(),
-                                        'PREFER_DATES_FROM': 'past'
-                                    }
-                                )
-                                if parsed_date:
-                                    return parsed_date.date()
-                            except Exception:
-                                pass
-        
-        for pattern in date_patterns:
-            matches = re.finditer(pattern, text)
-            for match in matches:
-                date_str = match.group(0)
-                
-                for date_order in ['DMY', 'MDY', 'YMD']:
-                    try:
-                        parsed_date = await asyncio.to_thread(
-                            dateparser.parse,
-                            date_str,
-                            settings={
-                                'DATE_ORDER': date_order,
-                                'PREFER_DAY_OF_MONTH': 'first',
-                                'RELATIVE_BASE': datetime.now(),
-                                'PREFER_DATES_FROM': 'current_period'
-                            }
-                        )
-                        if parsed_date:
-                            return parsed_date.date()
-                    except Exception:
-                        pass
-        
-        special_date_formats = [
-            r'(\d{4})(\d{2})(\d{2})',
-            r'(\d{2})(\d{2})(\d{4})'
-        ]
-        
-        for pattern in special_date_formats:
-            matches = re.finditer(pattern, text)
-            for match in matches:
-                if pattern == r'(\d{4})(\d{2})(\d{2})':
-                    year, month, day = match.groups()
-                    try:
-                        return date(int(year), int(month), int(day))
-                    except ValueError:
-                        pass
-                else:
-                    first, second, year = match.groups()
-                    try:
-                        return date(int(year), int(second), int(first))
-                    except ValueError:
-                        try:
-                            return date(int(year), int(first), int(second))
-                        except ValueError:
-                            pass
-        
-        month_abbr = {'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6, 
-                      'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12}
-        
-        for month_name, month_num in month_abbr.items():
-            pattern = rf'(?i){month_name}\S*\.?\s+(\d{{1,2}})\S*\.?\s+(\d{{4}})'
-            matches = re.finditer(pattern, text)
-            for match in matches:
-                day, year = match.groups()
-                try:
-                    return date(int(year), month_num, int(day))
-                except ValueError:
-                    pass
-            
-            pattern = rf'(?i)(\d{{1,2}})\S*\.?\s+{month_name}\S*\.?\s+(\d{{4}})'
-            matches = re.finditer(pattern, text)
-            for match in matches:
-                day, year = match.groups()
-                try:
-                    return date(int(year), month_num, int(day))
-                except ValueError:
-                    pass
-        
-        dot_date_pattern = r'\b(\d{1,2})\.(\d{1,2})\.(\d{2})\b'
-        dot_matches = re.findall(dot_date_pattern, text)
-        for match in dot_matches:
-            if len(match) == 3:
-                day, month, year_short = match
-                current_year = datetime.now().year
-                century = current_year // 100
-                year = int(f"{century}{year_short}")
-                if year > current_year + 20:
-                    year = int(f"{century-1}{year_short}")
-                try:
-                    return date(year, int(month), int(day))
-                except ValueError:
-                    try:
-                        return date(year, int(day), int(month))
-                    except ValueError:
-                        pass
+        # One compiled pass over the text; candidates come back scored by label proximity
+        candidates, keyword_hits = scan_dates(text, labels)
+        if candidates:
+            return candidates[0].value
         
+        # dateparser only ever sees a few short windows after date labels, in a single thread hop
+        windows = fallback_windows(text, keyword_hits)
+        if not windows:
+            return None
         try:
-            parsed_date = await asyncio.to_thread(
-                dateparser.parse,
-                text,
-                settings={
-                    'RELATIVE_BASE': datetime.now()
-                }
-            )
-            if parsed_date:
-                return parsed_date.date()
-        except Exception:
-            pass
-            
-        return None
+            parsed_dates = await parsing_service.parse_dates_async(windows)
+            return next((parsed_date for parsed_date in parsed_dates if parsed_date), None)
+        except Exception as e:
+            logger.warning(f"dateparser fallback failed: {str(e)}")
+            return None
     
     async def _extract_date_from_entities(self, entities: List[str]) -> Optional[date]:
         for entity in entities:
             if entity.startswith('invoice_date:') or entity.startswith('date:'):
                 date_str = entity.split(':', 1)[1].strip()
                 
-                # Direct handling for DD/MM/YYYY format
-                if re.match(r'^\d{1,2}/\d{1,2}/\d{4}$', date_str):
-                    try:
-                        day, month, year = date_str.split('/')
-                        return date(int(year), int(month), int(day))
-                    except (ValueError, IndexError):
-                        pass
-                
-                # Direct handling for DD-MM-YYYY format
-                if re.match(r'^\d{1,2}-\d{1,2}-\d{4}$', date_str):
-                    try:
-                        day, month, year = date_str.split('-')
-                        return date(int(year), int(month), int(day))
-                    except (ValueError, IndexError):
-                        pass
-                
-                # Direct handling for YYYY-MM-DD format
-                if re.match(r'^\d{4}-\d{1,2}-\d{1,2}$', date_str):
-                    try:
-                        year, month, day = date_str.split('-')
-                        return date(int(year), int(month), int(day))
-                    except (ValueError, IndexError):
-                        pass
-                
-                for date_order in ['DMY', 'MDY', 'YMD']:
-                    try:
-                        parsed_date = await asyncio.to_thread(
-                            dateparser.parse,
-                            date_str,
-                            settings={
-                                'DATE_ORDER': date_order,
-                                'PREFER_DAY_OF_MONTH': 'first',
-                                'RELATIVE_BASE': datetime.now(),
-                                'PREFER_DATES_FROM': 'past'
-                            }
-                        )
-                        if parsed_date:
-                            return parsed_date.date()
-                    except Exception:
-                        pass
-                
-                dot_date_pattern = r'\b(\d{1,2})\.(\d{1,2})\.(\d{2})\b'
-                dot_matches = re.findall(dot_date_pattern, date_str)
-                for match in dot_matches:
-                    if len(match) == 3:
-                        day, month, year_short = match
-                        current_year = datetime.now().year
-                        century = current_year // 100
-                        year = int(f"{century}{year_short}")
-                        if year > current_year + 20:
-                            year = int(f"{century-1}{year_short}")
-                        try:
-                            return date(year, int(month), int(day))
-                        except ValueError:
-                            try:
-                                return date(year, int(day), int(month))
-                            except ValueError:
-                                pass
+                try:
+                    parsed_date = (await parsing_service.parse_dates_async([date_str]))[0]
+                    if parsed_date:
+                        return parsed_date
+                except Exception:
+                    pass
         return None    
     
     async def _extract_single_result(self, ocr_result: Dict) -> Invoice:
         try:
-            # Disable cache lookup temporarily to force reprocessing
-            # cache_key = f"extracted:{hash(str(ocr_result))}"
-            # if self.redis:
-            #     cached_result = await self.redis.get(cache_key)
-            #     if cached_result:
-            #         logger.info(f"Cache hit for {ocr_result.get('filename', '')}")
-            #         return Invoice.parse_raw(cached_result)
-
-            # Process the document regardless of cache status
+            cached_invoice = await self.get_cached_invoice(ocr_result)
+            if cached_invoice is not None:
+                logger.info(f"Cache hit for {ocr_result.get('filename', '')}")
+                return cached_invoice
+
             start_time = time.time()
             invoice = await self.extract_invoice_data(ocr_result)
             end_time = time.time()
             logger.info(f"Extracted data for {ocr_result.get('filename', '')} in {end_time - start_time:.2f} seconds")
 
-            # Disable cache storage temporarily
-            # if self.redis:
-            #     await self.redis.set(cache_key, invoice.json(), expire=86400)
-            
+            await self.cache_invoice(ocr_result, invoice)
             return invoice
         except Exception as e:
             logger.error(f"Error extracting data for {ocr_result.get('filename', '')}: {str(e)}")
             return Invoice(filename=ocr_result.get("filename", ""))    
+
+    async def get_cached_invoice(self, ocr_result: Dict) -> Optional[Invoice]:
+        try:
+            return await self.cache.get(ocr_result)
+        except Exception as e:
+            logger.warning(f"Extraction cache lookup failed for {ocr_result.get('filename', '')}: {str(e)}")
+            return None
+
+    async def cache_invoice(self, ocr_result: Dict, invoice: Invoice):
+        try:
+            await self.cache.put(ocr_result, invoice)
+        except Exception as e:
+            logger.warning(f"Could not cache extraction for {ocr_result.get('filename', '')}: {str(e)}")
     
-    async def extract_invoice_data(self, ocr_result: Dict, docai_result: Optional[Dict] = None) -> Invoice:
+    async def extract_invoice_data(self, ocr_result: Dict, docai_result: Optional[Dict] = None,
+                                   fallback: Optional[Invoice] = None) -> Invoice:
+        """`fallback` is an already extracted layout result, used instead of re-running GCV extraction."""
         filename = ocr_result.get('filename', '')
         
         if docai_result and 'entities' in docai_result:
@@ -298,9 +162,19 @@ class DataExtractor:
         else:
             logger.info(f"No DocAI result available for {filename}, using GCV extraction")
         
+        if fallback is not None:
+            return fallback
         logger.info(f"Falling back to GCV extraction for {filename}")
         return await self._extract_from_gcv(ocr_result, filename)
     
+    def is_invoice_complete(self, invoice: Invoice) -> bool:
+        """Every field Document AI would be asked for is already present."""
+        return bool(invoice.invoice_number and
+                    invoice.vendor.name and
+                    invoice.invoice_date and
+                    invoice.final_total is not None and
+                    invoice.items)
+
     def _is_invoice_valid(self, invoice: Invoice) -> bool:
         return (invoice.invoice_number or 
                 invoice.vendor.name or 
@@ -308,74 +182,34 @@ class DataExtractor:
                 invoice.grand_total is not None)
     
     async def _extract_from_docai(self, docai_result: Dict, filename: str) -> Invoice:
-        entities = docai_result.get('entities', {})
+        fields = docai_result.get('fields')
+        if fields is None:
+            document = docai_result.get('document', None)
+            if document is not None and hasattr(document, 'entities'):
+                fields = DocAIFields.from_document(document)
+            else:
+                fields = DocAIFields.from_entities(docai_result.get('entities', {}))
         
         vendor = Vendor(
-            name=entities.get('supplier_name', ''),
+            name=fields.text('supplier_name'),
             address=Address(
-                street=entities.get('supplier_address', ''),
-                city=entities.get('supplier_city', ''),
-                state=entities.get('supplier_state', ''),
-                country=entities.get('supplier_country', ''),
-                postal_code=entities.get('supplier_zip', '')
+                street=fields.text('supplier_address'),
+                city=fields.text('supplier_city'),
+                state=fields.text('supplier_state'),
+                country=fields.text('supplier_country'),
+                postal_code=fields.text('supplier_zip')
             )
         )
 
-        invoice_date = None
-        if 'invoice_date' in entities:
-            date_str = entities.get('invoice_date', '')
-            logger.info(f"Attempting to parse invoice date: {date_str}")
-            try:
-                if re.match(r'^\d{1,2}/\d{1,2}/\d{4}$', date_str):
-                    try:
-                        day, month, year = date_str.split('/')
-                        invoice_date = date(int(year), int(month), int(day))
-                        logger.info(f"Parsed date directly: {invoice_date}")
-                    except (ValueError, IndexError) as e:
-                        logger.warning(f"Failed direct parsing: {str(e)}")
-                
-                elif re.match(r'^\d{1,2}-\d{1,2}-\d{4}$', date_str):
-                    try:
-                        day, month, year = date_str.split('-')
-                        invoice_date = date(int(year), int(month), int(day))
-                        logger.info(f"Parsed hyphen date directly: {invoice_date}")
-                    except (ValueError, IndexError) as e:
-                        logger.warning(f"Failed direct hyphen parsing: {str(e)}")
-                
-                if not invoice_date:
-                    invoice_date_entity = [f"invoice_date:{date_str}"]
-                    logger.info(f"Created entity: {invoice_date_entity}")
-                    invoice_date = await self._extract_date(date_str, entities=invoice_date_entity)
-                    logger.info(f"Result of flexible date extraction: {invoice_date}")
-                
-                if not invoice_date:
-                    logger.warning(f"Could not parse invoice date: {date_str}")
-            except Exception as e:
-                logger.warning(f"Error parsing invoice date: {date_str}, error: {str(e)}")
+        invoice_date = fields.date('invoice_date')
+        if invoice_date:
+            logger.info(f"Using normalized invoice date: {invoice_date}")
+        elif 'invoice_date' in fields:
+            invoice_date = await self._parse_docai_date(fields.text('invoice_date'))
 
-        grand_total = None
-        if 'net_amount' in entities:
-            try:
-                grand_total = self._parse_decimal(entities.get('net_amount', ''))
-                logger.info(f"Extracted grand_total from net_amount: {grand_total}")
-            except Exception as e:
-                logger.warning(f"Error parsing net_amount: {str(e)}")
-                
-        taxes = None
-        if 'total_tax_amount' in entities:
-            try:
-                taxes = self._parse_decimal(entities.get('total_tax_amount', ''))
-                logger.info(f"Extracted taxes: {taxes}")
-            except Exception as e:
-                logger.warning(f"Error parsing total_tax_amount: {str(e)}")
-                
-        final_total = None
-        if 'total_amount' in entities:
-            try:
-                final_total = self._parse_decimal(entities.get('total_amount', ''))
-                logger.info(f"Extracted final_total from total_amount: {final_total}")
-            except Exception as e:
-                logger.warning(f"Error parsing total_amount: {str(e)}")
+        convention = self._docai_convention(fields)
+        totals = self._docai_amounts(fields, convention)
+        grand_total, taxes, final_total = totals['grand_total'], totals['taxes'], totals['final_total']
 
         if grand_total is not None and taxes is not None and final_total is not None:
             calculated_total = grand_total + taxes
@@ -389,31 +223,15 @@ class DataExtractor:
         if final_total is None and grand_total is not None and taxes is not None:
             final_total = grand_total + taxes
             logger.info(f"Calculated final_total: {final_total}")
-            
-        if grand_total is None and 'total_amount' in entities and taxes is not None:
-            try:
-                total_amount = self._parse_decimal(entities.get('total_amount', ''))
-                grand_total = total_amount - taxes
-                logger.info(f"Calculated grand_total from total_amount - taxes: {grand_total}")
-            except Exception as e:
-                logger.warning(f"Error calculating grand_total from total_amount - taxes: {str(e)}")
 
         items = []
-        line_item_entities = []
-        document = docai_result.get('document', None)
-        
-        if document and hasattr(document, 'entities'):
-            for entity in document.entities:
-                if entity.type_ == 'line_item':
-                    line_item_entities.append(entity.mention_text)
-        
-        for line_item in line_item_entities:
+        for line_item in fields.all('line_item'):
             try:
-                item = self._parse_line_item(line_item)
+                item = self._item_from_docai_line_item(line_item, convention)
                 if item:
                     items.append(item)
             except Exception as e:
-                logger.warning(f"Error parsing line item '{line_item}': {str(e)}")
+                logger.warning(f"Error parsing line item '{line_item.mention_text}': {str(e)}")
         
         if not items:
             tables = docai_result.get('tables', [])
@@ -427,7 +245,7 @@ class DataExtractor:
                         continue
                     
                     try:
-                        item = self._extract_item_from_table_row(row, header_row)
+                        item = self._extract_item_from_table_row(row, header_row, convention)
                         if item:
                             items.append(item)
                     except Exception as e:
@@ -435,17 +253,116 @@ class DataExtractor:
 
         return Invoice(
             filename=filename,
-            invoice_number=entities.get('invoice_id', ''),
+            invoice_number=fields.text('invoice_id'),
             vendor=vendor,
             invoice_date=invoice_date,
             grand_total=grand_total,
             taxes=taxes,
             final_total=final_total,
+            currency=convention.currency,
             items=items,
             pages=1  
         )
+
+    def _docai_convention(self, fields: DocAIFields) -> AmountConvention:
+        """Amount convention of the mention texts, for the values Document AI left unnormalized."""
+        mentions = [field.mention_text for type_, _ in DOCAI_TOTALS_FIELDS for field in fields.all(type_)]
+        mentions.extend(field.mention_text for field in fields.all('line_item'))
+        convention = detect_convention(' '.join(mentions))
+        return convention._replace(currency=fields.currency() or convention.currency)
+
+    def _docai_amounts(self, fields: DocAIFields, convention: AmountConvention) -> Dict[str, Optional[Decimal]]:
+        """Prefer Document AI's normalized money values; parse the remaining mention texts in one batch."""
+        totals = {field_name: fields.amount(type_) for type_, field_name in DOCAI_TOTALS_FIELDS}
+        missing = [(type_, field_name) for type_, field_name in DOCAI_TOTALS_FIELDS
+                   if totals[field_name] is None and type_ in fields]
+        parsed = normalize_amounts([fields.text(type_) for type_, _ in missing], convention)
+        for (type_, field_name), amount in zip(missing, parsed.values):
+            if amount is None:
+                logger.warning(f"Error parsing {type_}: {fields.text(type_)}")
+                continue
+            totals[field_name] = amount
+            logger.info(f"Parsed {type_} from mention text: {amount}")
+        return totals
+
+    async def _parse_docai_date(self, date_str: str) -> Optional[date]:
+        """Fallback for invoice dates that Document AI did not normalize."""
+        logger.info(f"Attempting to parse invoice date: {date_str}")
+        invoice_date = None
+        try:
+            if re.match(r'^\d{1,2}/\d{1,2}/\d{4}$', date_str):
+                try:
+                    day, month, year = date_str.split('/')
+                    invoice_date = date(int(year), int(month), int(day))
+                    logger.info(f"Parsed date directly: {invoice_date}")
+                except (ValueError, IndexError) as e:
+                    logger.warning(f"Failed direct parsing: {str(e)}")
+            
+            elif re.match(r'^\d{1,2}-\d{1,2}-\d{4}$', date_str):
+                try:
+                    day, month, year = date_str.split('-')
+                    invoice_date = date(int(year), int(month), int(day))
+                    logger.info(f"Parsed hyphen date directly: {invoice_date}")
+                except (ValueError, IndexError) as e:
+                    logger.warning(f"Failed direct hyphen parsing: {str(e)}")
+            
+            if not invoice_date:
+                invoice_date_entity = [f"invoice_date:{date_str}"]
+                invoice_date = await self._extract_date(date_str, entities=invoice_date_entity)
+                logger.info(f"Result of flexible date extraction: {invoice_date}")
+            
+            if not invoice_date:
+                logger.warning(f"Could not parse invoice date: {date_str}")
+        except Exception as e:
+            logger.warning(f"Error parsing invoice date: {date_str}, error: {str(e)}")
+        return invoice_date
+
+    def _item_from_docai_line_item(self, line_item: DocAIField,
+                                   convention: Optional[AmountConvention] = None) -> Optional[InvoiceItem]:
+        """Build an item from the `line_item/*` child properties, re-parsing mention text only as a fallback."""
+        if not line_item.properties:
+            return self._parse_line_item(line_item.mention_text, convention)
+
+        description_prop = line_item.child('description') or line_item.child('product_code')
+        quantity_prop = line_item.child('quantity')
+        unit_price_prop = line_item.child('unit_price')
+        amount_prop = line_item.child('amount')
+
+        description = description_prop.mention_text if description_prop else ""
+
+        quantity = None
+        if quantity_prop:
+            quantity_value = quantity_prop.number_value
+            if quantity_value is None:
+                quantity_value = self._parse_decimal(quantity_prop.normalized_text or quantity_prop.mention_text,
+                                                     convention=convention)
+            if quantity_value is not None:
+                quantity = int(quantity_value)
+
+        unit_price = self._docai_item_amount(unit_price_prop, convention)
+        total = self._docai_item_amount(amount_prop, convention)
+
+        if not description and quantity is None and unit_price is None and total is None:
+            return self._parse_line_item(line_item.mention_text, convention)
+
+        return InvoiceItem(
+            description=description or line_item.mention_text,
+            quantity=quantity,
+            unit_price=unit_price,
+            total=total
+        )
+
+    def _docai_item_amount(self, prop: Optional[DocAIField],
+                           convention: Optional[AmountConvention] = None) -> Optional[Decimal]:
+        if prop is None:
+            return None
+        if prop.money_value is not None:
+            return prop.money_value
+        if prop.number_value is not None:
+            return prop.number_value
+        return self._parse_decimal(prop.mention_text, convention=convention)
         
-    def _parse_line_item(self, line_item: str) -> Optional[InvoiceItem]:
+    def _parse_line_item(self, line_item: str, convention: Optional[AmountConvention] = None) -> Optional[InvoiceItem]:
         line = line_item.strip()
         if not line:
             return None
@@ -469,8 +386,8 @@ class DataExtractor:
                 total_match = amount_matches[-1]
                 unit_price_match = amount_matches[-2]
                 
-                total = self._parse_decimal(total_match.group(1))
-                unit_price = self._parse_decimal(unit_price_match.group(1))
+                total = self._parse_decimal(total_match.group(1), convention=convention)
+                unit_price = self._parse_decimal(unit_price_match.group(1), convention=convention)
                 
                 # Extract description (everything between quantity and unit price)
                 description_end = unit_price_match.start()
@@ -491,8 +408,8 @@ class DataExtractor:
                 
                 try:
                     quantity = int(qty_match.group(1))
-                    unit_price = self._parse_decimal(unit_price_match.group(1))
-                    total = self._parse_decimal(total_match.group(1))
+                    unit_price = self._parse_decimal(unit_price_match.group(1), convention=convention)
+                    total = self._parse_decimal(total_match.group(1), convention=convention)
                     
                     # Description is everything before the first number
                     description = line[:qty_match.start()].strip()
@@ -503,7 +420,7 @@ class DataExtractor:
                 # Might be just DESCRIPTION TOTAL
                 total_match = amount_matches[-1]
                 try:
-                    total = self._parse_decimal(total_match.group(1))
+                    total = self._parse_decimal(total_match.group(1), convention=convention)
                     description = line[:total_match.start()].strip()
                 except (ValueError, InvalidOperation):
                     pass
@@ -526,20 +443,16 @@ class DataExtractor:
     def _identify_header_row(self, row: List[str]) -> Dict[str, int]:
         header_map = {}
         for idx, cell in enumerate(row):
-            cell_lower = cell.lower().strip()
-            
-            if any(kw in cell_lower for kw in ['desc', 'item', 'service', 'product']):
-                header_map['description'] = idx
-            elif any(kw in cell_lower for kw in ['qty', 'quantity', 'count', 'units']):
-                header_map['quantity'] = idx
-            elif any(kw in cell_lower for kw in ['price', 'rate', 'unit', 'cost']):
-                header_map['unit_price'] = idx
-            elif any(kw in cell_lower for kw in ['amount', 'total', 'sum']):
-                header_map['total'] = idx
+            cell_fields = {hit.field for hit in scan_labels(cell).matches}
+            for label_field, column in HEADER_FIELDS:
+                if label_field in cell_fields:
+                    header_map[column] = idx
+                    break
                 
         return header_map
         
-    def _extract_item_from_table_row(self, row: List[str], header_map: Optional[Dict[str, int]] = None) -> Optional[InvoiceItem]:
+    def _extract_item_from_table_row(self, row: List[str], header_map: Optional[Dict[str, int]] = None,
+                                     convention: Optional[AmountConvention] = None) -> Optional[InvoiceItem]:
         if not row:
             return None
             
@@ -565,7 +478,7 @@ class DataExtractor:
                 price_str = row[header_map['unit_price']].strip()
                 try:
                     if price_str:
-                        unit_price = self._parse_decimal(price_str)
+                        unit_price = self._parse_decimal(price_str, convention=convention)
                 except (ValueError, InvalidOperation):
                     pass
                     
@@ -573,7 +486,7 @@ class DataExtractor:
                 total_str = row[header_map['total']].strip()
                 try:
                     if total_str:
-                        total = self._parse_decimal(total_str)
+                        total = self._parse_decimal(total_str, convention=convention)
                 except (ValueError, InvalidOperation):
                     pass
         else:
@@ -590,13 +503,13 @@ class DataExtractor:
                     
                 try:
                     if row[2].strip():
-                        unit_price = self._parse_decimal(row[2])
+                        unit_price = self._parse_decimal(row[2], convention=convention)
                 except (ValueError, InvalidOperation):
                     pass
                     
                 try:
                     if row[3].strip():
-                        total = self._parse_decimal(row[3])
+                        total = self._parse_decimal(row[3], convention=convention)
                 except (ValueError, InvalidOperation):
                     pass
             elif len(row) == 3:
@@ -612,7 +525,7 @@ class DataExtractor:
                     
                 try:
                     if row[2].strip():
-                        total = self._parse_decimal(row[2])
+                        total = self._parse_decimal(row[2], convention=convention)
                 except (ValueError, InvalidOperation):
                     pass
             elif len(row) == 2:
@@ -621,7 +534,7 @@ class DataExtractor:
                 
                 try:
                     if row[1].strip():
-                        total = self._parse_decimal(row[1])
+                        total = self._parse_decimal(row[1], convention=convention)
                 except (ValueError, InvalidOperation):
                     pass
         
@@ -641,15 +554,23 @@ class DataExtractor:
         if not text and 'words' in ocr_result:
             text = ' '.join(ocr_result.get('words', []))
         
-        invoice_number = self._extract_invoice_number(text)
+        index = self._build_spatial_index(ocr_result)
+        # One label pass per page, shared by every field below
+        labels = index.labels if index is not None and index.text == text else scan_labels(text)
+        
+        invoice_number = self._extract_invoice_number(text, index, labels)
         
-        vendor = self._extract_vendor(text)
+        vendor = self._extract_vendor(text, index)
         
-        invoice_date = await self._extract_date(text) 
+        invoice_date = await self._extract_date(text, labels=labels)
         
-        grand_total, taxes, final_total = self._extract_totals(text)
+        # Decimal mark and currency are decided once per page, from all of its numbers
+        convention = index.amount_convention if index is not None and index.text == text else \
+            detect_convention(text, labels.language())
         
-        items = self._extract_items(ocr_result)
+        grand_total, taxes, final_total = self._extract_totals(text, index, labels, convention)
+        
+        items = self._extract_items(ocr_result, index, convention)
         
         return Invoice(
             filename=filename,
@@ -659,23 +580,132 @@ class DataExtractor:
             grand_total=grand_total,
             taxes=taxes,
             final_total=final_total,
+            currency=convention.currency,
             items=items,
             pages=ocr_result.get('num_pages', 1)
         )
 
-    def _extract_invoice_number(self, text: str) -> Optional[str]:
-        patterns = [
-            r'(?i)invoice\s*number?[:\s]*([A-Za-z0-9-]{5,})',
-            r'(?i)invoice\s*#[:\s]*([A-Za-z0-9-]{5,})',
-            r'(?i)inv[:\s]*([A-Za-z0-9-]{5,})'
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, text)
-            if match:
+    def _build_spatial_index(self, ocr_result: Dict) -> Optional[SpatialIndex]:
+        # Kept on the OCR result so template matching and GCV extraction share one index
+        if 'spatial_index' in ocr_result:
+            return ocr_result['spatial_index']
+        try:
+            index = SpatialIndex.from_ocr_result(ocr_result)
+        except Exception as e:
+            logger.warning(f"Could not index word boxes for {ocr_result.get('filename', '')}: {str(e)}")
+            index = None
+        ocr_result['spatial_index'] = index
+        return index
+
+    # Vendor templates
+
+    def _fingerprint(self, ocr_result: Dict, index: SpatialIndex) -> VendorFingerprint:
+        if 'vendor_fingerprint' not in ocr_result:
+            ocr_result['vendor_fingerprint'] = VendorFingerprint.from_page(
+                index, ocr_result.get('text', ''), ocr_result.get('content')
+            )
+        return ocr_result['vendor_fingerprint']
+
+    async def extract_from_template(self, ocr_result: Dict, project_id: Optional[int] = None) -> Optional[Invoice]:
+        # Indexing, fingerprinting (a logo hash of the page image) and matching are CPU-bound
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, self._extract_from_template_sync, ocr_result, project_id)
+
+    def _extract_from_template_sync(self, ocr_result: Dict, project_id: Optional[int] = None) -> Optional[Invoice]:
+        """
+        Read a repeat vendor's fields from their learned positions, with the
+        project's templates; None if no template validates. The vendor is read
+        from the page and has to be the template's.
+        """
+        index = self._build_spatial_index(ocr_result)
+        if index is None:
+            return None
+        
+        matched = template_store.match(self._fingerprint(ocr_result, index), project_id)
+        if matched is None:
+            return None
+        template, score = matched
+        
+        filename = ocr_result.get('filename', '')
+        vendor = self._extract_vendor(ocr_result.get('text', ''), index)
+        if not same_vendor(vendor.name, template.vendor.get('name')):
+            logger.info(f"Template {template.template_id} matched {filename} (score {score:.2f}) "
+                        f"but the page names vendor {vendor.name!r}")
+            return None
+        
+        values = template_store.read(template, index)
+        try:
+            invoice = Invoice(
+                filename=filename,
+                invoice_number=values.get('invoice_number'),
+                vendor=vendor,
+                invoice_date=values.get('invoice_date'),
+                grand_total=values.get('grand_total'),
+                taxes=values.get('taxes'),
+                final_total=values.get('final_total'),
+                currency=index.amount_convention.currency,
+                items=self._extract_items(ocr_result, index, index.amount_convention),
+                pages=ocr_result.get('num_pages', 1)
+            )
+        except Exception as e:
+            logger.warning(f"Template {template.template_id} produced an unusable invoice for {filename}: {str(e)}")
+            return None
+        
+        if not self._is_template_invoice_valid(invoice):
+            logger.info(f"Template {template.template_id} matched {filename} (score {score:.2f}) but failed validation")
+            return None
+        
+        logger.info(f"Extracted {filename} with vendor template {template.template_id} (score {score:.2f})")
+        return invoice
+
+    async def learn_template(self, ocr_result: Dict, invoice: Invoice, project_id: Optional[int] = None):
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self.executor, self._learn_template_sync, ocr_result, invoice, project_id)
+
+    def _learn_template_sync(self, ocr_result: Dict, invoice: Invoice, project_id: Optional[int] = None):
+        """Remember the vendor layout of a confidently extracted page, for the project."""
+        if not self._is_template_invoice_valid(invoice):
+            return
+        index = self._build_spatial_index(ocr_result)
+        if index is None:
+            return
+        try:
+            template = template_store.learn(self._fingerprint(ocr_result, index), invoice, index, project_id)
+            if template:
+                logger.info(f"Learned vendor template {template.template_id} from {ocr_result.get('filename', '')}")
+        except Exception as e:
+            logger.warning(f"Could not learn vendor template from {ocr_result.get('filename', '')}: {str(e)}")
+
+    def _is_template_invoice_valid(self, invoice: Invoice) -> bool:
+        if not (invoice.invoice_number and invoice.invoice_date and invoice.final_total is not None):
+            return False
+        if invoice.grand_total is not None and invoice.taxes is not None:
+            return abs(invoice.grand_total + invoice.taxes - invoice.final_total) <= Decimal('0.01')
+        return True
+
+    def _extract_invoice_number(self, text: str, index: Optional[SpatialIndex] = None,
+                                labels: Optional[LabelTable] = None) -> Optional[str]:
+        if index is not None:
+            value = index.value_for(('invoice_number',), self._is_invoice_number_token, prefer='first')
+            if value:
+                return value.text.strip(':#')
+        
+        labels = labels if labels is not None else scan_labels(text)
+        for hit in labels.ranked('invoice_number'):
+            match = IDENTIFIER_AFTER_LABEL_RE.match(text, hit.end)
+            if match and self._is_invoice_number_token(match.group(1)):
                 return match.group(1)
         return None
 
-    def _extract_vendor(self, text: str) -> Vendor:
+    def _is_invoice_number_token(self, word: str) -> bool:
+        return is_identifier_token(word) and parse_date_string(word) is None
+
+    def _extract_vendor(self, text: str, index: Optional[SpatialIndex] = None) -> Vendor:
+        if index is not None:
+            vendor = self._extract_vendor_from_layout(index)
+            if vendor:
+                return vendor
+        
         lines = text.split('\n')
         if not lines:
             return Vendor(name="", address=Address())
@@ -688,6 +718,41 @@ class DataExtractor:
             address=self._extract_address(address_text)
         )
 
+    def _extract_vendor_from_layout(self, index: SpatialIndex) -> Optional[Vendor]:
+        """Vendor name is the most prominent text block in the page header; the address is the block under it."""
+        lines = index.segments()
+        header_limit = index.page_y0 + (index.page_y1 - index.page_y0) * 0.2
+        
+        best = None
+        best_height = 0.0
+        for position, line in enumerate(lines):
+            if float(index.y0[line].min()) > header_limit:
+                continue
+            line_text = index.line_text(line)
+            if not any(ch.isalpha() for ch in line_text) or INVOICE_TITLE_RE.match(line_text):
+                continue
+            height = float(np.median(index.heights[line]))
+            if height > best_height * 1.15:
+                best, best_height = position, height
+        
+        if best is None:
+            return None
+        
+        name_line = lines[best]
+        left, right = float(index.x0[name_line].min()), float(index.x1[name_line].max())
+        address_lines = []
+        for line in lines[best + 1:]:
+            if len(address_lines) == 3:
+                break
+            if float(index.x1[line].max()) < left or float(index.x0[line].min()) > right:
+                continue
+            address_lines.append(index.line_text(line))
+        
+        return Vendor(
+            name=index.line_text(name_line),
+            address=self._extract_address('\n'.join(address_lines))
+        )
+
     def _extract_address(self, text: str) -> Address:
         lines = text.split('\n')
         
@@ -716,26 +781,40 @@ class DataExtractor:
             postal_code=postal_code
         )  
 
-    def _extract_totals(self, text: str) -> Tuple[Optional[Decimal], Optional[Decimal], Optional[Decimal]]:
-        grand_total = None
-        taxes = None
-        final_total = None
-        
-        subtotal_match = re.search(r'(?i)subtotal[:\s]*\$?([\d,]+\.\d{2})', text)
-        if subtotal_match:
-            grand_total = self._parse_decimal(subtotal_match.group(1))
-        
-        tax_match = re.search(r'(?i)tax[:\s]*\$?([\d,]+\.\d{2})', text)
-        if tax_match:
-            taxes = self._parse_decimal(tax_match.group(1))
-        
-        total_match = re.search(r'(?i)total[:\s]*\$?([\d,]+\.\d{2})', text)
-        if total_match:
-            final_total = self._parse_decimal(total_match.group(1))
-        
-        return grand_total, taxes, final_total
+    def _extract_totals(self, text: str, index: Optional[SpatialIndex] = None,
+                        labels: Optional[LabelTable] = None,
+                        convention: Optional[AmountConvention] = None) -> Tuple[Optional[Decimal], Optional[Decimal], Optional[Decimal]]:
+        labels = labels if labels is not None else scan_labels(text)
+        # "1.234,56" on a German invoice: the page's own numbers decide, the label language breaks ties
+        convention = convention or detect_convention(text, labels.language())
+        
+        # Candidates per field, best first; all of them are normalized in one batch
+        candidates = []
+        if index is not None:
+            # Label words consumed by one field are not reused by the next
+            used = set()
+            for label_field, field_name in TOTALS_FIELDS:
+                value = index.value_for((label_field,), is_amount_token, prefer='last', used=used)
+                if value is not None:
+                    candidates.append((field_name, value.text))
+        
+        for label_field, field_name in TOTALS_FIELDS:
+            for hit in labels.ranked(label_field):
+                match = AMOUNT_AFTER_LABEL_RE.match(text, hit.end)
+                if match:
+                    candidates.append((field_name, match.group(1)))
+                    break
+        
+        totals = {}
+        amounts = normalize_amounts([candidate for _, candidate in candidates], convention)
+        for (field_name, _), value in zip(candidates, amounts.values):
+            if value is not None and totals.get(field_name) is None:
+                totals[field_name] = value
+        
+        return totals.get('grand_total'), totals.get('taxes'), totals.get('final_total')
 
-    def _extract_items(self, ocr_result: Dict) -> List[InvoiceItem]:
+    def _extract_items(self, ocr_result: Dict, index: Optional[SpatialIndex] = None,
+                       convention: Optional[AmountConvention] = None) -> List[InvoiceItem]:
         items = []
         
         tables = ocr_result.get('tables', [])
@@ -745,8 +824,8 @@ class DataExtractor:
                     if len(row) >= 4:
                         description = row[0]
                         quantity = int(row[1]) if row[1].strip() else None
-                        unit_price = self._parse_decimal(row[2]) if row[2].strip() else None
-                        total = self._parse_decimal(row[3]) if row[3].strip() else None
+                        unit_price = self._parse_decimal(row[2], convention=convention) if row[2].strip() else None
+                        total = self._parse_decimal(row[3], convention=convention) if row[3].strip() else None
                         
                         items.append(InvoiceItem(
                             description=description,
@@ -757,25 +836,38 @@ class DataExtractor:
                 except (ValueError, IndexError, InvalidOperation) as e:
                     logger.warning(f"Error parsing item: {str(e)}")
         
+        # Vision rarely reports TABLE blocks, so rebuild the table from the word boxes
+        if not items and index is not None:
+            items = self._extract_items_from_layout(index, convention)
+        
         return items
 
-    def _parse_decimal(self, amount_string: str) -> Optional[Decimal]:
-        if not amount_string or not amount_string.strip():
-            return None
-            
+    def _extract_items_from_layout(self, index: SpatialIndex,
+                                   convention: Optional[AmountConvention] = None) -> List[InvoiceItem]:
         try:
-            cleaned = re.sub(r'[^\d.-]', '', amount_string)
-            return Decimal(cleaned)
-        except (InvalidOperation, TypeError):
-            try:
-                price = Price.fromstring(amount_string)
-                return Decimal(str(price.amount)) if price.amount else None
-            except:
-                logger.warning(f"Could not parse decimal: {amount_string}")
-                return None
+            table = reconstruct_table(index, self._identify_header_row, TABLE_STOP_FIELDS)
+        except Exception as e:
+            logger.warning(f"Table reconstruction failed: {str(e)}")
+            return []
+        if table is None:
+            return []
+        
+        items = []
+        for row in table.rows:
+            item = self._extract_item_from_table_row(row, table.header_map, convention)
+            if item:
+                items.append(item)
+        return items
+
+    def _parse_decimal(self, amount_string: str, locale: Optional[str] = None,
+                       convention: Optional[AmountConvention] = None) -> Optional[Decimal]:
+        return parsing_service.parse_amount(amount_string, locale, convention)
             
     async def cleanup(self):
         self.executor.shutdown(wait=True)
+        batch_extractor.shutdown()
+        parsing_service.shutdown()
+        template_store.shutdown()
         if self.redis:
             await self.redis.close()
 
@@ -787,5 +879,21 @@ async def initialize_data_extractor():
 async def cleanup_data_extractor():
     await data_extractor.cleanup()
 
-async def extract_invoice_data(ocr_result: Dict, docai_result: Optional[Dict] = None) -> Invoice:
-    return await data_extractor.extract_invoice_data(ocr_result, docai_result)
+async def extract_invoice_data(ocr_result: Dict, docai_result: Optional[Dict] = None,
+                               fallback: Optional[Invoice] = None) -> Invoice:
+    return await data_extractor.extract_invoice_data(ocr_result, docai_result, fallback)
+
+def is_invoice_complete(invoice: Invoice) -> bool:
+    return data_extractor.is_invoice_complete(invoice)
+
+async def extract_from_template(ocr_result: Dict, project_id: Optional[int] = None) -> Optional[Invoice]:
+    return await data_extractor.extract_from_template(ocr_result, project_id)
+
+async def learn_template(ocr_result: Dict, invoice: Invoice, project_id: Optional[int] = None):
+    await data_extractor.learn_template(ocr_result, invoice, project_id)
+
+async def get_cached_invoice(ocr_result: Dict) -> Optional[Invoice]:
+    return await data_extractor.get_cached_invoice(ocr_result)
+
+async def cache_invoice(ocr_result: Dict, invoice: Invoice):
+    await data_extractor.cache_invoice(ocr_result, invoice)
@@ -0,0 +1,202 @@
+import re
+from bisect import bisect_right
+from typing import List, NamedTuple, Optional, Tuple
+from datetime import datetime, date
+import logging
+from app.utils.label_automaton import LabelMatch, LabelTable, scan_labels
+
+logger = logging.getLogger(__name__)
+
+MONTHS = {
+    'jan': 1, 'january': 1, 'feb': 2, 'february': 2, 'mar': 3, 'march': 3,
+    'apr': 4, 'april': 4, 'may': 5, 'jun': 6, 'june': 6, 'jul': 7, 'july': 7,
+    'aug': 8, 'august': 8, 'sep': 9, 'sept': 9, 'september': 9, 'oct': 10, 'october': 10,
+    'nov': 11, 'november': 11, 'dec': 12, 'december': 12
+}
+
+# Label field -> weight. Candidates right after a strong label win over ones near weak labels.
+DATE_FIELD_WEIGHTS = {
+    'invoice_date': 5, 'date': 4, 'transaction_date': 3, 'document_title': 2, 'due_date': 1
+}
+
+KEYWORD_WINDOW = 50
+FALLBACK_WINDOW = 80
+MAX_FALLBACK_WINDOWS = 3
+
+_MONTH = r'(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|sept?(?:ember)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)'
+_ORDINAL = r'(?:st|nd|rd|th)?'
+
+# Alternatives that start with a digit vs. a letter are grouped behind a one-character
+# lookahead so most word starts are rejected without trying every branch.
+_NUMERIC_DATE_ALTERNATIVES = [
+    r'(?P<ymd_y>\d{4})[/.-](?P<ymd_m>\d{1,2})[/.-](?P<ymd_d>\d{1,2})',
+    r'(?P<num_a>\d{1,2})[/.-](?P<num_b>\d{1,2})[/.-](?P<num_y>\d{4}|\d{2})',
+    rf'(?P<dmy_d>\d{{1,2}}){_ORDINAL}[\s-]+(?P<dmy_m>{_MONTH})\.?,?[\s-]+(?P<dmy_y>\d{{4}}|\d{{2}})',
+    r'(?P<compact>\d{8})',
+    r'(?P<sp_a>\d{1,2})\s(?P<sp_b>\d{1,2})\s(?P<sp_y>\d{4})',
+]
+_MONTH_FIRST_DATE = rf'(?P<mdy_m>{_MONTH})\.?\s+(?P<mdy_d>\d{{1,2}}){_ORDINAL},?\s+(?P<mdy_y>\d{{4}}|\d{{2}})'
+_DATE_ALTERNATIVES = _NUMERIC_DATE_ALTERNATIVES + [_MONTH_FIRST_DATE]
+
+# One alternation: a single left-to-right pass yields every date candidate in order.
+# Labels come from the page's label table, so they are not part of this pattern.
+DATE_SCAN_RE = re.compile(
+    rf'\b(?:(?=\d)(?P<date>{"|".join(_NUMERIC_DATE_ALTERNATIVES)})'
+    rf'|(?=[a-z])(?P<word_date>{_MONTH_FIRST_DATE}))\b',
+    re.IGNORECASE
+)
+
+# Spaced day/month/year triples are a weak signal (table columns look the same).
+_FORMAT_SCORES = {'ymd_y': 1.0, 'num_a': 1.0, 'dmy_d': 1.2, 'mdy_m': 1.2, 'compact': 0.4, 'sp_a': 0.2}
+
+
+class DateCandidate(NamedTuple):
+    value: date
+    start: int
+    score: float
+    keyword: Optional[str]
+    text: str
+
+
+def _expand_year(year: str) -> int:
+    if len(year) == 4:
+        return int(year)
+    current_year = datetime.now().year
+    century = current_year // 100
+    expanded = century * 100 + int(year)
+    if expanded > current_year + 20:
+        expanded -= 100
+    return expanded
+
+
+def _plausible(candidate: date) -> bool:
+    return 1900 <= candidate.year <= datetime.now().year + 20
+
+
+def _make_date(year: int, month: int, day: int) -> Optional[date]:
+    try:
+        candidate = date(year, month, day)
+    except ValueError:
+        return None
+    return candidate if _plausible(candidate) else None
+
+
+def _parse_match(match: 're.Match', date_order: str = 'DMY') -> Optional[date]:
+    """Turn a DATE_SCAN_RE (or DATE_STRING_RE) match into a date without dateparser."""
+    groups = match.groupdict()
+    if groups.get('ymd_y'):
+        return _make_date(int(groups['ymd_y']), int(groups['ymd_m']), int(groups['ymd_d']))
+    if groups.get('num_a'):
+        return _parse_day_month(groups['num_a'], groups['num_b'], groups['num_y'], date_order)
+    if groups.get('sp_a'):
+        return _parse_day_month(groups['sp_a'], groups['sp_b'], groups['sp_y'], date_order)
+    if groups.get('dmy_d'):
+        month = MONTHS.get(groups['dmy_m'].lower())
+        return _make_date(_expand_year(groups['dmy_y']), month, int(groups['dmy_d'])) if month else None
+    if groups.get('mdy_m'):
+        month = MONTHS.get(groups['mdy_m'].lower())
+        return _make_date(_expand_year(groups['mdy_y']), month, int(groups['mdy_d'])) if month else None
+    if groups.get('compact'):
+        digits = groups['compact']
+        return (_make_date(int(digits[:4]), int(digits[4:6]), int(digits[6:]))
+                or _parse_day_month(digits[:2], digits[2:4], digits[4:], date_order))
+    return None
+
+
+def _parse_day_month(first: str, second: str, year: str, date_order: str = 'DMY') -> Optional[date]:
+    # The preferred order is tried first and the other one only if it gives an invalid date.
+    full_year = _expand_year(year)
+    day_first = _make_date(full_year, int(second), int(first))
+    month_first = _make_date(full_year, int(first), int(second))
+    if date_order == 'MDY':
+        return month_first or day_first
+    return day_first or month_first
+
+
+def _format_key(match: 're.Match') -> str:
+    groups = match.groupdict()
+    for key in _FORMAT_SCORES:
+        if groups.get(key):
+            return key
+    return ''
+
+
+def date_label_hits(labels: LabelTable) -> List[LabelMatch]:
+    """Date-related label hits in text order, one per span (the heaviest field wins)."""
+    hits = {}
+    for hit in labels.get(*DATE_FIELD_WEIGHTS):
+        current = hits.get(hit.start)
+        if current is None or DATE_FIELD_WEIGHTS[hit.field] > DATE_FIELD_WEIGHTS[current.field]:
+            hits[hit.start] = hit
+    return [hits[start] for start in sorted(hits)]
+
+
+def scan_dates(text: str, labels: Optional[LabelTable] = None) -> Tuple[List[DateCandidate], List[LabelMatch]]:
+    """
+    Single pass over `text`. Returns parsed date candidates (best first) and
+    the date label hits, which callers can reuse as fallback windows. Pass the
+    page's label table when the caller already has one.
+    """
+    keyword_hits = date_label_hits(labels if labels is not None else scan_labels(text))
+    keyword_ends = [hit.end for hit in keyword_hits]
+    candidates = []
+
+    for match in DATE_SCAN_RE.finditer(text):
+        value = _parse_match(match)
+        if value is None:
+            continue
+
+        score = _FORMAT_SCORES.get(_format_key(match), 0.0)
+        near_keyword = None
+        # Closest label that ends before the candidate starts
+        position = bisect_right(keyword_ends, match.start()) - 1
+        if position >= 0:
+            hit = keyword_hits[position]
+            distance = match.start() - hit.end
+            if distance <= KEYWORD_WINDOW:
+                near_keyword = hit.label.lower()
+                score += DATE_FIELD_WEIGHTS[hit.field] * (1.0 - distance / (2.0 * KEYWORD_WINDOW))
+
+        candidates.append(DateCandidate(value, match.start(), score, near_keyword, match.group(0)))
+
+    candidates.sort(key=lambda c: (-c.score, c.start))
+    return candidates, keyword_hits
+
+
+DATE_STRING_RE = re.compile(rf'^\s*(?:{"|".join(_DATE_ALTERNATIVES)})\s*$', re.IGNORECASE)
+
+
+def parse_date_string(date_str: str, date_order: str = 'DMY') -> Optional[date]:
+    """Fast parser for a string that should hold exactly one date (e.g. an entity value)."""
+    if not date_str:
+        return None
+    match = DATE_STRING_RE.match(date_str)
+    if match:
+        return _parse_match(match, date_order)
+    for match in DATE_SCAN_RE.finditer(date_str):
+        return _parse_match(match, date_order)
+    return None
+
+
+def fallback_windows(text: str, keyword_hits: List[LabelMatch]) -> List[str]:
+    """Bounded snippets handed to dateparser when the fast parser found nothing."""
+    windows = []
+    for hit in sorted(keyword_hits, key=lambda hit: -DATE_FIELD_WEIGHTS[hit.field]):
+        window = text[hit.end:hit.end + FALLBACK_WINDOW].lstrip(' :\t\r\n')
+        window = window.split('\n', 1)[0].strip()
+        if window and window not in windows:
+            windows.append(window)
+        if len(windows) >= MAX_FALLBACK_WINDOWS:
+            break
+    return windows
+
+
+def find_date(text: str, use_fallback: bool = True, labels: Optional[LabelTable] = None) -> Optional[date]:
+    candidates, keyword_hits = scan_dates(text, labels)
+    if candidates:
+        return candidates[0].value
+    if use_fallback:
+        from app.utils.parsing_service import parsing_service
+        parsed = parsing_service.parse_dates(fallback_windows(text, keyword_hits))
+        return next((value for value in parsed if value), None)
+    return None
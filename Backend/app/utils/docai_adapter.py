@@ -0,0 +1,159 @@
+from typing import Dict, List, Optional, Any
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from dataclasses import dataclass, field
+import logging
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class DocAIField:
+    """A single Document AI entity with its normalized value, if Document AI supplied one."""
+    type_: str
+    mention_text: str = ""
+    confidence: float = 0.0
+    date_value: Optional[date] = None
+    money_value: Optional[Decimal] = None
+    currency_code: Optional[str] = None
+    number_value: Optional[Decimal] = None
+    normalized_text: Optional[str] = None
+    properties: List['DocAIField'] = field(default_factory=list)
+
+    @property
+    def is_normalized(self) -> bool:
+        return self.date_value is not None or self.money_value is not None or self.number_value is not None
+
+    def child(self, name: str) -> Optional['DocAIField']:
+        """Highest-confidence child property, matched with or without its parent prefix (`line_item/`)."""
+        best = None
+        for prop in self.properties:
+            prop_name = prop.type_.split('/', 1)[1] if '/' in prop.type_ else prop.type_
+            if prop_name == name and (best is None or prop.confidence > best.confidence):
+                best = prop
+        return best
+
+
+class DocAIFields:
+    """Entities grouped by type, highest confidence first, so duplicates are no longer lost."""
+
+    def __init__(self, fields: List[DocAIField]):
+        self._by_type: Dict[str, List[DocAIField]] = {}
+        for docai_field in fields:
+            self._by_type.setdefault(docai_field.type_, []).append(docai_field)
+        for candidates in self._by_type.values():
+            candidates.sort(key=lambda f: f.confidence, reverse=True)
+
+    @classmethod
+    def from_document(cls, document) -> 'DocAIFields':
+        if document is None or not hasattr(document, 'entities'):
+            return cls([])
+        return cls([_adapt_entity(entity) for entity in document.entities])
+
+    @classmethod
+    def from_entities(cls, entities: Dict[str, str]) -> 'DocAIFields':
+        """Build from the legacy flat `{type_: mention_text}` mapping (no normalization available)."""
+        return cls([DocAIField(type_=type_, mention_text=text or "") for type_, text in (entities or {}).items()])
+
+    def __contains__(self, type_: str) -> bool:
+        return type_ in self._by_type
+
+    def best(self, type_: str) -> Optional[DocAIField]:
+        candidates = self._by_type.get(type_)
+        return candidates[0] if candidates else None
+
+    def all(self, type_: str) -> List[DocAIField]:
+        return list(self._by_type.get(type_, []))
+
+    def text(self, type_: str, default: str = "") -> str:
+        best = self.best(type_)
+        return best.mention_text if best and best.mention_text else default
+
+    def date(self, type_: str) -> Optional[date]:
+        best = self.best(type_)
+        return best.date_value if best else None
+
+    def amount(self, type_: str) -> Optional[Decimal]:
+        best = self.best(type_)
+        if best is None:
+            return None
+        return best.money_value if best.money_value is not None else best.number_value
+
+    def currency(self) -> Optional[str]:
+        """Currency code Document AI attached to the most money values."""
+        counts: Dict[str, int] = {}
+        for candidates in self._by_type.values():
+            for docai_field in candidates:
+                if docai_field.currency_code:
+                    counts[docai_field.currency_code] = counts.get(docai_field.currency_code, 0) + 1
+        return max(counts, key=counts.get) if counts else None
+
+    def as_flat_dict(self) -> Dict[str, str]:
+        return {type_: candidates[0].mention_text for type_, candidates in self._by_type.items()}
+
+
+def _has_field(message, name: str) -> bool:
+    try:
+        return name in message
+    except TypeError:
+        pass
+    try:
+        return message.HasField(name)
+    except (ValueError, AttributeError):
+        return False
+
+
+def _money_to_decimal(money) -> Optional[Decimal]:
+    units = getattr(money, 'units', 0) or 0
+    nanos = getattr(money, 'nanos', 0) or 0
+    try:
+        return Decimal(units) + (Decimal(nanos) / Decimal(1_000_000_000))
+    except (InvalidOperation, TypeError):
+        return None
+
+
+def _date_value(proto_date) -> Optional[date]:
+    year = getattr(proto_date, 'year', 0)
+    month = getattr(proto_date, 'month', 0)
+    day = getattr(proto_date, 'day', 0)
+    if not (year and month and day):
+        return None
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def _adapt_entity(entity: Any) -> DocAIField:
+    adapted = DocAIField(
+        type_=getattr(entity, 'type_', ''),
+        mention_text=(getattr(entity, 'mention_text', '') or '').strip(),
+        confidence=float(getattr(entity, 'confidence', 0.0) or 0.0),
+    )
+
+    normalized = getattr(entity, 'normalized_value', None)
+    if normalized is not None:
+        try:
+            if _has_field(normalized, 'date_value'):
+                adapted.date_value = _date_value(normalized.date_value)
+            elif _has_field(normalized, 'datetime_value'):
+                adapted.date_value = _date_value(normalized.datetime_value)
+
+            if _has_field(normalized, 'money_value'):
+                adapted.money_value = _money_to_decimal(normalized.money_value)
+                adapted.currency_code = getattr(normalized.money_value, 'currency_code', None) or None
+
+            if _has_field(normalized, 'integer_value'):
+                adapted.number_value = Decimal(normalized.integer_value)
+            elif _has_field(normalized, 'float_value'):
+                adapted.number_value = Decimal(str(normalized.float_value))
+
+            text = getattr(normalized, 'text', '')
+            if text:
+                adapted.normalized_text = text
+        except Exception as e:
+            logger.warning(f"Could not read normalized value for entity {adapted.type_}: {str(e)}")
+
+    for prop in getattr(entity, 'properties', None) or []:
+        adapted.properties.append(_adapt_entity(prop))
+
+    return adapted
@@ -0,0 +1,203 @@
+import re
+import math
+import threading
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, NamedTuple, Optional
+from app.config import settings
+from app.utils.anomaly_engine import vendor_key
+from app.utils.pipeline import InvoiceSet
+from app.utils.state_store import StateStore, get_state_store
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_NAMESPACE = 'invoice_index'
+# Characters OCR mistakes for one another, after normalize_invoice_number upper-cased them ('l' is 'L')
+OCR_CONFUSABLE = ('0O', '1IL', '5S', '8B')
+_CONFUSED = {(a, b) for group in OCR_CONFUSABLE for a in group for b in group if a != b}
+
+
+def normalize_invoice_number(number: Optional[str]) -> Optional[str]:
+    """Upper-case alphanumerics with leading zeros dropped from digit runs: 'inv-00231' and 'INV 231' agree."""
+    compact = re.sub(r'[^A-Z0-9]+', '', (number or '').upper())
+    compact = re.sub(r'(?<![0-9])0+(?=[0-9])', '', compact)
+    return compact or None
+
+
+def number_key(project_id: Optional[int], vendor: str, number: str) -> str:
+    return f"{project_id or 0}:n:{vendor}:{number}"
+
+
+def block_prefix(project_id: Optional[int], vendor: str, total_cents: int) -> str:
+    # Completed with the invoice date's proleptic ordinal, so neighbouring days are just +/- 1
+    return f"{project_id or 0}:b:{vendor}:{total_cents}:"
+
+
+def misread_variants(a: str, b: str) -> bool:
+    """
+    One OCR misread apart: a single substitution between confusable
+    characters, or two neighbouring characters swapped. A digit read as
+    another digit is not a misread: INV-20931 and INV-20932 are two invoices.
+    """
+    if len(a) != len(b):
+        return False
+    diff = [index for index, (x, y) in enumerate(zip(a, b)) if x != y]
+    if len(diff) == 1:
+        return (a[diff[0]], b[diff[0]]) in _CONFUSED
+    if len(diff) == 2 and diff[1] == diff[0] + 1:
+        return a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]]
+    return False
+
+
+def _date_offsets(window: int) -> List[int]:
+    return [0] + [offset for distance in range(1, window + 1) for offset in (-distance, distance)]
+
+
+class InvoiceKeys(NamedTuple):
+    normalized_number: Optional[str]
+    by_number: Optional[str]
+    # The block key of the invoice's own date, then the neighbouring days to probe
+    blocks: List[str]
+
+
+class DuplicateIndex:
+    """
+    Every invoice processed in a project, looked up by normalized (vendor,
+    invoice number) and, as a fuzzy fallback, by blocking keys (vendor, total
+    in cents, date). A new invoice costs one number key plus one block key per
+    day in the DUPLICATE_DATE_WINDOW, fetched together with the rest of its
+    batch, so checking never scans history. Entries live in the state store
+    and are added by register() once a task's results are saved, with the
+    task, file and time, so a flag can say where the original is.
+    """
+
+    def __init__(self, state_store: Optional[StateStore] = None):
+        self._state_store = state_store
+        self._lock = threading.Lock()
+
+    @property
+    def state_store(self) -> StateStore:
+        if self._state_store is None:
+            self._state_store = get_state_store()
+        return self._state_store
+
+    def _keys(self, invoice, project_id: Optional[int], total: float, offsets: List[int]) -> Optional[InvoiceKeys]:
+        vendor = vendor_key(invoice.vendor.name)
+        if not vendor:
+            return None
+        number = normalize_invoice_number(invoice.invoice_number)
+        blocks = []
+        if invoice.invoice_date is not None and not math.isnan(total):
+            prefix = block_prefix(project_id, vendor, int(round(total * 100)))
+            day = invoice.invoice_date.toordinal()
+            blocks = [f"{prefix}{day + offset}" for offset in offsets]
+        return InvoiceKeys(number, number_key(project_id, vendor, number) if number else None, blocks)
+
+    @staticmethod
+    def _similar_numbers(a: Optional[str], b: Optional[str]) -> bool:
+        # Invoices with different numbers are different invoices, even at the same total
+        if not a or not b:
+            return True
+        return a == b or misread_variants(a, b)
+
+    @staticmethod
+    def _record(invoice_id: str, invoice, number: Optional[str], task_id: Optional[str]) -> Dict:
+        return {'task_id': task_id, 'invoice_id': invoice_id, 'filename': invoice.filename, 'number': number,
+                'date': invoice.invoice_date.isoformat() if invoice.invoice_date else None,
+                'registered_at': datetime.now(timezone.utc).isoformat(timespec='seconds')}
+
+    @staticmethod
+    def _original(match: Dict, in_upload: bool) -> str:
+        if in_upload:
+            return f"{match['invoice_id']} in this upload"
+        where = [f"task {match['task_id']}"] if match.get('task_id') else []
+        if match.get('registered_at'):
+            where.append(f"processed {match['registered_at'][:10]}")
+        name = match.get('filename') or match['invoice_id']
+        return f"{name} ({', '.join(where)})" if where else name
+
+    def _all_keys(self, invoice_set: InvoiceSet, project_id: Optional[int], offsets: List[int]) -> List[Optional[InvoiceKeys]]:
+        totals = invoice_set.batch.amounts['final_total']
+        return [self._keys(invoice, project_id, total, offsets) for invoice, total in zip(invoice_set.invoices, totals.tolist())]
+
+    def check(self, invoice_set: InvoiceSet, project_id: Optional[int] = None, task_id: Optional[str] = None) -> List[List[str]]:
+        """
+        Duplicate flags for every invoice of the set, against the project's
+        history and earlier rows of the set. Entries a task registered itself
+        are not duplicates of it. Nothing is registered here.
+        """
+        flags: List[List[str]] = [[] for _ in range(len(invoice_set))]
+        keys = self._all_keys(invoice_set, project_id, _date_offsets(settings.DUPLICATE_DATE_WINDOW))
+        probes = [key for invoice_keys in keys if invoice_keys for key in (invoice_keys.by_number, *invoice_keys.blocks) if key]
+        if not probes:
+            return flags
+
+        stored = {key: entry for key, entry in self.state_store.get_many(DUPLICATE_NAMESPACE, probes).items()
+                  if task_id is None or entry.get('task_id') != task_id}
+        pending: Dict[str, Dict] = {}
+        for row, (invoice_id, invoice, invoice_keys) in enumerate(zip(invoice_set.ids, invoice_set.invoices, keys)):
+            if invoice_keys is None:
+                continue
+            number = invoice_keys.normalized_number
+            key = invoice_keys.by_number
+            if key and (key in stored or key in pending):
+                match = stored.get(key) or pending[key]
+                flags[row].append(f"Possible duplicate of {self._original(match, key not in stored)}: "
+                                  f"same vendor and invoice number")
+            else:
+                for key in invoice_keys.blocks:
+                    candidate = stored.get(key) or pending.get(key)
+                    if candidate and self._similar_numbers(number, candidate.get('number')):
+                        flags[row].append(
+                            f"Possible duplicate of {self._original(candidate, key not in stored)}: "
+                            f"same vendor and total, dated {candidate['date']}"
+                        )
+                        break
+
+            # First sighting wins, so later copies keep pointing at the original
+            record = self._record(invoice_id, invoice, number, task_id)
+            for key in (invoice_keys.by_number, *invoice_keys.blocks[:1]):
+                if key and key not in stored:
+                    pending.setdefault(key, record)
+        return flags
+
+    def register(self, invoice_set: InvoiceSet, project_id: Optional[int] = None,
+                 task_id: Optional[str] = None) -> List[int]:
+        """
+        Add a task's invoices to the index; called once its results are saved.
+        Returns the rows of the invoices the index did not know yet, from an
+        earlier run or earlier in the set, for the vendor statistics to count.
+        """
+        keys = self._all_keys(invoice_set, project_id, [0])
+        entries: Dict[str, Dict] = {}
+        primary: List[Optional[str]] = []
+        for invoice_id, invoice, invoice_keys in zip(invoice_set.ids, invoice_set.invoices, keys):
+            if invoice_keys is None:
+                primary.append(None)
+                continue
+            primary.append(invoice_keys.by_number or next(iter(invoice_keys.blocks), None))
+            record = self._record(invoice_id, invoice, invoice_keys.normalized_number, task_id)
+            for key in (invoice_keys.by_number, *invoice_keys.blocks):
+                if key:
+                    entries.setdefault(key, record)
+        with self._lock:
+            known = self.state_store.get_many(DUPLICATE_NAMESPACE, list(entries)) if entries else {}
+            added = {key: record for key, record in entries.items() if key not in known}
+            if added:
+                self.state_store.put_many(DUPLICATE_NAMESPACE, added)
+
+        new_rows, seen = [], set()
+        for row, key in enumerate(primary):
+            if key is None or (key not in known and key not in seen):
+                new_rows.append(row)
+            if key is not None:
+                seen.add(key)
+        return new_rows
+
+    def forget_project(self, project_id: int):
+        """Drop a deleted project's invoices from the index."""
+        with self._lock:
+            self.state_store.delete_prefix(DUPLICATE_NAMESPACE, f"{project_id}:")
+
+
+duplicate_index = DuplicateIndex()
@@ -1,8 +1,11 @@
 import pandas as pd
 import io
 import logging
-from typing import List
+from typing import List, Union
+import numpy as np
 from app.models import Invoice
+from app.utils.invoice_batch import ADDRESS_COLUMNS, InvoiceBatch
+from app.utils.amount_engine import CURRENCY_SYMBOLS
 from app.config import settings
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
@@ -13,6 +16,11 @@ import re
 
 logger = logging.getLogger(__name__)
 
+# ISO code -> the sign amounts are printed with; the first sign listed for a code wins ('$' for USD)
+CURRENCY_SIGNS = {}
+for sign, code in CURRENCY_SYMBOLS.items():
+    CURRENCY_SIGNS.setdefault(code, sign)
+
 class InvoiceExporter:
     def __init__(self):
         self.columns = [
@@ -21,9 +29,9 @@ class InvoiceExporter:
             "Description", "Pages"
         ]
         self.executor = ThreadPoolExecutor(max_workers=settings.MAX_WORKERS)
-        self.default_currency = '$'  # Default currency symbol
+        self.default_currency = '$'  # Default currency symbol, for invoices without a detected currency
 
-    async def export_invoices(self, invoices: List[Invoice], format: str) -> io.BytesIO:
+    async def export_invoices(self, invoices: Union[List[Invoice], InvoiceBatch], format: str) -> io.BytesIO:
         try:
             df = await self._create_dataframe(invoices)
             if format.lower() == 'csv':
@@ -36,7 +44,7 @@ class InvoiceExporter:
             logger.error(f"Error during invoice export: {str(e)}")
             raise
 
-    async def _create_dataframe(self, invoices: List[Invoice]) -> pd.DataFrame:
+    async def _create_dataframe(self, invoices: Union[List[Invoice], InvoiceBatch]) -> pd.DataFrame:
         loop = asyncio.get_event_loop()
         return await loop.run_in_executor(self.executor, self._create_dataframe_sync, invoices)
 
@@ -77,65 +85,57 @@ class InvoiceExporter:
         except ValueError:
             return 0
 
-    def _create_dataframe_sync(self, invoices: List[Invoice]) -> pd.DataFrame:
-        data = []
-        grand_total_sum = 0
-        final_total_sum = 0
+    def _currency_sign(self, currency) -> str:
+        if not currency:
+            return self.default_currency
+        # Codes without a sign of their own print as "CHF 12.50"
+        return CURRENCY_SIGNS.get(currency, f"{currency} ")
+
+    def _format_amounts(self, decimals: np.ndarray, signs: List[str]) -> List:
+        return [None if value is None else f"{sign}{self._format_decimal(value)}" for value, sign in zip(decimals, signs)]
+
+    def _join_address(self, batch: InvoiceBatch) -> np.ndarray:
+        # ", ".join of the non-empty parts, one column at a time
+        address = batch.address[ADDRESS_COLUMNS[0]]
+        for column in ADDRESS_COLUMNS[1:]:
+            part = batch.address[column]
+            separator = np.where((np.char.str_len(address) > 0) & (np.char.str_len(part) > 0), ', ', '')
+            address = np.char.add(np.char.add(address, separator), part)
+        return address
+
+    def _create_dataframe_sync(self, invoices: Union[List[Invoice], InvoiceBatch]) -> pd.DataFrame:
+        batch = invoices if isinstance(invoices, InvoiceBatch) else InvoiceBatch(invoices)
+        index = np.arange(1, len(batch) + 1)
+        signs = [self._currency_sign(invoice.currency) for invoice in batch.invoices]
         
-        for index, invoice in enumerate(invoices, 1):
-            # Combine address fields into a single address
-            address_parts = [
-                invoice.vendor.address.street,
-                invoice.vendor.address.city,
-                invoice.vendor.address.state,
-                invoice.vendor.address.postal_code,
-                invoice.vendor.address.country
-            ]
-            address = ", ".join([part for part in address_parts if part])
-            
+        # Columns are built whole; only the currency formatting is per value
+        df = pd.DataFrame({
+            "Filename": batch.filename,
+            "Invoice Number": [invoice.invoice_number for invoice in batch.invoices],
+            "Vendor Name": [invoice.vendor.name for invoice in batch.invoices],
+            "Address": self._join_address(batch) if len(batch) else [],
+            "Invoice Date": batch.invoice_date.astype(object),
+            "Grand Total": self._format_amounts(batch.decimals['grand_total'], signs),
+            "Taxes": self._format_amounts(batch.decimals['taxes'], signs),
+            "Final Total": self._format_amounts(batch.decimals['final_total'], signs),
             # Use "Purchase X" as the description
-            description = f"Purchase {index}"
-            
-            # Format monetary values with currency symbol
-            grand_total = None
-            if invoice.grand_total is not None:
-                grand_total_sum += float(invoice.grand_total)
-                grand_total = f"{self.default_currency}{self._format_decimal(invoice.grand_total)}"
-                
-            taxes = None
-            if invoice.taxes is not None:
-                taxes = f"{self.default_currency}{self._format_decimal(invoice.taxes)}"
-                
-            final_total = None
-            if invoice.final_total is not None:
-                final_total_sum += float(invoice.final_total)
-                final_total = f"{self.default_currency}{self._format_decimal(invoice.final_total)}"
-            
-            row = {
-                "Filename": invoice.filename,
-                "Invoice Number": invoice.invoice_number,
-                "Vendor Name": invoice.vendor.name,
-                "Address": address,
-                "Invoice Date": invoice.invoice_date,
-                "Grand Total": grand_total,
-                "Taxes": taxes,
-                "Final Total": final_total,
-                "Description": description,
-                "Pages": index 
-            }
-            data.append(row)
-
-        # Create DataFrame
-        df = pd.DataFrame(data, columns=self.columns)
+            "Description": np.char.add('Purchase ', index.astype(str)) if len(batch) else [],
+            "Pages": index,
+        }, columns=self.columns)
         
-        # Add Sum Total row
-        sum_row = {col: "" for col in self.columns}
-        sum_row["Vendor Name"] = "TOTAL"
-        sum_row["Grand Total"] = f"{self.default_currency}{self._format_decimal(grand_total_sum)}"
-        sum_row["Final Total"] = f"{self.default_currency}{self._format_decimal(final_total_sum)}"
+        # Add Sum Total rows, one per currency, so amounts in different currencies are never added up
+        sign_array = np.array(signs, dtype=object)
+        sum_rows = []
+        for sum_sign in dict.fromkeys(signs or [self.default_currency]):
+            mask = sign_array == sum_sign if signs else slice(None)
+            sum_row = {col: "" for col in self.columns}
+            sum_row["Vendor Name"] = "TOTAL"
+            sum_row["Grand Total"] = f"{sum_sign}{self._format_decimal(float(np.nansum(batch.amounts['grand_total'][mask])))}"
+            sum_row["Final Total"] = f"{sum_sign}{self._format_decimal(float(np.nansum(batch.amounts['final_total'][mask])))}"
+            sum_rows.append(sum_row)
         
-        # Append sum row to DataFrame
-        df = pd.concat([df, pd.DataFrame([sum_row], columns=self.columns)], ignore_index=True)
+        # Append sum rows to DataFrame
+        df = pd.concat([df, pd.DataFrame(sum_rows, columns=self.columns)], ignore_index=True)
         
         return df
 
@@ -170,14 +170,17 @@ class InvoiceExporter:
                 bottom=Side(style='medium')
             )
             
+            # Sheet rows of the sum rows (+2: header row, 1-based)
+            sum_rows = {index + 2 for index in np.flatnonzero(df["Vendor Name"].to_numpy() == "TOTAL")}
+            
             # Apply formatting to all cells
             for row_idx, row in enumerate(sheet.iter_rows(), 1):
                 for cell in row:
                     cell.border = medium_border
                     cell.alignment = Alignment(wrap_text=True, vertical='center')
                     
-                    # Highlight the sum row
-                    if row_idx == len(df) + 1:  # +1 for header row
+                    # Highlight the sum rows
+                    if row_idx in sum_rows:
                         cell.font = Font(bold=True)
                         cell.fill = PatternFill(start_color="E0E0E0", end_color="E0E0E0", fill_type="solid")
                     
@@ -209,6 +212,6 @@ class InvoiceExporter:
         output.seek(0)
         return output
 
-async def export_invoices(invoices: List[Invoice], format: str) -> io.BytesIO:
+async def export_invoices(invoices: Union[List[Invoice], InvoiceBatch], format: str) -> io.BytesIO:
     exporter = InvoiceExporter()
     return await exporter.export_invoices(invoices, format)
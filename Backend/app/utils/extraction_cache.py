@@ -0,0 +1,115 @@
+import json
+import zlib
+import hashlib
+import logging
+from typing import Dict, Optional
+import numpy as np
+from app.config import settings
+from app.models import Invoice
+from app.utils.parsing_service import LRUCache
+from app.utils.spatial_index import boxes_to_array
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever extraction logic changes so old cached invoices are not served
+EXTRACTOR_VERSION = "2"
+CACHE_PREFIX = "extracted"
+
+
+def _update_page_digest(digest, ocr_result: Dict):
+    digest.update((ocr_result.get('text') or '').encode('utf-8'))
+    digest.update(b'\x1e')
+    digest.update('\x1f'.join(ocr_result.get('words') or []).encode('utf-8'))
+    digest.update(b'\x1e')
+    boxes = ocr_result.get('box_array')
+    if boxes is None:
+        boxes = ocr_result.get('boxes') or []
+    if len(boxes):
+        # Whole pixels: the same scan always yields the same digest
+        digest.update(np.rint(boxes_to_array(boxes)).astype(np.int32).tobytes())
+    digest.update(b'\x1e')
+    digest.update(json.dumps(ocr_result.get('tables') or [], sort_keys=True, default=str).encode('utf-8'))
+    digest.update(json.dumps(ocr_result.get('key_value_pairs') or [], sort_keys=True, default=str).encode('utf-8'))
+    digest.update(str(ocr_result.get('num_pages', 1)).encode('ascii'))
+
+
+def extraction_key(ocr_result: Dict) -> str:
+    """
+    Stable digest of the normalized OCR payload (text, words, whole-pixel boxes,
+    layout) and EXTRACTOR_VERSION. Protos, image bytes and the filename are left
+    out, so the same page gives the same key in every process.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(EXTRACTOR_VERSION.encode('ascii'))
+    pages = ocr_result.get('pages') if ocr_result.get('is_multipage') else None
+    for page in pages or [ocr_result]:
+        digest.update(b'\x1d')
+        _update_page_digest(digest, page)
+    return f"{CACHE_PREFIX}:{EXTRACTOR_VERSION}:{digest.hexdigest()}"
+
+
+def serialize_invoice(invoice: Invoice) -> bytes:
+    payload = invoice.json(exclude_none=True, exclude_defaults=True, separators=(',', ':'))
+    return zlib.compress(payload.encode('utf-8'))
+
+
+def deserialize_invoice(data: bytes) -> Invoice:
+    return Invoice.parse_raw(zlib.decompress(data))
+
+
+class ExtractionCache:
+    """
+    Two-level cache of extracted invoices: a bounded in-process LRU in front of
+    Redis. Values are compressed compact JSON with a TTL; entries larger than
+    EXTRACTION_CACHE_MAX_BYTES are not stored.
+    """
+
+    def __init__(self, redis=None, size: int = None, ttl: int = None, max_bytes: int = None):
+        self.redis = redis
+        self.ttl = ttl or settings.EXTRACTION_CACHE_TTL
+        self.max_bytes = max_bytes or settings.EXTRACTION_CACHE_MAX_BYTES
+        self.local = LRUCache(size or settings.EXTRACTION_CACHE_SIZE)
+
+    def key_for(self, ocr_result: Dict) -> str:
+        # Computed once per OCR result, whichever caller gets there first
+        if 'extraction_key' not in ocr_result:
+            ocr_result['extraction_key'] = extraction_key(ocr_result)
+        return ocr_result['extraction_key']
+
+    async def get(self, ocr_result: Dict) -> Optional[Invoice]:
+        key = self.key_for(ocr_result)
+        data = self.local.get(key, None)
+        if data is None:
+            if self.redis:
+                try:
+                    data = await self.redis.get(key)
+                except Exception as e:
+                    logger.warning(f"Extraction cache read failed: {str(e)}")
+            if data is None:
+                return None
+            self.local.put(key, data)
+
+        try:
+            invoice = deserialize_invoice(data)
+        except Exception as e:
+            logger.warning(f"Discarding unreadable extraction cache entry {key}: {str(e)}")
+            return None
+        # The key ignores the filename, so identical pages uploaded under another name still hit
+        filename = ocr_result.get('filename')
+        return invoice.copy(update={'filename': filename}) if filename else invoice
+
+    async def put(self, ocr_result: Dict, invoice: Invoice):
+        key = self.key_for(ocr_result)
+        data = serialize_invoice(invoice)
+        if len(data) > self.max_bytes:
+            logger.info(f"Not caching extraction for {invoice.filename}: {len(data)} bytes")
+            return
+        self.local.put(key, data)
+        if self.redis:
+            try:
+                await self.redis.set(key, data, ex=self.ttl)
+            except Exception as e:
+                logger.warning(f"Extraction cache write failed: {str(e)}")
+
+    def clear(self):
+        self.local.clear()
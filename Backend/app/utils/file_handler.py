@@ -1,15 +1,21 @@
 import os
+import shutil
+import hashlib
 import zipfile
+import tempfile
+import multiprocessing
 import magic
+from collections import deque
 from fastapi import UploadFile, HTTPException
-from typing import List, Dict, Union
+from typing import Any, AsyncIterator, Callable, Deque, Iterable, List, Dict, NamedTuple, Optional, Tuple, Union
 import fitz  # PyMuPDF
 import io
 import uuid
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from app.config import settings
 from app.models import FileUpload
+from app.utils.rasterizer import RasterOptions, page_count, pdf_rasterizer, render_range
 from PIL import Image
 import logging
 from tenacity import retry, stop_after_attempt, wait_exponential
@@ -18,15 +24,240 @@ from tenacity import retry, stop_after_attempt, wait_exponential
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# libmagic only looks at the header; this is what documents are sniffed on
+SNIFF_BYTES = 8192
+SPOOL_CHUNK_SIZE = 1024 * 1024
+ALLOWED_DOCUMENT_TYPES = {'application/pdf', 'image/jpeg', 'image/png'}
+ALLOWED_UPLOAD_TYPES = ALLOWED_DOCUMENT_TYPES | {'application/zip'}
+
 class FileProcessingError(Exception):
     """Custom exception for file processing errors"""
     pass
 
+class UploadTooLargeError(FileProcessingError):
+    pass
+
+class UnsupportedFileTypeError(FileProcessingError):
+    pass
+
+class SpooledUpload(NamedTuple):
+    """An upload written to disk in one pass, with its size, SHA-256 and sniffed type."""
+    path: str
+    filename: str
+    content_type: str
+    size: int
+    sha256: str
+
+class _UploadWriter:
+    """Writes, hashes, sniffs and size-checks an upload in the same pass over its chunks."""
+
+    def __init__(self, directory: str, filename: str):
+        self.filename = os.path.basename(filename or '') or f"upload_{uuid.uuid4()}"
+        self.path = os.path.join(directory, self.filename)
+        self.file = open(self.path, 'wb')
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.head = b''
+        self.content_type: Optional[str] = None
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > settings.MAX_UPLOAD_SIZE:
+            raise UploadTooLargeError(f"{self.filename} exceeds the maximum upload size of {settings.MAX_UPLOAD_SIZE} bytes")
+        if self.content_type is None:
+            self.head += chunk[:SNIFF_BYTES - len(self.head)]
+            if len(self.head) >= SNIFF_BYTES:
+                self._sniff()
+        self.digest.update(chunk)
+        self.file.write(chunk)
+
+    def _sniff(self):
+        self.content_type = magic.from_buffer(self.head, mime=True)
+        if self.content_type not in ALLOWED_UPLOAD_TYPES:
+            raise UnsupportedFileTypeError(f"Unsupported file type {self.content_type}: {self.filename}")
+
+    def finish(self) -> SpooledUpload:
+        self.file.close()
+        if not self.size:
+            raise UnsupportedFileTypeError(f"{self.filename} is empty")
+        if self.content_type is None:
+            self._sniff()
+        return SpooledUpload(self.path, self.filename, self.content_type, self.size, self.digest.hexdigest())
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def _check_declared_size(filename: str, size: Optional[int]):
+    # Refuse before reading a byte when the client says up front how big the file is
+    if size is not None and size > settings.MAX_UPLOAD_SIZE:
+        raise UploadTooLargeError(f"{filename} exceeds the maximum upload size of {settings.MAX_UPLOAD_SIZE} bytes")
+
+def _pdf_entry(filename: str, content: bytes, images: Optional[List[bytes]] = None) -> Dict[str, any]:
+    if images is None:
+        with fitz.open(stream=content, filetype="pdf") as doc:
+            images = render_range(doc, 0, len(doc), RasterOptions.from_settings())
+    pages = [{
+        'filename': f"{filename}_page_{page_number}.png",
+        'content': image,
+        'page_number': page_number,
+        'total_pages': len(images)
+    } for page_number, image in enumerate(images, 1)]
+    return {
+        'filename': filename,
+        'content': content,
+        'pages': pages,
+        'is_multipage': len(pages) > 1
+    }
+
+def _image_entry(filename: str, content: bytes) -> Dict[str, any]:
+    with Image.open(io.BytesIO(content)) as img:
+        img_format = img.format.lower()
+        if img_format not in ['jpeg', 'jpg', 'png']:
+            raise ValueError(f"Unsupported image format: {img_format}")
+    return {
+        'filename': filename,
+        'content': content,
+        'pages': [{
+            'filename': filename,
+            'content': content,
+            'page_number': 1,
+            'total_pages': 1
+        }],
+        'is_multipage': False
+    }
+
+def decode_member(filename: str, path: str, content_type: str) -> Dict[str, any]:
+    """Decode one spooled ZIP member into a document entry. Runs on the decode pool."""
+    with open(path, 'rb') as file:
+        content = file.read()
+    if content_type == 'application/pdf':
+        return _pdf_entry(filename, content)
+    return _image_entry(filename, content)
+
+class ZipMember(NamedTuple):
+    """A spooled ZIP member and its page count, ready to be handed out page by page."""
+    filename: str
+    path: str
+    content_type: str
+    size: int
+    total_pages: int
+
+def inspect_member(filename: str, path: str, content_type: str) -> ZipMember:
+    """Count the pages of one spooled ZIP member without rendering it. Runs on the decode pool."""
+    total_pages = page_count(path) if content_type == 'application/pdf' else 1
+    return ZipMember(filename, path, content_type, os.path.getsize(path), total_pages)
+
+def entry_bytes(entry: Dict[str, any]) -> int:
+    # A single image shares its bytes with its only page
+    pages = [page['content'] for page in entry['pages'] if page['content'] is not entry['content']]
+    return len(entry['content']) + sum(len(content) for content in pages)
+
+class PageHandle:
+    """
+    One page of an upload: the file it lives in and its index, not its pixels.
+    The image is produced only when render_pages gets to it.
+    """
+
+    __slots__ = ('source', 'path', 'page_index', 'total_pages', 'content_type')
+
+    def __init__(self, source: str, path: str, page_index: int, total_pages: int, content_type: str):
+        self.source = source
+        self.path = path
+        self.page_index = page_index
+        self.total_pages = total_pages
+        self.content_type = content_type
+
+    @property
+    def page_number(self) -> int:
+        return self.page_index + 1
+
+    @property
+    def filename(self) -> str:
+        # Named as OCREngine names PDF pages, so page results and cache entries line up
+        if self.content_type == 'application/pdf':
+            return f"{self.source}_page{self.page_number}"
+        return self.source
+
+def render_page(page: PageHandle) -> bytes:
+    """PNG bytes of one page; images are passed through as they are."""
+    if page.content_type != 'application/pdf':
+        with open(page.path, 'rb') as file:
+            return file.read()
+    with fitz.open(page.path) as doc:
+        return render_range(doc, page.page_index, page.page_index + 1, RasterOptions.from_settings())[0]
+
+class _Decoding:
+    """A member on its way through the decode pool and what it holds in memory."""
+
+    __slots__ = ('filename', 'future', 'held', 'weigh')
+
+    def __init__(self, filename: str, future: asyncio.Future, size: int, weigh: Callable[[Any], int]):
+        # Until decoded, the spooled size is the best guess; afterwards the real figure
+        self.filename, self.future, self.held, self.weigh = filename, future, size, weigh
+        future.add_done_callback(self._settle)
+
+    def _settle(self, future: asyncio.Future):
+        if not future.cancelled() and future.exception() is None:
+            self.held = self.weigh(future.result())
+
 class FileHandler:
     def __init__(self, upload_dir: str = "/tmp/invoice_uploads"):
         self.upload_dir = upload_dir
         os.makedirs(self.upload_dir, exist_ok=True)
         self.executor = ThreadPoolExecutor(max_workers=settings.MAX_WORKERS)
+        self.decode_processes = settings.INGEST_PROCESSES
+        self.memory_budget = settings.INGEST_MEMORY_BUDGET
+        self._decode_pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def decode_pool(self) -> Union[ProcessPoolExecutor, ThreadPoolExecutor]:
+        if self.decode_processes <= 0:
+            return self.executor
+        if self._decode_pool is None:
+            # spawn: forked children would inherit the parent's thread pools without their threads
+            self._decode_pool = ProcessPoolExecutor(
+                max_workers=self.decode_processes,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return self._decode_pool
+
+    @property
+    def decode_window(self) -> int:
+        # Members decoding or decoded but not yet taken: enough to keep every worker busy
+        return 2 * max(self.decode_processes, settings.MAX_WORKERS, 1)
+
+    async def spool_upload(self, file: UploadFile, directory: str) -> SpooledUpload:
+        """
+        Stream an upload into `directory` in SPOOL_CHUNK_SIZE chunks, hashing
+        and sniffing it on the way. Raises UploadTooLargeError as soon as
+        MAX_UPLOAD_SIZE is passed and UnsupportedFileTypeError as soon as the
+        header is known; either way nothing is left on disk.
+        """
+        _check_declared_size(file.filename, getattr(file, 'size', None))
+        loop = asyncio.get_event_loop()
+        writer = _UploadWriter(directory, file.filename)
+        try:
+            while chunk := await file.read(SPOOL_CHUNK_SIZE):
+                await loop.run_in_executor(self.executor, writer.write, chunk)
+            return writer.finish()
+        except BaseException:
+            writer.abort()
+            raise
+
+    def spool_chunks(self, chunks: Iterable[bytes], filename: str, directory: str,
+                     declared_size: Optional[int] = None) -> SpooledUpload:
+        """spool_upload for synchronous callers, e.g. Django's UploadedFile.chunks()."""
+        _check_declared_size(filename, declared_size)
+        writer = _UploadWriter(directory, filename)
+        try:
+            for chunk in chunks:
+                writer.write(chunk)
+            return writer.finish()
+        except BaseException:
+            writer.abort()
+            raise
 
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
     async def save_upload(self, file: UploadFile) -> FileUpload:
@@ -115,6 +346,65 @@ class FileHandler:
                 logger.error(f"Error processing {file_upload.filename}: {str(e)}")
             raise FileProcessingError(f"Unable to process file: {str(e)}")
 
+    async def iter_pages(self, file_path: str, spool_dir: str) -> AsyncIterator[PageHandle]:
+        """
+        Handles for every page of an uploaded file, in document order, without
+        rendering anything. ZIP members go through iter_zip into spool_dir,
+        which the caller removes once the pages are rendered: their pages are
+        counted on the decode pool, and members spooled but not yet rendered
+        count against the memory budget by their size. A member that cannot
+        be read is logged and skipped.
+        """
+        if os.path.splitext(file_path)[1].lower() == '.zip':
+            async for member in self.iter_zip(file_path, spool_dir, inspect_member, lambda member: member.size):
+                for page_index in range(member.total_pages):
+                    yield PageHandle(member.filename, member.path, page_index, member.total_pages, member.content_type)
+            return
+
+        content_type = await asyncio.get_event_loop().run_in_executor(self.executor, self._sniff_file, file_path)
+        if content_type not in ALLOWED_DOCUMENT_TYPES:
+            raise FileProcessingError(f"Unsupported file type {content_type}: {os.path.basename(file_path)}")
+        async for page in self._document_pages(os.path.basename(file_path), file_path, content_type):
+            yield page
+
+    async def _document_pages(self, source: str, path: str, content_type: str) -> AsyncIterator[PageHandle]:
+        total_pages = 1
+        if content_type == 'application/pdf':
+            try:
+                total_pages = await asyncio.get_event_loop().run_in_executor(self.executor, page_count, path)
+            except Exception as e:
+                raise FileProcessingError(f"Unable to process PDF {source}: {str(e)}")
+        for page_index in range(total_pages):
+            yield PageHandle(source, path, page_index, total_pages, content_type)
+
+    def _sniff_file(self, file_path: str) -> str:
+        with open(file_path, 'rb') as file:
+            return magic.from_buffer(file.read(SNIFF_BYTES), mime=True)
+
+    async def render_pages(self, pages: AsyncIterator[PageHandle]) -> AsyncIterator[Tuple[PageHandle, bytes]]:
+        """
+        (page, PNG bytes) in page order. Each PDF is handed to the rasterizer
+        once, which renders its pages on every core a window ahead of the
+        caller, so only the pages in flight are ever held in memory.
+        """
+        loop = asyncio.get_event_loop()
+        stream, stream_path = None, None
+        try:
+            async for page in pages:
+                if page.content_type != 'application/pdf':
+                    yield page, await loop.run_in_executor(self.executor, render_page, page)
+                    continue
+                if page.path != stream_path:
+                    if stream is not None:
+                        await stream.aclose()
+                    stream, stream_path = pdf_rasterizer.render(page.path, total_pages=page.total_pages), page.path
+                # iter_pages hands out a document's pages in order, as the rasterizer returns them
+                _, image = await stream.__anext__()
+                yield page, image
+        finally:
+            if stream is not None:
+                await stream.aclose()
+
     async def process_uploads(self, file_uploads: List[FileUpload]) -> List[Dict[str, any]]:
         tasks = [self.process_upload(file_upload) for file_upload in file_uploads]
         results = await asyncio.gather(*tasks, return_exceptions=True)
@@ -128,62 +418,107 @@ class FileHandler:
  
 
     async def _process_zip(self, zip_path: str) -> List[Dict[str, any]]:
+        return [entry async for entry in self.iter_zip(zip_path)]
+
+    async def iter_zip(self, zip_path: str, spool_dir: Optional[str] = None,
+                       decode: Callable[[str, str, str], Any] = decode_member,
+                       weigh: Callable[[Any], int] = entry_bytes) -> AsyncIterator[Any]:
+        """
+        Decoded ZIP members in archive order, each as soon as it is ready.
+
+        Members are sniffed on their first SNIFF_BYTES and spooled to disk in
+        chunks, never read whole into memory, then decode(filename, path,
+        content_type) runs on the decode pool, several at a time: by default
+        PDFs are rasterized into document entries. Results not yet taken by
+        the caller count against the memory budget by weigh(result): over it,
+        spooling and decoding wait until the caller catches up. A member that
+        fails to decode is logged and skipped.
+
+        Members are spooled into spool_dir when given, and the caller removes
+        it; otherwise into a directory of their own, removed at the end.
+        """
         loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(self.executor, self._process_zip_sync, zip_path)
+        own_spool = spool_dir is None
+        if own_spool:
+            spool_dir = tempfile.mkdtemp(prefix='zip_', dir=settings.TEMP_FILE_DIR)
+        pending: Deque[_Decoding] = deque()
+        try:
+            try:
+                archive = await loop.run_in_executor(self.executor, zipfile.ZipFile, zip_path)
+            except Exception as e:
+                logger.error(f"Error processing zip file {zip_path}: {str(e)}")
+                raise FileProcessingError(f"Unable to process zip file {zip_path}: {str(e)}")
+
+            with archive:
+                for file_info in archive.infolist():
+                    if file_info.is_dir():
+                        continue
+                    while pending and (len(pending) >= self.decode_window or
+                                       sum(decoding.held for decoding in pending) >= self.memory_budget):
+                        entry = await self._take(pending)
+                        if entry is not None:
+                            yield entry
 
-    def _process_zip_sync(self, zip_path: str) -> List[Dict[str, any]]:
-        extracted_files = []
+                    spooled = await loop.run_in_executor(self.executor, self._spool_member, archive, file_info, spool_dir)
+                    if spooled is None:
+                        continue
+                    filename, path, content_type = spooled
+                    future = loop.run_in_executor(self.decode_pool, decode, filename, path, content_type)
+                    pending.append(_Decoding(filename, future, file_info.file_size, weigh))
+
+                    while pending and pending[0].future.done():
+                        entry = await self._take(pending)
+                        if entry is not None:
+                            yield entry
+
+            while pending:
+                entry = await self._take(pending)
+                if entry is not None:
+                    yield entry
+        finally:
+            for decoding in pending:
+                decoding.future.cancel()
+            if own_spool:
+                shutil.rmtree(spool_dir, ignore_errors=True)
+
+    async def _take(self, pending: Deque[_Decoding]) -> Any:
+        decoding = pending.popleft()
         try:
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                for file_info in zip_ref.infolist():
-                    if not file_info.filename.endswith('/'):  # Not a directory
-                        with zip_ref.open(file_info) as file:
-                            content = file.read()
-                            content_type = magic.from_buffer(content, mime=True)
-                            if content_type in settings.ALLOWED_EXTENSIONS:
-                                if content_type == 'application/pdf':
-                                    extracted_files.extend(self._process_pdf_content(file_info.filename, content))
-                                else:
-                                    extracted_files.append(self._process_image_content(file_info.filename, content))
+            return await decoding.future
         except Exception as e:
-            logger.error(f"Error processing zip file {zip_path}: {str(e)}")
-            raise FileProcessingError(f"Unable to process zip file {zip_path}: {str(e)}")
-        return extracted_files
+            logger.error(f"Error processing zip member {decoding.filename}: {str(e)}")
+            return None
+
+    def _spool_member(self, archive: zipfile.ZipFile, file_info: zipfile.ZipInfo, spool_dir: str) -> Optional[Tuple[str, str, str]]:
+        with archive.open(file_info) as member:
+            head = member.read(SNIFF_BYTES)
+            content_type = magic.from_buffer(head, mime=True)
+            if content_type not in ALLOWED_DOCUMENT_TYPES:
+                logger.info(f"Skipping zip member {file_info.filename}: unsupported type {content_type}")
+                return None
+            path = os.path.join(spool_dir, f"{uuid.uuid4()}{os.path.splitext(file_info.filename)[1]}")
+            with open(path, 'wb') as spool:
+                spool.write(head)
+                shutil.copyfileobj(member, spool, SPOOL_CHUNK_SIZE)
+        return file_info.filename, path, content_type
 
     async def _process_pdf(self, pdf_path: str) -> List[Dict[str, any]]:
         loop = asyncio.get_event_loop()
         try:
             with open(pdf_path, 'rb') as file:
                 content = await loop.run_in_executor(self.executor, file.read)
-            return await loop.run_in_executor(self.executor, self._process_pdf_content, os.path.basename(pdf_path), content)
+            images = [image async for _, image in pdf_rasterizer.render(pdf_path)]
+            return [_pdf_entry(os.path.basename(pdf_path), content, images)]
         except Exception as e:
             logger.error(f"Error processing PDF {pdf_path}: {str(e)}")
             raise FileProcessingError(f"Unable to process PDF {pdf_path}: {str(e)}")
 
     def _process_pdf_content(self, filename: str, content: bytes) -> List[Dict[str, any]]:
-        pages = []
         try:
-            doc = fitz.open(stream=content, filetype="pdf")
-            for page_num in range(len(doc)):
-                page = doc.load_page(page_num)
-                pix = page.get_pixmap()
-                img_bytes = pix.tobytes("png")
-                pages.append({
-                    'filename': f"{filename}_page_{page_num+1}.png",
-                    'content': img_bytes,
-                    'page_number': page_num + 1,
-                    'total_pages': len(doc)
-                })
-            doc.close()
+            return [_pdf_entry(filename, content)]
         except Exception as e:
             logger.error(f"Error processing PDF content {filename}: {str(e)}")
             raise FileProcessingError(f"Unable to process PDF content {filename}: {str(e)}")
-        return [{
-            'filename': filename,
-            'content': content,
-            'pages': pages,
-            'is_multipage': len(pages) > 1
-        }]
 
     async def _process_image(self, image_path: str) -> Dict[str, any]:
         loop = asyncio.get_event_loop()
@@ -197,21 +532,7 @@ class FileHandler:
 
     def _process_image_content(self, filename: str, content: bytes) -> Dict[str, any]:
         try:
-            with Image.open(io.BytesIO(content)) as img:
-                img_format = img.format.lower()
-                if img_format not in ['jpeg', 'jpg', 'png']:
-                    raise ValueError(f"Unsupported image format: {img_format}")
-            return {
-                'filename': filename,
-                'content': content,
-                'pages': [{
-                    'filename': filename,
-                    'content': content,
-                    'page_number': 1,
-                    'total_pages': 1
-                }],
-                'is_multipage': False
-            }
+            return _image_entry(filename, content)
         except Exception as e:
             logger.error(f"Error processing image content {filename}: {str(e)}")
             raise FileProcessingError(f"Unable to process image content {filename}: {str(e)}")
@@ -228,4 +549,10 @@ class FileHandler:
             logger.error(f"Error deleting file {file_path}: {str(e)}")
             raise FileProcessingError(f"Unable to delete file {file_path}: {str(e)}")
 
+    def shutdown(self):
+        if self._decode_pool is not None:
+            self._decode_pool.shutdown(wait=True)
+            self._decode_pool = None
+        self.executor.shutdown(wait=True)
+
 file_handler = FileHandler()
@@ -0,0 +1,83 @@
+import logging
+from decimal import Decimal
+from typing import List, Optional
+import numpy as np
+from app.models import Invoice
+
+logger = logging.getLogger(__name__)
+
+AMOUNT_COLUMNS = ('grand_total', 'taxes', 'final_total')
+ADDRESS_COLUMNS = ('street', 'city', 'state', 'postal_code', 'country')
+
+
+def _strings(values: List[Optional[str]]) -> np.ndarray:
+    # None and '' are the same thing to every consumer: a missing value
+    return np.array([value or '' for value in values], dtype=str)
+
+
+def _floats(values: List[Optional[Decimal]]) -> np.ndarray:
+    return np.array([np.nan if value is None else float(value) for value in values], dtype=np.float64)
+
+
+def blank(column: np.ndarray) -> np.ndarray:
+    """True where a string column is empty or only whitespace."""
+    if not len(column):
+        return np.zeros(0, dtype=bool)
+    return np.char.str_len(np.char.strip(column)) == 0
+
+
+class LineItems:
+    """The exploded line-item child table: one row per item, `invoice` is the parent row."""
+
+    __slots__ = ('objects', 'invoice', 'position', 'description', 'quantity', 'unit_price', 'total')
+
+    def __init__(self, invoices: List[Invoice]):
+        counts = np.fromiter((len(invoice.items or ()) for invoice in invoices), dtype=np.int64, count=len(invoices))
+        items = [item for invoice in invoices for item in invoice.items or ()]
+        self.objects = items
+        self.invoice = np.repeat(np.arange(len(invoices)), counts)
+        # 1-based position of the item within its invoice, as the warnings number them
+        starts = np.repeat(np.cumsum(counts) - counts, counts)
+        self.position = np.arange(len(items)) - starts + 1
+        self.description = _strings([item.description for item in items])
+        self.quantity = _floats([item.quantity for item in items])
+        self.unit_price = _floats([item.unit_price for item in items])
+        self.total = _floats([item.total for item in items])
+
+    def __len__(self) -> int:
+        return len(self.invoice)
+
+
+class InvoiceBatch:
+    """
+    Columnar view of the invoices of one run, built once after extraction.
+
+    Amounts are float64 with NaN for missing values, dates datetime64[D] with
+    NaT, and strings fixed-width NumPy arrays, so validation, anomaly checks and
+    export work on whole columns. The exact Decimal amounts are kept in object
+    columns for anything that prints them; line items are a child table.
+    """
+
+    def __init__(self, invoices: List[Invoice]):
+        self.invoices = invoices
+        self.filename = _strings([invoice.filename for invoice in invoices])
+        self.invoice_number = _strings([invoice.invoice_number for invoice in invoices])
+        self.vendor_name = _strings([invoice.vendor.name for invoice in invoices])
+        addresses = [invoice.vendor.address for invoice in invoices]
+        self.address = {
+            column: _strings([getattr(address, column, None) if address else None for address in addresses])
+            for column in ADDRESS_COLUMNS
+        }
+        self.has_address = np.array([bool(address) for address in addresses], dtype=bool)
+        self.invoice_date = np.array([invoice.invoice_date for invoice in invoices], dtype='datetime64[D]')
+        self.decimals = {
+            column: np.array([getattr(invoice, column) for invoice in invoices], dtype=object)
+            for column in AMOUNT_COLUMNS
+        }
+        self.amounts = {column: _floats(self.decimals[column]) for column in AMOUNT_COLUMNS}
+        self.pages = _floats([invoice.pages for invoice in invoices])
+        self.items = LineItems(invoices)
+        self.item_count = np.bincount(self.items.invoice, minlength=len(invoices))
+
+    def __len__(self) -> int:
+        return len(self.invoices)
@@ -0,0 +1,290 @@
+import threading
+import unicodedata
+from collections import Counter, deque
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Sequence, Tuple
+
+# Field labels per language, most specific first. A label's rank is its relative
+# position in its list (0.0 = most specific), so ranks compare across languages.
+LANGUAGE_PACKS: Dict[str, Dict[str, List[str]]] = {
+    'en': {
+        'invoice_number': ['invoice number', 'invoice no', 'invoice #', 'invoice num', 'invoice id',
+                           'inv no', 'inv #', 'inv', 'invoice'],
+        'invoice_date': ['invoice date', 'issue date', 'date of issue', 'billing date', 'document date',
+                         'statement date'],
+        'transaction_date': ['transaction date', 'posting date'],
+        'date': ['dated', 'date', 'issued'],
+        'due_date': ['due date', 'payment due'],
+        'document_title': ['tax invoice', 'invoice'],
+        'subtotal': ['sub total', 'subtotal', 'sub-total', 'net amount', 'net total', 'total before tax',
+                     'total excl tax', 'amount before tax'],
+        'tax': ['total tax', 'sales tax', 'tax amount', 'vat amount', 'vat', 'gst', 'hst', 'tax'],
+        'total': ['grand total', 'total due', 'amount due', 'balance due', 'total amount', 'invoice total',
+                  'amount payable', 'total'],
+        'header_description': ['description', 'desc', 'item', 'items', 'service', 'services', 'product',
+                               'products', 'details', 'particulars'],
+        'header_quantity': ['qty', 'quantity', 'count', 'units', 'hours', 'hrs'],
+        'header_unit_price': ['unit price', 'unit cost', 'price', 'rate', 'cost', 'unit'],
+        'header_total': ['line total', 'amount', 'total', 'sum'],
+    },
+    'fr': {
+        'invoice_number': ['numéro de facture', 'n° de facture', 'facture n°', 'facture no', 'n° facture',
+                           'no facture'],
+        'invoice_date': ['date de facture', 'date de facturation', "date d'émission"],
+        'date': ['date'],
+        'due_date': ["date d'échéance", 'échéance'],
+        'document_title': ['facture'],
+        'subtotal': ['sous-total', 'sous total', 'total ht', 'montant ht'],
+        'tax': ['montant tva', 'total tva', 'tva'],
+        'total': ['total ttc', 'montant ttc', 'net à payer', 'total à payer', 'total'],
+        'header_description': ['désignation', 'description', 'article', 'libellé'],
+        'header_quantity': ['quantité', 'qté'],
+        'header_unit_price': ['prix unitaire', 'pu ht', 'prix'],
+        'header_total': ['montant ht', 'montant', 'total'],
+    },
+    'de': {
+        'invoice_number': ['rechnungsnummer', 'rechnungs-nr', 'rechnung nr', 're-nr', 'belegnummer'],
+        'invoice_date': ['rechnungsdatum', 'belegdatum', 'ausstellungsdatum'],
+        'date': ['datum'],
+        'due_date': ['fälligkeitsdatum', 'fällig am', 'zahlbar bis'],
+        'document_title': ['rechnung'],
+        'subtotal': ['zwischensumme', 'nettobetrag', 'summe netto', 'netto'],
+        'tax': ['mwst betrag', 'mehrwertsteuer', 'umsatzsteuer', 'mwst', 'ust'],
+        'total': ['gesamtbetrag', 'rechnungsbetrag', 'endbetrag', 'summe brutto', 'brutto', 'gesamt', 'summe'],
+        'header_description': ['beschreibung', 'bezeichnung', 'artikel', 'leistung', 'position'],
+        'header_quantity': ['menge', 'anzahl', 'stk'],
+        'header_unit_price': ['einzelpreis', 'e-preis', 'preis'],
+        'header_total': ['gesamtpreis', 'betrag', 'gesamt', 'summe'],
+    },
+    'es': {
+        'invoice_number': ['número de factura', 'no. de factura', 'nº factura', 'factura nº', 'factura n°'],
+        'invoice_date': ['fecha de factura', 'fecha de emisión', 'fecha factura'],
+        'date': ['fecha'],
+        'due_date': ['fecha de vencimiento', 'vencimiento'],
+        'document_title': ['factura'],
+        'subtotal': ['base imponible', 'importe neto', 'subtotal'],
+        'tax': ['cuota iva', 'impuesto', 'iva'],
+        'total': ['total factura', 'total a pagar', 'importe total', 'total'],
+        'header_description': ['descripción', 'concepto', 'artículo', 'producto'],
+        'header_quantity': ['cantidad', 'cant', 'unidades', 'uds'],
+        'header_unit_price': ['precio unitario', 'precio'],
+        'header_total': ['importe', 'total'],
+    },
+    'pt': {
+        'invoice_number': ['número da fatura', 'nº da fatura', 'fatura nº', 'fatura n.º', 'n.º fatura'],
+        'invoice_date': ['data da fatura', 'data de emissão', 'data fatura'],
+        'date': ['data'],
+        'due_date': ['data de vencimento', 'vencimento'],
+        'document_title': ['fatura'],
+        'subtotal': ['total sem iva', 'base tributável', 'valor líquido', 'subtotal'],
+        'tax': ['valor iva', 'imposto', 'iva'],
+        'total': ['total a pagar', 'valor total', 'total geral', 'total'],
+        'header_description': ['descrição', 'artigo', 'produto', 'serviço'],
+        'header_quantity': ['quantidade', 'qtde', 'qtd'],
+        'header_unit_price': ['preço unitário', 'valor unitário', 'preço'],
+        'header_total': ['montante', 'valor', 'total'],
+    },
+}
+
+# Length-preserving normalization applied to both labels and page text
+_WHITESPACE = str.maketrans({'\n': ' ', '\r': ' ', '\t': ' ', '\f': ' ', '\v': ' ', ' ': ' '})
+
+
+def _normalize(text: str) -> str:
+    lowered = text.lower()
+    if len(lowered) != len(text):
+        # A few characters (e.g. 'İ') lower-case to two; keep offsets aligned with the original text
+        lowered = ''.join(ch.lower() if len(ch.lower()) == 1 else ch for ch in text)
+    return lowered.translate(_WHITESPACE)
+
+
+def _is_word_char(ch: str) -> bool:
+    # Hyphens and slashes join words: "inv" must not match inside "INV-2024-001"
+    return ch.isalnum() or ch in '-_/'
+
+
+def _strip_accents(text: str) -> str:
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+class LabelMatch(NamedTuple):
+    field: str
+    label: str
+    start: int
+    end: int
+    rank: float
+    languages: FrozenSet[str]
+
+
+class LabelTable:
+    """Label hits of one page, in text order, with per-field lookups."""
+
+    def __init__(self, text: str, matches: List[LabelMatch]):
+        self.text = text
+        self.matches = matches
+        self._by_field: Dict[str, List[LabelMatch]] = {}
+        for match in matches:
+            self._by_field.setdefault(match.field, []).append(match)
+
+    def __len__(self) -> int:
+        return len(self.matches)
+
+    def __contains__(self, field: str) -> bool:
+        return field in self._by_field
+
+    def get(self, *fields: str) -> List[LabelMatch]:
+        """Hits for any of `fields`, in text order."""
+        if len(fields) == 1:
+            return list(self._by_field.get(fields[0], []))
+        return sorted((match for field in fields for match in self._by_field.get(field, [])),
+                      key=lambda match: match.start)
+
+    def ranked(self, *fields: str) -> List[LabelMatch]:
+        """Hits for any of `fields`, most specific label first, then in text order."""
+        return sorted(self.get(*fields), key=lambda match: (match.rank, match.start))
+
+    def language(self) -> Optional[str]:
+        """Language whose labels alone explain most hits, if any label was language-specific."""
+        votes = Counter()
+        seen = set()
+        for match in self.matches:
+            if len(match.languages) == 1 and (match.start, match.end) not in seen:
+                seen.add((match.start, match.end))
+                votes[next(iter(match.languages))] += 1
+        return votes.most_common(1)[0][0] if votes else None
+
+
+class LabelAutomaton:
+    """
+    Aho-Corasick automaton over every field label of the enabled language packs.
+
+    One left-to-right pass over a page finds all labels at once; overlapping
+    hits are resolved leftmost-longest, so "sub total" is never also reported
+    as "total". Labels only match on word boundaries. Accent-free variants of
+    every label are added because OCR often drops diacritics.
+    """
+
+    def __init__(self, languages: Optional[Sequence[str]] = None, packs: Optional[Dict[str, Dict[str, List[str]]]] = None):
+        self.packs = packs if packs is not None else LANGUAGE_PACKS
+        self.languages = tuple(languages) if languages else tuple(self.packs)
+        self._build()
+
+    def _build(self):
+        entries: Dict[str, Dict[str, Tuple[float, set]]] = {}
+        for language in self.languages:
+            for field, labels in self.packs.get(language, {}).items():
+                for position, label in enumerate(labels):
+                    rank = position / len(labels)
+                    for variant in {_normalize(label), _normalize(_strip_accents(label))}:
+                        by_field = entries.setdefault(variant, {})
+                        best_rank, langs = by_field.get(field, (rank, set()))
+                        langs.add(language)
+                        by_field[field] = (min(best_rank, rank), langs)
+
+        self.patterns: List[str] = list(entries)
+        self._entries: List[Tuple[Tuple[str, float, FrozenSet[str]], ...]] = [
+            tuple((field, rank, frozenset(langs)) for field, (rank, langs) in entries[pattern].items())
+            for pattern in self.patterns
+        ]
+
+        # Trie
+        goto: List[Dict[str, int]] = [{}]
+        outputs: List[List[int]] = [[]]
+        for pattern_id, pattern in enumerate(self.patterns):
+            state = 0
+            for ch in pattern:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    outputs.append([])
+                state = nxt
+            outputs[state].append(pattern_id)
+
+        # Failure links, then fold them into a full transition table (a DFA) so the
+        # scan does exactly one dict lookup per character.
+        fail = [0] * len(goto)
+        delta: List[Dict[str, int]] = [dict(goto[0])] + [None] * (len(goto) - 1)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            outputs[state] = outputs[state] + outputs[fail[state]]
+            transitions = dict(delta[fail[state]])
+            transitions.update(goto[state])
+            delta[state] = transitions
+            for ch, nxt in goto[state].items():
+                fail[nxt] = delta[fail[state]].get(ch, 0) if state else 0
+                queue.append(nxt)
+
+        self._delta = delta
+        self._outputs = [tuple(output) for output in outputs]
+        self._lengths = [len(pattern) for pattern in self.patterns]
+        self._bounded_start = [pattern[0].isalnum() for pattern in self.patterns]
+        self._bounded_end = [pattern[-1].isalnum() for pattern in self.patterns]
+
+    def scan(self, text: str) -> LabelTable:
+        if not text:
+            return LabelTable(text or '', [])
+        normalized = _normalize(text)
+        delta = self._delta
+        outputs = self._outputs
+        lengths = self._lengths
+
+        bounded_start = self._bounded_start
+        bounded_end = self._bounded_end
+        text_length = len(normalized)
+
+        # Hits that sit on word boundaries; mid-word hits ("inv" in "environment") are dropped here
+        raw = []
+        state = 0
+        for position, ch in enumerate(normalized):
+            state = delta[state].get(ch, 0)
+            found = outputs[state]
+            if found:
+                end = position + 1
+                open_end = end < text_length and _is_word_char(normalized[end])
+                for pattern_id in found:
+                    if open_end and bounded_end[pattern_id]:
+                        continue
+                    start = end - lengths[pattern_id]
+                    if start > 0 and bounded_start[pattern_id] and _is_word_char(normalized[start - 1]):
+                        continue
+                    raw.append((start, end, pattern_id))
+
+        # Leftmost-longest, non-overlapping
+        raw.sort(key=lambda hit: (hit[0], hit[0] - hit[1]))
+        matches = []
+        last_end = 0
+        for start, end, pattern_id in raw:
+            if start < last_end:
+                continue
+            last_end = end
+            label = text[start:end]
+            for field, rank, languages in self._entries[pattern_id]:
+                matches.append(LabelMatch(field, label, start, end, rank, languages))
+        return LabelTable(text, matches)
+
+
+_registry_lock = threading.Lock()
+_label_automaton: Optional[LabelAutomaton] = None
+
+
+def register_language_pack(language: str, pack: Dict[str, List[str]]):
+    """Add (or replace) a language pack; the shared automaton is rebuilt on next use."""
+    global _label_automaton
+    with _registry_lock:
+        LANGUAGE_PACKS[language] = pack
+        _label_automaton = None
+
+
+def get_label_automaton() -> LabelAutomaton:
+    global _label_automaton
+    with _registry_lock:
+        if _label_automaton is None:
+            _label_automaton = LabelAutomaton()
+        return _label_automaton
+
+
+def scan_labels(text: str) -> LabelTable:
+    return get_label_automaton().scan(text)
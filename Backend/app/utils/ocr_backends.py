@@ -0,0 +1,268 @@
+import io
+import asyncio
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from app.config import settings
+from app.utils.spatial_index import boxes_to_array
+from app.utils.preflight import BULK_QUEUE
+from app.utils.cassette import google_client
+
+logger = logging.getLogger(__name__)
+
+Box = List[Tuple[int, int]]
+
+
+class PageOCR(NamedTuple):
+    """What every OCR backend returns for one page image."""
+    words: List[str]
+    boxes: List[Box]
+    text: str
+    tables: List[List[List[str]]]
+    key_value_pairs: List[Dict[str, str]]
+    # The engine's own response, for callers that need more than the above
+    raw: Any = None
+    # The backend that produced it, set by OCREngine.annotate
+    backend: str = ''
+
+    def to_result(self) -> Dict:
+        """The OCR result dictionary the extraction pipeline works on."""
+        return {
+            "words": self.words,
+            "boxes": self.boxes,
+            "box_array": boxes_to_array(self.boxes),
+            "text": self.text,
+            "tables": self.tables,
+            "key_value_pairs": self.key_value_pairs,
+            "full_response": self.raw,
+            "ocr_backend": self.backend,
+            "is_multipage": False,
+            "num_pages": 1
+        }
+
+
+def split_key_value(text: str) -> Optional[Dict[str, str]]:
+    if ':' in text:
+        key, value = text.split(':', 1)
+        return {key.strip(): value.strip()}
+    return None
+
+
+class OCRBackend:
+    """An OCR engine: annotate(filename, image) -> PageOCR for one page image."""
+
+    name = ''
+
+    async def annotate(self, filename: str, image: bytes) -> PageOCR:
+        raise NotImplementedError
+
+    def shutdown(self):
+        pass
+
+
+class VisionBackend(OCRBackend):
+    """
+    Google Cloud Vision document text detection. Words, tables and key-value
+    pairs all come out of a single call per page.
+    """
+
+    name = 'vision'
+
+    def __init__(self, client=None):
+        self._client = client
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # Created on first use, so other backends run without Google credentials
+        with self._lock:
+            if self._client is None:
+                from google.cloud import vision
+                self._client = google_client('vision', vision.ImageAnnotatorClient)
+        return self._client
+
+    async def annotate(self, filename: str, image: bytes) -> PageOCR:
+        from google.cloud import vision
+        try:
+            response = await asyncio.to_thread(self.client.document_text_detection, vision.Image(content=image))
+        except Exception as e:
+            logger.error(f"Google Cloud Vision API error for {filename}: {str(e)}")
+            raise
+        document = response.full_text_annotation
+        logger.info(f"Google Cloud Vision extracted text: {document.text[:500]}...")
+
+        words, boxes, tables, key_value_pairs = [], [], [], []
+        for page in document.pages:
+            for block in page.blocks:
+                for paragraph in block.paragraphs:
+                    for word in paragraph.words:
+                        words.append(''.join([symbol.text for symbol in word.symbols]))
+                        boxes.append([(vertex.x, vertex.y) for vertex in word.bounding_box.vertices])
+                if block.block_type == vision.Block.BlockType.TABLE:
+                    tables.append(self._extract_table(block))
+                elif block.block_type == vision.Block.BlockType.TEXT:
+                    key_value_pair = self._extract_key_value_pair(block)
+                    if key_value_pair:
+                        key_value_pairs.append(key_value_pair)
+        return PageOCR(words, boxes, document.text, tables, key_value_pairs, response)
+
+    @staticmethod
+    def _extract_table(block) -> List[List[str]]:
+        table = []
+        for paragraph in block.paragraphs:
+            table_row = [''.join([symbol.text for symbol in word.symbols]) for word in paragraph.words]
+            if table_row:
+                table.append(table_row)
+        return table
+
+    @staticmethod
+    def _extract_key_value_pair(block) -> Optional[Dict[str, str]]:
+        text = " ".join(''.join([''.join([symbol.text for symbol in word.symbols]) for word in paragraph.words])
+                        for paragraph in block.paragraphs)
+        return split_key_value(text.strip())
+
+
+def tesseract_page(image: bytes, lang: str) -> PageOCR:
+    """Worker side: OCR one page image with Tesseract, words grouped into lines as it found them."""
+    import pytesseract
+    from PIL import Image
+    data = pytesseract.image_to_data(Image.open(io.BytesIO(image)), lang=lang, output_type=pytesseract.Output.DICT)
+
+    words, boxes, lines = [], [], {}
+    for index, word in enumerate(data['text']):
+        word = word.strip()
+        if not word or float(data['conf'][index]) < 0:
+            continue
+        left, top = data['left'][index], data['top'][index]
+        right, bottom = left + data['width'][index], top + data['height'][index]
+        words.append(word)
+        boxes.append([(left, top), (right, top), (right, bottom), (left, bottom)])
+        line = (data['block_num'][index], data['par_num'][index], data['line_num'][index])
+        lines.setdefault(line, []).append(word)
+
+    text = '\n'.join(' '.join(line) for line in lines.values())
+    key_value_pairs = [pair for pair in (split_key_value(' '.join(line)) for line in lines.values()) if pair]
+    # Tesseract finds no tables; the layout extractor rebuilds line items from the boxes
+    return PageOCR(words, boxes, text, [], key_value_pairs)
+
+
+class TesseractBackend(OCRBackend):
+    """
+    Local Tesseract OCR on a process pool: no network, no per-page cost.
+    Tesseract is CPU-bound, so pages are spread over TESSERACT_PROCESSES
+    worker processes rather than threads.
+    """
+
+    name = 'tesseract'
+
+    def __init__(self, max_workers: Optional[int] = None, lang: Optional[str] = None):
+        self.max_workers = max_workers or settings.TESSERACT_PROCESSES
+        self.lang = lang or settings.TESSERACT_LANG
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: forked children would inherit the parent's thread pools without their threads
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return self._pool
+
+    async def annotate(self, filename: str, image: bytes) -> PageOCR:
+        try:
+            return await asyncio.get_event_loop().run_in_executor(self.pool, tesseract_page, image, self.lang)
+        except Exception as e:
+            logger.error(f"Tesseract OCR error for {filename}: {str(e)}")
+            raise
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+
+class FakeBackend(OCRBackend):
+    """
+    Deterministic OCR without an engine, for offline runs and benchmarks: the
+    text registered for a page's filename, or a line naming the page, laid out
+    one line per row on a fixed grid.
+    """
+
+    name = 'fake'
+
+    LINE_HEIGHT = 30
+    CHAR_WIDTH = 10
+
+    def __init__(self, pages: Optional[Dict[str, str]] = None, latency: float = 0.0):
+        self.pages = dict(pages or {})
+        self.latency = latency
+
+    def add(self, filename: str, text: str):
+        self.pages[filename] = text
+
+    async def annotate(self, filename: str, image: bytes) -> PageOCR:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        text = self.pages.get(filename, f"Page {filename}")
+
+        words, boxes, key_value_pairs = [], [], []
+        for row, line in enumerate(text.splitlines()):
+            top, left = row * self.LINE_HEIGHT, 0
+            for word in line.split():
+                right, bottom = left + len(word) * self.CHAR_WIDTH, top + self.LINE_HEIGHT - 10
+                words.append(word)
+                boxes.append([(left, top), (right, top), (right, bottom), (left, bottom)])
+                left = right + self.CHAR_WIDTH
+            key_value_pair = split_key_value(line.strip())
+            if key_value_pair:
+                key_value_pairs.append(key_value_pair)
+        return PageOCR(words, boxes, text, [], key_value_pairs)
+
+
+OCR_BACKENDS = {backend.name: backend for backend in (VisionBackend, TesseractBackend, FakeBackend)}
+
+_backends: Dict[str, OCRBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_ocr_backend(name: str) -> OCRBackend:
+    """The shared instance of a backend, by name."""
+    if name not in OCR_BACKENDS:
+        raise ValueError(f"Unknown OCR backend: {name}")
+    with _backends_lock:
+        if name not in _backends:
+            _backends[name] = OCR_BACKENDS[name]()
+        return _backends[name]
+
+
+def set_ocr_backend(backend: OCRBackend):
+    """Replace the shared instance of a backend, e.g. a FakeBackend with registered pages."""
+    with _backends_lock:
+        _backends[backend.name] = backend
+
+
+def resolve_ocr_backend(requested: Optional[str] = None, project_id: Optional[int] = None,
+                        queue: Optional[str] = None) -> str:
+    """
+    The backend for a task: the one requested for it, else the project's
+    (OCR_PROJECT_BACKENDS), else the bulk tier's for bulk jobs
+    (OCR_BULK_BACKEND), else OCR_BACKEND.
+    """
+    name = (requested
+            or settings.OCR_PROJECT_BACKENDS.get(str(project_id))
+            or (settings.OCR_BULK_BACKEND if queue == BULK_QUEUE else None)
+            or settings.OCR_BACKEND)
+    if name not in OCR_BACKENDS:
+        raise ValueError(f"Unknown OCR backend: {name}")
+    return name
+
+
+def shutdown_ocr_backends():
+    with _backends_lock:
+        for backend in _backends.values():
+            backend.shutdown()
+        _backends.clear()
@@ -2,7 +2,7 @@ import asyncio
 from typing import List, Dict, Tuple, Optional
 import io
 import logging
-from google.cloud import vision, documentai_v1 as documentai
+from google.cloud import documentai_v1 as documentai
 import cv2
 import numpy as np
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
@@ -17,7 +17,13 @@ import json
 import hashlib 
 import time
 import mimetypes
-from app.utils.data_extractor import extract_invoice_data
+from app.utils.data_extractor import extract_invoice_data, is_invoice_complete, extract_from_template, learn_template
+from app.utils.data_extractor import get_cached_invoice, cache_invoice
+from app.utils.batch_extraction import batch_extractor
+from app.utils.docai_adapter import DocAIFields
+from app.utils.preflight import throughput
+from app.utils.ocr_backends import PageOCR, get_ocr_backend
+from app.utils.cassette import google_client
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -32,11 +38,7 @@ class DecimalEncoder(json.JSONEncoder):
 
 class OCREngine:
     def __init__(self):
-        self.gcv_client = vision.ImageAnnotatorClient()
-        endpoint = settings.DOCAI_ENDPOINT
-        self.docai_client = documentai.DocumentProcessorServiceClient(
-               client_options={"api_endpoint": endpoint}
-        )
+        self._docai_client = None
 
         self.redis = None
         self.thread_executor = ThreadPoolExecutor(max_workers=settings.MAX_WORKERS)
@@ -44,6 +46,15 @@ class OCREngine:
 
     async def initialize(self):
         self.redis = await aioredis.from_url(settings.REDIS_URL)
+
+    @property
+    def docai_client(self) -> documentai.DocumentProcessorServiceClient:
+        # Created on first use, so the pipeline runs offline with a local OCR backend
+        if self._docai_client is None:
+            self._docai_client = google_client('docai', lambda: documentai.DocumentProcessorServiceClient(
+                client_options={"api_endpoint": settings.DOCAI_ENDPOINT}
+            ))
+        return self._docai_client
     
     async def process_documents(self, documents: List[Dict[str, any]]) -> Dict[str, Dict]:
         results = {}
@@ -93,6 +104,19 @@ class OCREngine:
 
         return results
     
+    async def process_page(self, filename: str, content: bytes, backend: Optional[str] = None) -> Dict:
+        """
+        OCR one rendered page with the named backend (OCR_BACKEND by default).
+        Extraction is left to extract_pages, so a document's pages go in one batch.
+        """
+        ocr_result = await self._process_single_page({'filename': filename, 'content': content, 'original_content': content},
+                                                     backend)
+        ocr_result['filename'] = filename
+        return ocr_result
+
+    async def extract_pages(self, ocr_results: List[Dict], project_id: Optional[int] = None) -> List[Invoice]:
+        return await self._extract_invoices(ocr_results, project_id)
+
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
     async def _process_document(self, document):
         try:
@@ -100,6 +124,10 @@ class OCREngine:
                 file_path = document
                 file_name = os.path.basename(file_path)
                 
+                if file_name.lower().endswith('.pdf'):
+                    # Opened by path: the PDF itself is never copied into memory
+                    return await self._process_pdf_as_separate_invoices({'filename': file_name, 'path': file_path})
+                
                 with open(file_path, 'rb') as f:
                     content = f.read()
                 
@@ -145,11 +173,7 @@ class OCREngine:
             ocr_result['original_content'] = document['original_content']
             ocr_result['filename'] = document.get('filename', '')
             
-            # Get Document AI results
-            docai_result = await self._get_docai_results(ocr_result)
-            
-            # Use DataExtractor to extract final structured data
-            extracted_data = await extract_invoice_data(ocr_result, docai_result)
+            extracted_data = await self._extract_invoice(ocr_result)
             
             if self.redis:
                 content_hash = hashlib.md5(document['content']).hexdigest()
@@ -177,12 +201,14 @@ class OCREngine:
             
             logger.info(f"Processing PDF as separate invoices: {document['filename']}")
             
-            # Open the PDF
-            pdf_bytes = io.BytesIO(document['content'])
-            pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+            # Open the PDF: by path when it is on disk, else straight from its bytes
+            if document.get('path'):
+                pdf_document = fitz.open(document['path'])
+            else:
+                pdf_document = fitz.open(stream=document['content'], filetype="pdf")
             
-            # Create a list to hold all the invoice results
-            invoices = []
+            # OCR every page first, then extract all pages as one batch
+            ocr_results = []
             
             # Process each page as a separate invoice
             for page_num in range(len(pdf_document)):
@@ -203,20 +229,14 @@ class OCREngine:
                 # Process this page as a single document
                 ocr_result = await self._process_single_page(page_document)
                 ocr_result['filename'] = page_document['filename']
-                
-                # Get Document AI results for this page
-                docai_result = await self._get_docai_results(ocr_result)
-                
-                # Extract invoice data for this page
-                invoice = await extract_invoice_data(ocr_result, docai_result)
-                
-                # Add to our list of invoices
-                invoices.append(invoice)
+                ocr_results.append(ocr_result)
                 
                 logger.info(f"Processed page {page_num+1}/{len(pdf_document)} of {document['filename']}")
             
             pdf_document.close()
             
+            invoices = await self._extract_invoices(ocr_results)
+            
             # Return the list of invoices
             return invoices
         except ImportError:
@@ -226,6 +246,51 @@ class OCREngine:
             logger.error(f"Error processing PDF as separate invoices: {str(e)}")
             raise
     
+    async def _extract_invoice(self, ocr_result: Dict) -> Invoice:
+        return (await self._extract_invoices([ocr_result]))[0]
+    
+    async def _extract_invoices(self, ocr_results: List[Dict], project_id: Optional[int] = None) -> List[Invoice]:
+        """
+        Cheapest source first: the extraction cache, a learned vendor template of the project,
+        then the Vision layout (on the process pool, in chunks), and Document AI
+        only for pages whose fields are still missing. Confident results teach
+        the template store so the next invoice from the vendor skips both.
+        """
+        invoices: List[Optional[Invoice]] = [await get_cached_invoice(result) for result in ocr_results]
+        computed = [idx for idx, invoice in enumerate(invoices) if invoice is None]
+        if len(computed) < len(ocr_results):
+            logger.info(f"Extraction cache hits: {len(ocr_results) - len(computed)}/{len(ocr_results)}")
+        
+        templated = await asyncio.gather(*[extract_from_template(ocr_results[idx], project_id) for idx in computed])
+        for idx, invoice in zip(computed, templated):
+            invoices[idx] = invoice
+        
+        pending = [idx for idx in computed if invoices[idx] is None]
+        layout_results = await batch_extractor.extract([ocr_results[idx] for idx in pending])
+        
+        incomplete = []
+        for idx, invoice in zip(pending, layout_results):
+            invoices[idx] = invoice
+            if is_invoice_complete(invoice):
+                logger.info(f"Layout extraction complete for {ocr_results[idx].get('filename', '')}, skipping Document AI")
+                await learn_template(ocr_results[idx], invoice, project_id)
+            else:
+                incomplete.append(idx)
+        throughput.record_docai(len(ocr_results), len(incomplete))
+        
+        async def with_docai(idx: int) -> Invoice:
+            docai_result = await self._get_docai_results(ocr_results[idx])
+            invoice = await extract_invoice_data(ocr_results[idx], docai_result, fallback=invoices[idx])
+            await learn_template(ocr_results[idx], invoice, project_id)
+            return invoice
+        
+        for idx, invoice in zip(incomplete, await asyncio.gather(*[with_docai(idx) for idx in incomplete])):
+            invoices[idx] = invoice
+        
+        for idx in computed:
+            await cache_invoice(ocr_results[idx], invoices[idx])
+        return invoices
+    
     async def _process_multipage(self, document: Dict[str, any]) -> Dict:
         results = await asyncio.gather(*[self._process_single_page({'content': page['content'], 'filename': f"{document['filename']}_page{i}", 'original_content': page['content']}) for i, page in enumerate(document['pages'], 1)])
         return {
@@ -236,17 +301,14 @@ class OCREngine:
             "filename": document.get('filename', '')
         }
  
-    async def _process_single_page(self, document: Dict[str, any]) -> Dict:
+    async def _process_single_page(self, document: Dict[str, any], backend: Optional[str] = None) -> Dict:
         image_bytes = document['content']
         image_name = document.get('filename', '')
         
         try:
             preprocessed_image = await self._preprocess_image(image_bytes)
-            ocr_result, layout_result = await asyncio.gather(
-                self._process_with_gcv(image_name, preprocessed_image),
-                self._analyze_layout(preprocessed_image)
-            )
-            ocr_result.update(layout_result)
+            page_ocr = await self.annotate(image_name, preprocessed_image, backend)
+            ocr_result = page_ocr.to_result()
             ocr_result['content'] = image_bytes
             if 'original_content' in document:
                 ocr_result['original_content'] = document['original_content']
@@ -272,85 +334,20 @@ class OCREngine:
             return image_bytes
         return buffer.tobytes()
 
-    async def _process_with_gcv(self, image_name: str, image_bytes: bytes) -> Dict:
-        image = vision.Image(content=image_bytes)
+    async def annotate(self, filename: str, image: bytes, backend: Optional[str] = None) -> PageOCR:
+        """
+        OCR one preprocessed page image, falling back to OCR_FALLBACK_BACKEND
+        when the backend fails; the result names the backend that produced it.
+        """
+        name = backend or settings.OCR_BACKEND
         try:
-            response = await asyncio.to_thread(self.gcv_client.document_text_detection, image)
-            document = response.full_text_annotation
-
-            words = []
-            boxes = []
-            text = document.text
-            
-            logger.info(f"Google Cloud Vision extracted text: {text[:500]}...") 
-            
-            for page in document.pages:
-                for block in page.blocks:
-                    for paragraph in block.paragraphs:
-                        for word in paragraph.words:
-                            word_text = ''.join([symbol.text for symbol in word.symbols])
-                            words.append(word_text)
-                            vertices = [(vertex.x, vertex.y) for vertex in word.bounding_box.vertices]
-                            boxes.append(vertices)
-
-            return {
-                "words": words,
-                "boxes": boxes,
-                "text": text,
-                "full_response": response,
-                "is_multipage": False,
-                "num_pages": 1
-            }
+            return (await get_ocr_backend(name).annotate(filename, image))._replace(backend=name)
         except Exception as e:
-            logger.error(f"Google Cloud Vision API error for {image_name}: {str(e)}")
-            raise
-
-    async def _analyze_layout(self, image_bytes: bytes) -> Dict:
-        image = vision.Image(content=image_bytes)
-        try:
-            response = await asyncio.to_thread(self.gcv_client.document_text_detection, image)
-            return self._parse_layout(response)
-        except Exception as e:
-            logger.error(f"Layout analysis error: {str(e)}")
-            raise
-
-    def _parse_layout(self, response) -> Dict:
-        layout = {"tables": [], "key_value_pairs": []}
-        for page in response.full_text_annotation.pages:
-            for block in page.blocks:
-                if block.block_type == vision.Block.BlockType.TABLE:
-                    table = self._extract_table(block)
-                    layout["tables"].append(table)
-                elif block.block_type == vision.Block.BlockType.TEXT:
-                    key_value_pair = self._extract_key_value_pair(block)
-                    if key_value_pair:
-                        layout["key_value_pairs"].append(key_value_pair)
-        return layout
-    
-    def _extract_table(self, block) -> List[List[str]]:
-        table = []
-        
-        for paragraph in block.paragraphs:
-            table_row = []
-            for word in paragraph.words:
-                cell_text = ''.join([symbol.text for symbol in word.symbols])
-                table_row.append(cell_text)
-            if table_row:
-                table.append(table_row)
-        return table
-
-    def _extract_key_value_pair(self, block) -> Dict[str, str]:
-        text = ""
-        for paragraph in block.paragraphs:
-            paragraph_text = ''.join([''.join([symbol.text for symbol in word.symbols]) 
-                                     for word in paragraph.words])
-            text += paragraph_text + " "
-        
-        text = text.strip()
-        if ':' in text:
-            key, value = text.split(':', 1)
-            return {key.strip(): value.strip()}
-        return None    
+            fallback = settings.OCR_FALLBACK_BACKEND
+            if not fallback or fallback == name:
+                raise
+            logger.warning(f"OCR backend {name} failed for {filename}, falling back to {fallback}: {str(e)}")
+            return (await get_ocr_backend(fallback).annotate(filename, image))._replace(backend=fallback)
 
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
     async def _get_docai_results(self, ocr_result: Dict) -> Optional[Dict]:
@@ -388,10 +385,10 @@ class OCREngine:
             if hasattr(response, 'document') and hasattr(response.document, 'entities'):
                  logger.info(f"Document AI extracted entities: {[f'{e.type_}: {e.mention_text}' for e in response.document.entities]}")
             
-            # Extract entities into a dictionary
-            entities = {}
-            if hasattr(response, 'document') and hasattr(response.document, 'entities'):
-                entities = {e.type_: e.mention_text for e in response.document.entities}
+            # Keep every entity with its confidence and normalized value; the flat
+            # dictionary holds the highest-confidence mention per type
+            fields = DocAIFields.from_document(getattr(response, 'document', None))
+            entities = fields.as_flat_dict()
             
             # Extract tables if available
             tables = []
@@ -409,6 +406,7 @@ class OCREngine:
             
             return {
                 'entities': entities,
+                'fields': fields,
                 'tables': tables,
                 'document': response.document
             }
@@ -454,6 +452,7 @@ class OCREngine:
     async def cleanup(self):
         self.thread_executor.shutdown(wait=True)
         self.process_executor.shutdown(wait=True)
+        batch_extractor.shutdown()
         if self.redis:
             await self.redis.close()    
 
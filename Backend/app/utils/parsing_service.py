@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+from datetime import datetime, date
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+from app.config import settings
+from app.utils.date_engine import parse_date_string
+from app.utils.amount_engine import AmountConvention, decimal_separator_for_locale, normalize_amount
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATE_ORDERS = ('DMY', 'MDY', 'YMD')
+
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Small thread-safe bounded LRU map that, unlike functools.lru_cache, can be probed without computing."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: 'OrderedDict' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=_MISSING):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+class ParsingService:
+    """
+    Shared date and amount parsing with bounded LRU memoization.
+
+    The same strings ("31/12/2023", "1,250.00") recur across the pages of a job
+    and across jobs, so every lookup is keyed by (string, date order, locale)
+    and only cache misses reach dateparser or price_parser. The *_async batch
+    methods resolve cache hits inline and send all misses for a page to the
+    executor in one submission.
+    """
+
+    def __init__(self, cache_size: int = None, executor: Optional[ThreadPoolExecutor] = None):
+        self.cache_size = cache_size or settings.PARSE_CACHE_SIZE
+        self.executor = executor or ThreadPoolExecutor(max_workers=settings.MAX_WORKERS)
+        self.date_cache = LRUCache(self.cache_size)
+        self.amount_cache = LRUCache(self.cache_size)
+
+    # Dates
+
+    def parse_date(self, date_str: str, date_order: str = 'DMY', locale: Optional[str] = None) -> Optional[date]:
+        if not date_str or not date_str.strip():
+            return None
+        # Today's date is part of the key so relative expressions never outlive their day
+        key = (date_str.strip(), date_order, locale, date.today())
+        parsed_date = self.date_cache.get(key)
+        if parsed_date is _MISSING:
+            parsed_date = self._parse_date_uncached(*key)
+            self.date_cache.put(key, parsed_date)
+        return parsed_date
+
+    def parse_date_any_order(self, date_str: str, date_orders: Sequence[str] = DEFAULT_DATE_ORDERS,
+                             locale: Optional[str] = None) -> Optional[date]:
+        for date_order in date_orders:
+            parsed_date = self.parse_date(date_str, date_order, locale)
+            if parsed_date:
+                return parsed_date
+        return None
+
+    def parse_dates(self, candidates: Sequence[str], date_orders: Sequence[str] = DEFAULT_DATE_ORDERS,
+                    locale: Optional[str] = None) -> List[Optional[date]]:
+        return [self.parse_date_any_order(candidate, date_orders, locale) for candidate in candidates]
+
+    async def parse_dates_async(self, candidates: Sequence[str], date_orders: Sequence[str] = DEFAULT_DATE_ORDERS,
+                                locale: Optional[str] = None) -> List[Optional[date]]:
+        results: List[Optional[date]] = []
+        pending = []
+        for idx, candidate in enumerate(candidates):
+            resolved = self._resolve_inline(candidate, date_orders, locale)
+            results.append(None if resolved is _MISSING else resolved)
+            if resolved is _MISSING:
+                pending.append(idx)
+
+        if pending:
+            loop = asyncio.get_event_loop()
+            parsed = await loop.run_in_executor(
+                self.executor, self.parse_dates, [candidates[idx] for idx in pending], tuple(date_orders), locale
+            )
+            for idx, parsed_date in zip(pending, parsed):
+                results[idx] = parsed_date
+        return results
+
+    def _resolve_inline(self, date_str: str, date_orders: Sequence[str], locale: Optional[str]):
+        """Answer from the cache or the regex fast path; _MISSING means dateparser is needed."""
+        if not date_str or not date_str.strip():
+            return None
+        key_text = date_str.strip()
+        today = date.today()
+        for date_order in date_orders:
+            parsed_date = self.date_cache.get((key_text, date_order, locale, today))
+            if parsed_date is _MISSING:
+                parsed_date = parse_date_string(key_text, date_order)
+                if parsed_date is None:
+                    return _MISSING
+                self.date_cache.put((key_text, date_order, locale, today), parsed_date)
+            if parsed_date:
+                return parsed_date
+        return None
+
+    def _parse_date_uncached(self, date_str: str, date_order: str, locale: Optional[str], today: date) -> Optional[date]:
+        parsed_date = parse_date_string(date_str, date_order)
+        if parsed_date:
+            return parsed_date
+
+        import dateparser
+        try:
+            parsed = dateparser.parse(
+                date_str,
+                languages=[locale] if locale else None,
+                settings={
+                    'DATE_ORDER': date_order,
+                    'PREFER_DAY_OF_MONTH': 'first',
+                    'RELATIVE_BASE': datetime.combine(today, datetime.now().time()),
+                    'PREFER_DATES_FROM': 'past'
+                }
+            )
+            return parsed.date() if parsed else None
+        except Exception:
+            return None
+
+    # Amounts
+
+    def parse_amount(self, amount_string: str, locale: Optional[str] = None,
+                     convention: Optional[AmountConvention] = None) -> Optional[Decimal]:
+        """`convention` (detected per document) wins over `locale`, which only supplies the decimal mark."""
+        if not amount_string or not amount_string.strip():
+            return None
+        key = (amount_string, locale, convention)
+        amount = self.amount_cache.get(key)
+        if amount is _MISSING:
+            amount = self._parse_amount_uncached(amount_string, locale, convention)
+            self.amount_cache.put(key, amount)
+        return amount
+
+    def parse_amounts(self, amount_strings: Sequence[str], locale: Optional[str] = None,
+                      convention: Optional[AmountConvention] = None) -> List[Optional[Decimal]]:
+        return [self.parse_amount(amount_string, locale, convention) for amount_string in amount_strings]
+
+    async def parse_amounts_async(self, amount_strings: Sequence[str], locale: Optional[str] = None,
+                                  convention: Optional[AmountConvention] = None) -> List[Optional[Decimal]]:
+        results: List[Optional[Decimal]] = []
+        pending = []
+        for idx, amount_string in enumerate(amount_strings):
+            cached = self.amount_cache.get((amount_string, locale, convention)) if amount_string and amount_string.strip() else None
+            results.append(None if cached is _MISSING else cached)
+            if cached is _MISSING:
+                pending.append(idx)
+
+        if pending:
+            loop = asyncio.get_event_loop()
+            parsed = await loop.run_in_executor(
+                self.executor, self.parse_amounts, [amount_strings[idx] for idx in pending], locale, convention
+            )
+            for idx, amount in zip(pending, parsed):
+                results[idx] = amount
+        return results
+
+    def _parse_amount_uncached(self, amount_string: str, locale: Optional[str],
+                               convention: Optional[AmountConvention]) -> Optional[Decimal]:
+        if convention is None:
+            convention = AmountConvention(decimal_separator_for_locale(locale) or '.')
+        amount = normalize_amount(amount_string, convention)
+        if amount is None:
+            logger.warning(f"Could not parse decimal: {amount_string}")
+            return None
+        return amount.value
+
+    # Housekeeping
+
+    def cache_info(self) -> Dict[str, Tuple[int, int, int]]:
+        """(hits, misses, size) per cache."""
+        return {
+            'dates': (self.date_cache.hits, self.date_cache.misses, len(self.date_cache)),
+            'amounts': (self.amount_cache.hits, self.amount_cache.misses, len(self.amount_cache)),
+        }
+
+    def clear(self):
+        self.date_cache.clear()
+        self.amount_cache.clear()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+parsing_service = ParsingService()
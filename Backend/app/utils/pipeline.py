@@ -0,0 +1,82 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+from app.models import Invoice
+from app.utils.invoice_batch import InvoiceBatch
+from app.utils.validation_rules import ValidationReport
+
+logger = logging.getLogger(__name__)
+
+
+def invoice_id(source: str, page: int) -> str:
+    """Stable per-invoice ID: the source document and the 1-based page the invoice came from."""
+    return f"{source}#{page}"
+
+
+class InvoiceSet:
+    """
+    The pipeline's data contract after extraction: every invoice is built once
+    and carried by reference under a stable ID (source document plus page).
+    Validation warnings and anomaly flags live in side tables indexed like
+    `invoices` instead of being merged into copies of each invoice, and
+    `results` joins them back in one pass.
+    """
+
+    __slots__ = ('invoices', 'ids', 'index', 'report', 'flags', '_sources', '_batch', '_warnings')
+
+    def __init__(self, invoices: Optional[List[Invoice]] = None):
+        self.invoices: List[Invoice] = []
+        self.ids: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.report: Optional[ValidationReport] = None
+        self.flags: List[List[str]] = []
+        self._sources: Dict[str, int] = {}
+        self._batch: Optional[InvoiceBatch] = None
+        self._warnings: Optional[List[Dict[str, List[str]]]] = None
+        for invoice in invoices or []:
+            self.add(invoice.filename, [invoice])
+
+    def add(self, source: str, invoices: List[Invoice]):
+        """Invoices of one source document, in page order."""
+        copies = self._sources[source] = self._sources.get(source, 0) + 1
+        if copies > 1:
+            # The same document name uploaded twice: later copies get a deterministic suffix
+            source = f"{source}~{copies}"
+        for page, invoice in enumerate(invoices, 1):
+            id_ = invoice_id(source, page)
+            self.index[id_] = len(self.invoices)
+            self.ids.append(id_)
+            self.invoices.append(invoice)
+            self.flags.append([])
+        self._batch = self._warnings = self.report = None
+
+    def annotate(self, report: ValidationReport, flags: List[List[str]]):
+        self.report, self.flags, self._warnings = report, flags, None
+
+    @property
+    def batch(self) -> InvoiceBatch:
+        """Columnar view for validation, anomaly checks and export, built on first use."""
+        if self._batch is None:
+            self._batch = InvoiceBatch(self.invoices)
+        return self._batch
+
+    @property
+    def warnings(self) -> List[Dict[str, List[str]]]:
+        """Validation warnings by category, as InvoiceValidator.validate_invoice returns them."""
+        if self._warnings is None:
+            self._warnings = self.report.warnings() if self.report is not None else [{} for _ in self.invoices]
+        return self._warnings
+
+    def __len__(self) -> int:
+        return len(self.invoices)
+
+    def results(self) -> Tuple[Dict[str, Dict[str, List[str]]], List[Dict]]:
+        """
+        The validation and anomaly payloads in one pass: warnings keyed by
+        invoice ID, and each flagged invoice as a dict with its ID and flags.
+        """
+        validation_results, anomalies = {}, []
+        for id_, invoice, warnings, flags in zip(self.ids, self.invoices, self.warnings, self.flags):
+            validation_results[id_] = warnings
+            if flags:
+                anomalies.append({**invoice.dict(), 'invoice_id': id_, 'flags': flags})
+        return validation_results, anomalies
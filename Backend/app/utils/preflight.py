@@ -0,0 +1,218 @@
+import os
+import shutil
+import asyncio
+import tempfile
+import zipfile
+import threading
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, NamedTuple, Optional
+import fitz  # PyMuPDF
+import magic
+from app.config import settings
+from app.utils.file_handler import ALLOWED_DOCUMENT_TYPES, SNIFF_BYTES, SPOOL_CHUNK_SIZE, FileProcessingError
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('render', 'ocr', 'extract')
+# Seconds per page until real runs have been measured
+DEFAULT_SECONDS_PER_PAGE = {'render': 0.1, 'ocr': 1.5, 'extract': 0.3}
+DEFAULT_DOCAI_RATIO = 0.5
+THROUGHPUT_SMOOTHING = 0.2
+
+# A PDF page with at least this much extractable text was born digital, not scanned
+TEXT_LAYER_MIN_CHARS = 50
+TEXT_SAMPLE_PAGES = 3
+
+# Backends billed per page; Tesseract and the fake backend run locally for free
+BILLED_OCR_BACKENDS = ('vision',)
+
+INTERACTIVE_QUEUE = 'interactive'
+BULK_QUEUE = 'bulk'
+# Bulk jobs poll for a free slot, backing off between these many seconds
+BULK_SLOT_POLL_MIN = 0.05
+BULK_SLOT_POLL_MAX = 1.0
+
+
+class QuotaExceededError(FileProcessingError):
+    pass
+
+
+class FilePreflight(NamedTuple):
+    filename: str
+    content_type: str
+    pages: int
+    text_layer: bool
+
+
+class StageThroughput:
+    """
+    Recent seconds per page of each pipeline stage, and the share of pages
+    that needed Document AI, as exponentially weighted averages over real
+    runs. Estimates start from DEFAULT_SECONDS_PER_PAGE.
+    """
+
+    def __init__(self, smoothing: float = THROUGHPUT_SMOOTHING):
+        self.smoothing = smoothing
+        self.seconds_per_page = dict(DEFAULT_SECONDS_PER_PAGE)
+        self.docai_ratio = DEFAULT_DOCAI_RATIO
+        self._lock = threading.Lock()
+
+    def _update(self, current: float, observed: float, weight: int) -> float:
+        # A run of n pages moves the average as much as n single-page runs would
+        keep = (1 - self.smoothing) ** max(weight, 1)
+        return keep * current + (1 - keep) * observed
+
+    def record(self, stage: str, pages: int, seconds: float):
+        if pages <= 0:
+            return
+        with self._lock:
+            self.seconds_per_page[stage] = self._update(self.seconds_per_page[stage], seconds / pages, pages)
+
+    def record_docai(self, pages: int, docai_pages: int):
+        if pages <= 0:
+            return
+        with self._lock:
+            self.docai_ratio = self._update(self.docai_ratio, docai_pages / pages, pages)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'seconds_per_page': dict(self.seconds_per_page), 'docai_ratio': self.docai_ratio}
+
+
+throughput = StageThroughput()
+
+
+class PreflightReport:
+    """
+    Page counts of a job's uploads and what processing them is expected to
+    cost. The queue follows from the pages alone; the API calls and cost
+    depend on the OCR backend, which is resolved from the queue, so they are
+    priced by price(backend), OCR_BACKEND until then.
+    """
+
+    def __init__(self, files: List[FilePreflight], rates: Optional[Dict[str, Any]] = None):
+        self.files = files
+        self.pages = sum(file.pages for file in files)
+        self.text_pages = sum(file.pages for file in files if file.text_layer)
+        self.rates = rates or throughput.snapshot()
+        self.seconds = self.pages * sum(self.rates['seconds_per_page'][stage] for stage in STAGES)
+        self.queue = BULK_QUEUE if self.pages > settings.BULK_JOB_PAGES else INTERACTIVE_QUEUE
+        self.price(settings.OCR_BACKEND)
+
+    def price(self, backend: str):
+        self.backend = backend
+        self.vision_calls = self.pages if backend in BILLED_OCR_BACKENDS else 0
+        # Born-digital pages OCR cleanly, so only scanned pages are expected to need Document AI
+        self.docai_calls = round((self.pages - self.text_pages) * self.rates['docai_ratio'])
+        self.cost = self.vision_calls * settings.VISION_COST_PER_PAGE + self.docai_calls * settings.DOCAI_COST_PER_PAGE
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'files': [file._asdict() for file in self.files],
+            'pages': self.pages,
+            'text_layer_pages': self.text_pages,
+            'scanned_pages': self.pages - self.text_pages,
+            'ocr_backend': self.backend,
+            'vision_calls': self.vision_calls,
+            'docai_calls': self.docai_calls,
+            'estimated_cost_usd': round(self.cost, 4),
+            'estimated_seconds': round(self.seconds, 1),
+            'queue': self.queue,
+        }
+
+
+def _pdf_preflight(doc: fitz.Document, filename: str) -> FilePreflight:
+    # The page count comes from the page tree; a few pages' text tells born-digital from scanned
+    sample = range(min(len(doc), TEXT_SAMPLE_PAGES))
+    text_layer = bool(len(doc)) and all(len(doc.load_page(index).get_text().strip()) >= TEXT_LAYER_MIN_CHARS
+                                        for index in sample)
+    return FilePreflight(filename, 'application/pdf', len(doc), text_layer)
+
+
+def _member_preflight(archive: zipfile.ZipFile, file_info: zipfile.ZipInfo, spool_dir: str) -> Optional[FilePreflight]:
+    with archive.open(file_info) as member:
+        head = member.read(SNIFF_BYTES)
+        content_type = magic.from_buffer(head, mime=True)
+        if content_type not in ALLOWED_DOCUMENT_TYPES:
+            return None
+        if content_type != 'application/pdf':
+            return FilePreflight(file_info.filename, content_type, 1, False)
+        # PDFs keep their page tree at the end, so the member is spooled to disk in chunks and opened by path
+        with tempfile.NamedTemporaryFile(dir=spool_dir, suffix='.pdf') as spool:
+            spool.write(head)
+            shutil.copyfileobj(member, spool, SPOOL_CHUNK_SIZE)
+            spool.flush()
+            with fitz.open(spool.name) as doc:
+                return _pdf_preflight(doc, file_info.filename)
+
+
+def inspect_file(file_path: str) -> List[FilePreflight]:
+    """Pages and text layer of an upload, per document; ZIP members are listed from the central directory."""
+    filename = os.path.basename(file_path)
+    if zipfile.is_zipfile(file_path):
+        files = []
+        with zipfile.ZipFile(file_path) as archive:
+            for file_info in archive.infolist():
+                if file_info.is_dir():
+                    continue
+                try:
+                    preflight = _member_preflight(archive, file_info, os.path.dirname(file_path))
+                except Exception as e:
+                    logger.warning(f"Preflight could not read zip member {file_info.filename}: {str(e)}")
+                    continue
+                if preflight:
+                    files.append(preflight)
+        return files
+
+    with open(file_path, 'rb') as file:
+        content_type = magic.from_buffer(file.read(SNIFF_BYTES), mime=True)
+    if content_type == 'application/pdf':
+        try:
+            with fitz.open(file_path) as doc:
+                return [_pdf_preflight(doc, filename)]
+        except Exception as e:
+            raise FileProcessingError(f"Unable to read PDF {filename}: {str(e)}")
+    return [FilePreflight(filename, content_type, 1, False)]
+
+
+def inspect_uploads(file_paths: List[str]) -> PreflightReport:
+    return PreflightReport([preflight for file_path in file_paths for preflight in inspect_file(file_path)])
+
+
+def admit(report: PreflightReport):
+    """Refuse jobs over the per-job page quota."""
+    if report.pages > settings.MAX_PAGES_PER_JOB:
+        raise QuotaExceededError(
+            f"{report.pages} pages exceed the limit of {settings.MAX_PAGES_PER_JOB} pages per job"
+        )
+
+
+class JobQueues:
+    """
+    Interactive jobs start at once; bulk jobs (over BULK_JOB_PAGES pages) take
+    one of BULK_JOB_CONCURRENCY slots first, so a few huge uploads cannot
+    starve everyone else. The slots are a threading semaphore because the
+    Django views run each job on its own event loop; waiters poll it without
+    blocking, so no thread is parked and a cancelled waiter holds nothing.
+    """
+
+    def __init__(self, bulk_slots: Optional[int] = None):
+        self.bulk = threading.BoundedSemaphore(bulk_slots or settings.BULK_JOB_CONCURRENCY)
+
+    @asynccontextmanager
+    async def slot(self, queue: str):
+        if queue != BULK_QUEUE:
+            yield
+            return
+        delay = BULK_SLOT_POLL_MIN
+        while not self.bulk.acquire(blocking=False):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, BULK_SLOT_POLL_MAX)
+        try:
+            yield
+        finally:
+            self.bulk.release()
+
+
+job_queues = JobQueues()
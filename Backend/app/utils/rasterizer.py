@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Deque, List, NamedTuple, Optional, Tuple
+import fitz  # PyMuPDF
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+COLORSPACES = {'rgb': fitz.csRGB, 'gray': fitz.csGRAY}
+
+
+class RasterOptions(NamedTuple):
+    dpi: int = 72
+    colorspace: str = 'rgb'
+
+    @classmethod
+    def from_settings(cls) -> 'RasterOptions':
+        return cls(settings.RASTER_DPI, settings.RASTER_COLORSPACE)
+
+
+def render_range(doc: fitz.Document, start: int, stop: int, options: RasterOptions) -> List[bytes]:
+    """PNG bytes of pages [start, stop) of an open document."""
+    matrix = fitz.Matrix(options.dpi / 72, options.dpi / 72)
+    colorspace = COLORSPACES[options.colorspace]
+    return [
+        doc.load_page(page_index).get_pixmap(matrix=matrix, colorspace=colorspace, alpha=False).tobytes("png")
+        for page_index in range(start, stop)
+    ]
+
+
+def render_shard(path: str, start: int, stop: int, options: RasterOptions) -> List[bytes]:
+    """Worker side: open the shared on-disk PDF and render one page range of it."""
+    with fitz.open(path) as doc:
+        return render_range(doc, start, stop, options)
+
+
+def page_count(path: str) -> int:
+    with fitz.open(path) as doc:
+        return len(doc)
+
+
+def shard_ranges(total_pages: int, workers: int, shard_pages: int) -> List[Tuple[int, int]]:
+    """Disjoint page ranges: enough to give every worker one, never more than shard_pages each."""
+    size = max(min(shard_pages, -(-total_pages // max(workers, 1))), 1)
+    return [(start, min(start + size, total_pages)) for start in range(0, total_pages, size)]
+
+
+class PdfRasterizer:
+    """
+    PDF rasterization on a process pool, sharded by page range.
+
+    fitz holds the GIL through most of a render, so threads do not help; each
+    worker opens the PDF from disk itself and renders a disjoint range of
+    pages, and only PNG bytes travel back. Shards are handed out a window at a
+    time and their pages come back in page order, so memory stays bounded by
+    the shards in flight. Documents up to RASTER_INLINE_PAGES pages, or any
+    document with RASTER_PROCESSES = 0, are rendered in a thread instead: for
+    those a worker round trip costs more than it saves.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, shard_pages: Optional[int] = None,
+                 options: Optional[RasterOptions] = None):
+        self.max_workers = settings.RASTER_PROCESSES if max_workers is None else max_workers
+        self.shard_pages = max(shard_pages or settings.RASTER_SHARD_PAGES, 1)
+        self.options = options or RasterOptions.from_settings()
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: forked children would inherit the parent's thread pools without their threads
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return self._pool
+
+    async def render(self, path: str, options: Optional[RasterOptions] = None,
+                     total_pages: Optional[int] = None) -> AsyncIterator[Tuple[int, bytes]]:
+        """(page index, PNG bytes) for every page of the PDF at `path`, in page order."""
+        options = options or self.options
+        loop = asyncio.get_event_loop()
+        if total_pages is None:
+            total_pages = await loop.run_in_executor(None, page_count, path)
+
+        if self.max_workers <= 0 or total_pages <= settings.RASTER_INLINE_PAGES:
+            images = await loop.run_in_executor(None, render_shard, path, 0, total_pages, options)
+            for page_index, image in enumerate(images):
+                yield page_index, image
+            return
+
+        shards = deque(shard_ranges(total_pages, self.max_workers, self.shard_pages))
+        pending: Deque[Tuple[int, asyncio.Future]] = deque()
+        try:
+            while shards or pending:
+                # Two shards per worker: one rendering, one waiting to be taken
+                while shards and len(pending) < 2 * self.max_workers:
+                    start, stop = shards.popleft()
+                    pending.append((start, loop.run_in_executor(self.pool, render_shard, path, start, stop, options)))
+                start, future = pending.popleft()
+                for page_index, image in enumerate(await future, start):
+                    yield page_index, image
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+
+pdf_rasterizer = PdfRasterizer()
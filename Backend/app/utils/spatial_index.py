@@ -0,0 +1,275 @@
+import re
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+import numpy as np
+from app.utils.label_automaton import LabelTable, scan_labels
+from app.utils.amount_engine import AmountConvention, detect_convention
+
+_LABEL_STRIP = ':#.-'
+# Optional currency symbol or ISO code, then digits with grouping/decimal separators
+AMOUNT_TOKEN_RE = re.compile(r'^(?:[A-Z]{3}\s?|[^\w\s\-]{0,3}-?)\d(?:[\d,.\s]*\d)?$')
+IDENTIFIER_TOKEN_RE = re.compile(r'^(?=.*\d)[A-Za-z0-9][A-Za-z0-9\-/_.]{2,}$')
+
+
+class LabelHit(NamedTuple):
+    label: str
+    rank: float
+    first: int
+    last: int
+    x0: float
+    y0: float
+    x1: float
+    y1: float
+
+
+class ValueHit(NamedTuple):
+    label: str
+    index: int
+    text: str
+    x0: float
+    y0: float
+    x1: float
+    y1: float
+
+
+def boxes_to_array(boxes: Sequence) -> np.ndarray:
+    """(n, 4) float32 array of x0, y0, x1, y1 from Vision vertex lists or an existing array."""
+    if isinstance(boxes, np.ndarray) and boxes.ndim == 2 and boxes.shape[1] == 4:
+        return boxes.astype(np.float32, copy=False)
+    if len(boxes) == 0:
+        return np.zeros((0, 4), dtype=np.float32)
+    try:
+        vertices = np.asarray(boxes, dtype=np.float32).reshape(len(boxes), -1, 2)
+    except ValueError:
+        # Ragged vertex lists (Vision drops vertices on clipped words)
+        padded = [list(box) + [box[-1]] * (4 - len(box)) if box else [(0, 0)] * 4 for box in boxes]
+        vertices = np.asarray(padded, dtype=np.float32).reshape(len(boxes), -1, 2)
+    return np.concatenate([vertices.min(axis=1), vertices.max(axis=1)], axis=1)
+
+
+def normalize_token(word: str) -> str:
+    """Lower-cased word without surrounding label punctuation; punctuation-only words stay as they are."""
+    word = word.strip().lower()
+    return word.strip(_LABEL_STRIP) or word
+
+
+class SpatialIndex:
+    """
+    Uniform-grid index over the word boxes of one page.
+
+    Word centres are bucketed into square cells and the word ids are sorted by
+    cell id, so every grid row of a query rectangle is one contiguous slice
+    found with two binary searches. Building is a handful of NumPy passes.
+    """
+
+    def __init__(self, words: Sequence[str], boxes: Sequence, text: Optional[str] = None):
+        self.words = list(words)
+        self.boxes = boxes_to_array(boxes)
+        n = len(self.words)
+        if self.boxes.shape[0] != n:
+            raise ValueError(f"{n} words but {self.boxes.shape[0]} boxes")
+
+        self.x0, self.y0, self.x1, self.y1 = (self.boxes[:, i] for i in range(4))
+        self.cx = (self.x0 + self.x1) / 2
+        self.cy = (self.y0 + self.y1) / 2
+        self.heights = np.maximum(self.y1 - self.y0, 1.0)
+
+        self.line_height = float(np.median(self.heights)) if n else 1.0
+        self.cell_size = max(self.line_height * 2.0, 1.0)
+        self.page_x0 = float(self.x0.min()) if n else 0.0
+        self.page_y0 = float(self.y0.min()) if n else 0.0
+        self.page_x1 = float(self.x1.max()) if n else 0.0
+        self.page_y1 = float(self.y1.max()) if n else 0.0
+
+        gx = ((self.cx - self.page_x0) // self.cell_size).astype(np.int64)
+        gy = ((self.cy - self.page_y0) // self.cell_size).astype(np.int64)
+        self.grid_cols = int(gx.max()) + 1 if n else 1
+        self.grid_rows = int(gy.max()) + 1 if n else 1
+        cell_ids = gy * self.grid_cols + gx
+        self._order = np.argsort(cell_ids, kind='stable')
+        self._sorted_cells = cell_ids[self._order]
+
+        self._text = text
+        self._word_starts: Optional[np.ndarray] = None
+        self._labels: Optional[LabelTable] = None
+        self._amount_convention: Optional[AmountConvention] = None
+
+    @classmethod
+    def from_ocr_result(cls, ocr_result: Dict) -> Optional['SpatialIndex']:
+        words = ocr_result.get('words') or []
+        boxes = ocr_result.get('box_array')
+        if boxes is None:
+            boxes = ocr_result.get('boxes') or []
+        if not words or len(words) != len(boxes):
+            return None
+        return cls(words, boxes, ocr_result.get('text') or None)
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    # Page text and labels
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = ' '.join(self.words)
+        return self._text
+
+    @property
+    def word_starts(self) -> np.ndarray:
+        """Offset of every word in `text` (words are located in order; -1 if OCR text and words disagree)."""
+        if self._word_starts is None:
+            starts = np.full(len(self.words), -1, dtype=np.int64)
+            text = self.text
+            cursor = 0
+            for idx, word in enumerate(self.words):
+                position = text.find(word, cursor)
+                if position >= 0:
+                    starts[idx] = position
+                    cursor = position + len(word)
+            self._word_starts = starts
+        return self._word_starts
+
+    @property
+    def labels(self) -> LabelTable:
+        """Label hits of the page text, computed once and shared by every extractor."""
+        if self._labels is None:
+            self._labels = scan_labels(self.text)
+        return self._labels
+
+    @property
+    def amount_convention(self) -> AmountConvention:
+        """Decimal mark and currency of the page's amounts, with the label language as tie-breaker."""
+        if self._amount_convention is None:
+            self._amount_convention = detect_convention(self.text, self.labels.language())
+        return self._amount_convention
+
+    def label_hits(self, *fields: str) -> List[LabelHit]:
+        """Label table hits for `fields` mapped to word ids, most specific label first."""
+        starts = self.word_starts
+        aligned = np.flatnonzero(starts >= 0)
+        if aligned.size == 0:
+            return []
+        aligned_starts = starts[aligned]
+        hits = []
+        for match in self.labels.ranked(*fields):
+            first_pos = np.searchsorted(aligned_starts, match.start, side='right') - 1
+            last_pos = np.searchsorted(aligned_starts, match.end - 1, side='right') - 1
+            if first_pos < 0:
+                continue
+            first, last = int(aligned[first_pos]), int(aligned[last_pos])
+            if starts[first] + len(self.words[first]) <= match.start or not self._same_line(first, last):
+                continue
+            span = slice(first, last + 1)
+            hits.append(LabelHit(match.label, match.rank, first, last,
+                                 float(self.x0[span].min()), float(self.y0[span].min()),
+                                 float(self.x1[span].max()), float(self.y1[span].max())))
+        return hits
+
+    # Geometry queries
+
+    def query_rect(self, x0: float, y0: float, x1: float, y1: float) -> np.ndarray:
+        """Ids of words whose centre lies inside the rectangle."""
+        if not self.words or x1 < x0 or y1 < y0:
+            return np.zeros(0, dtype=np.int64)
+        gx0 = max(int((x0 - self.page_x0) // self.cell_size), 0)
+        gx1 = min(int((x1 - self.page_x0) // self.cell_size), self.grid_cols - 1)
+        gy0 = max(int((y0 - self.page_y0) // self.cell_size), 0)
+        gy1 = min(int((y1 - self.page_y0) // self.cell_size), self.grid_rows - 1)
+        if gx1 < gx0 or gy1 < gy0:
+            return np.zeros(0, dtype=np.int64)
+
+        row_starts = np.arange(gy0, gy1 + 1, dtype=np.int64) * self.grid_cols
+        lo = np.searchsorted(self._sorted_cells, row_starts + gx0, side='left')
+        hi = np.searchsorted(self._sorted_cells, row_starts + gx1, side='right')
+        candidates = np.concatenate([self._order[a:b] for a, b in zip(lo, hi)]) if len(lo) else np.zeros(0, np.int64)
+        if candidates.size == 0:
+            return candidates
+        inside = ((self.cx[candidates] >= x0) & (self.cx[candidates] <= x1) &
+                  (self.cy[candidates] >= y0) & (self.cy[candidates] <= y1))
+        return candidates[inside]
+
+    def right_of(self, hit: LabelHit, predicate: Callable[[str], bool], max_distance: Optional[float] = None) -> Optional[int]:
+        """Nearest word to the right of the label on the same line that satisfies `predicate`."""
+        height = hit.y1 - hit.y0
+        limit = hit.x1 + (max_distance if max_distance is not None else self.page_x1 - hit.x1)
+        centre = (hit.y0 + hit.y1) / 2
+        ids = self.query_rect(hit.x1 - height * 0.25, centre - height * 0.6, limit, centre + height * 0.6)
+        return self._nearest(ids, hit, predicate, self.x0, hit.x1)
+
+    def below(self, hit: LabelHit, predicate: Callable[[str], bool], max_lines: float = 3.0) -> Optional[int]:
+        """Nearest word under the label that overlaps it horizontally and satisfies `predicate`."""
+        height = hit.y1 - hit.y0
+        width = hit.x1 - hit.x0
+        ids = self.query_rect(hit.x0 - width * 0.5, hit.y1, hit.x1 + width * 1.5, hit.y1 + height * (max_lines + 0.5))
+        return self._nearest(ids, hit, predicate, self.y0, hit.y1)
+
+    def value_for(self, fields: Sequence[str], predicate: Callable[[str], bool],
+                  prefer: str = 'last', used: Optional[set] = None) -> Optional[ValueHit]:
+        """
+        Value for the most specific label of `fields` that has one: right of the
+        label first, then below it. With several occurrences of equally specific
+        labels, `prefer` picks the top-most ('first') or bottom-most ('last') one.
+        Label words recorded in `used` are skipped, and the winner is added to it.
+        """
+        used = used if used is not None else set()
+        hits = [hit for hit in self.label_hits(*fields) if hit.first not in used]
+        for rank in sorted({hit.rank for hit in hits}):
+            same_rank = sorted((hit for hit in hits if hit.rank == rank), key=lambda hit: hit.y0,
+                               reverse=(prefer == 'last'))
+            for direction in (self.right_of, self.below):
+                for hit in same_rank:
+                    idx = direction(hit, predicate)
+                    if idx is not None:
+                        used.update(range(hit.first, hit.last + 1))
+                        return ValueHit(hit.label, idx, self.words[idx], float(self.x0[idx]), float(self.y0[idx]),
+                                        float(self.x1[idx]), float(self.y1[idx]))
+        return None
+
+    def lines(self) -> List[np.ndarray]:
+        """Word ids grouped into visual lines (top to bottom, left to right)."""
+        if not self.words:
+            return []
+        order = np.lexsort((self.cx, self.cy))
+        cy = self.cy[order]
+        # A new line starts where the centre jumps by more than half a line height
+        breaks = np.flatnonzero(np.diff(cy) > self.line_height * 0.5) + 1
+        lines = np.split(order, breaks)
+        return [line[np.argsort(self.cx[line], kind='stable')] for line in lines]
+
+    def segments(self, gap: float = 2.0) -> List[np.ndarray]:
+        """Lines split wherever the horizontal gap between words exceeds `gap` line heights."""
+        segments = []
+        for line in self.lines():
+            gaps = self.x0[line][1:] - self.x1[line][:-1]
+            breaks = np.flatnonzero(gaps > self.line_height * gap) + 1
+            segments.extend(np.split(line, breaks))
+        return segments
+
+    def line_text(self, ids: Sequence[int]) -> str:
+        return ' '.join(self.words[idx] for idx in ids)
+
+    # Helpers
+
+    def _same_line(self, a: int, b: int) -> bool:
+        return abs(float(self.cy[a]) - float(self.cy[b])) <= max(float(self.heights[a]), float(self.heights[b])) * 0.6
+
+    def _nearest(self, ids: np.ndarray, hit: LabelHit, predicate: Callable[[str], bool],
+                 coord: np.ndarray, origin: float) -> Optional[int]:
+        if ids.size == 0:
+            return None
+        ids = ids[(ids < hit.first) | (ids > hit.last)]
+        if ids.size == 0:
+            return None
+        distances = coord[ids] - origin
+        for idx in ids[np.argsort(distances, kind='stable')]:
+            if predicate(self.words[int(idx)]):
+                return int(idx)
+        return None
+
+
+def is_amount_token(word: str) -> bool:
+    return bool(AMOUNT_TOKEN_RE.match(word.strip())) and any(ch.isdigit() for ch in word)
+
+
+def is_identifier_token(word: str) -> bool:
+    return bool(IDENTIFIER_TOKEN_RE.match(word.strip()))
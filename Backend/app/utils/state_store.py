@@ -0,0 +1,141 @@
+import os
+import json
+import sqlite3
+import threading
+import logging
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Keeps IN (...) lists under SQLite's host parameter limit
+MAX_QUERY_PARAMETERS = 900
+
+
+class StateStore:
+    """
+    Durable key/value store for state that has to survive restarts.
+
+    Redis is flushed on every deployment, so learned state (vendor templates,
+    statistics, indexes) lives in a local SQLite file instead. Values are JSON;
+    keys are grouped by namespace.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or settings.STATE_DB_PATH
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM state WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def get_many(self, namespace: str, keys: List[str]) -> Dict[str, Any]:
+        """Values of the keys that exist, by primary-key lookups in as few queries as SQLite allows."""
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        for start in range(0, len(keys), MAX_QUERY_PARAMETERS):
+            chunk = keys[start:start + MAX_QUERY_PARAMETERS]
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM state WHERE namespace = ? AND key IN ({','.join('?' * len(chunk))})",
+                    (namespace, *chunk)
+                ).fetchall()
+            found.update((key, json.loads(value)) for key, value in rows)
+        return found
+
+    def put(self, namespace: str, key: str, value: Any):
+        self.put_many(namespace, {key: value})
+
+    def put_many(self, namespace: str, values: Dict[str, Any]):
+        rows = [(namespace, key, json.dumps(value, default=str)) for key, value in values.items()]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO state (namespace, key, value) VALUES (?, ?, ?)", rows
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def update_many(self, namespace: str, keys: List[str], update: Callable[[Dict[str, Any]], Dict[str, Any]]):
+        """
+        Read-modify-write: update(current values of the keys that exist)
+        returns the values to store, all in one IMMEDIATE transaction, so
+        concurrent writers, other processes included, apply their updates one
+        after another instead of overwriting each other's.
+        """
+        keys = list(dict.fromkeys(keys))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                current = {}
+                for start in range(0, len(keys), MAX_QUERY_PARAMETERS):
+                    chunk = keys[start:start + MAX_QUERY_PARAMETERS]
+                    rows = self._conn.execute(
+                        f"SELECT key, value FROM state WHERE namespace = ? AND key IN ({','.join('?' * len(chunk))})",
+                        (namespace, *chunk)
+                    ).fetchall()
+                    current.update((key, json.loads(value)) for key, value in rows)
+                rows = [(namespace, key, json.dumps(value, default=str)) for key, value in update(current).items()]
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO state (namespace, key, value) VALUES (?, ?, ?)", rows
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def items(self, namespace: str) -> Iterator[Tuple[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM state WHERE namespace = ?", (namespace,)
+            ).fetchall()
+        for key, value in rows:
+            yield key, json.loads(value)
+
+    def delete_prefix(self, namespace: str, prefix: str):
+        """Delete every key starting with `prefix`, as one range over the primary key."""
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM state WHERE namespace = ? AND key >= ? AND key < ?", (namespace, prefix, upper)
+            )
+
+    def clear(self, namespace: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM state WHERE namespace = ?", (namespace,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_state_store: Optional[StateStore] = None
+_state_store_lock = threading.Lock()
+
+
+def get_state_store() -> StateStore:
+    global _state_store
+    with _state_store_lock:
+        if _state_store is None:
+            _state_store = StateStore()
+        return _state_store
@@ -0,0 +1,152 @@
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence
+import numpy as np
+from app.utils.spatial_index import SpatialIndex, is_amount_token
+
+# Fraction of a word's height trimmed from top and bottom before rows are merged,
+# so boxes that only touch (or a slightly skewed scan) do not chain rows together.
+ROW_OVERLAP_TRIM = 0.25
+# Minimum empty x-projection between two columns, in line heights.
+COLUMN_GAP = 0.75
+# Body rows without any amount before the table is considered finished.
+MAX_ROWS_WITHOUT_AMOUNT = 3
+
+
+@dataclass
+class Table:
+    header: List[str]
+    header_map: Dict[str, int]
+    rows: List[List[str]] = field(default_factory=list)
+
+
+def _merge_intervals(lo: np.ndarray, hi: np.ndarray, gap: float = 0.0) -> np.ndarray:
+    """
+    Group label per interval after merging intervals that overlap (or are closer
+    than `gap`). Sorting by start and a running maximum of the ends is enough:
+    a new group starts wherever an interval begins past everything before it.
+    """
+    if lo.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    order = np.argsort(lo, kind='stable')
+    reach = np.maximum.accumulate(hi[order])
+    starts = np.empty(lo.size, dtype=bool)
+    starts[0] = True
+    starts[1:] = lo[order][1:] > reach[:-1] + gap
+    labels = np.empty(lo.size, dtype=np.int64)
+    labels[order] = np.cumsum(starts) - 1
+    return labels
+
+
+def cluster_rows(index: SpatialIndex) -> List[np.ndarray]:
+    """Word ids grouped into rows by vertical overlap, top to bottom, each row left to right."""
+    if len(index) == 0:
+        return []
+    trim = index.heights * ROW_OVERLAP_TRIM
+    labels = _merge_intervals(index.y0 + trim, index.y1 - trim)
+    order = np.lexsort((index.x0, labels))
+    breaks = np.flatnonzero(np.diff(labels[order])) + 1
+    return np.split(order, breaks)
+
+
+def column_bounds(index: SpatialIndex, rows: Sequence[np.ndarray]) -> np.ndarray:
+    """Column separators (x positions) from the gaps in the x-projection of `rows`."""
+    ids = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+    if ids.size == 0:
+        return np.zeros(0, dtype=np.float32)
+    lo, hi = index.x0[ids], index.x1[ids]
+    labels = _merge_intervals(lo, hi, index.line_height * COLUMN_GAP)
+    count = int(labels.max()) + 1
+    starts = np.full(count, np.inf, dtype=np.float32)
+    ends = np.full(count, -np.inf, dtype=np.float32)
+    np.minimum.at(starts, labels, lo)
+    np.maximum.at(ends, labels, hi)
+    # Separator halfway across each gap
+    return (ends[:-1] + starts[1:]) / 2
+
+
+def split_cells(index: SpatialIndex, row: np.ndarray, bounds: np.ndarray) -> List[str]:
+    columns = np.searchsorted(bounds, index.cx[row])
+    cells = [[] for _ in range(len(bounds) + 1)]
+    for idx, column in zip(row, columns):
+        cells[int(column)].append(index.words[int(idx)])
+    return [' '.join(cell) for cell in cells]
+
+
+def _segments(index: SpatialIndex, row: np.ndarray) -> List[np.ndarray]:
+    gaps = index.x0[row][1:] - index.x1[row][:-1]
+    return np.split(row, np.flatnonzero(gaps > index.line_height * COLUMN_GAP) + 1)
+
+
+def _header_bounds(index: SpatialIndex, header: np.ndarray) -> np.ndarray:
+    """Separators halfway between the header cells, for tables whose body fills the gaps."""
+    segments = _segments(index, header)
+    ends = np.array([index.x1[segment].max() for segment in segments[:-1]], dtype=np.float32)
+    starts = np.array([index.x0[segment].min() for segment in segments[1:]], dtype=np.float32)
+    return (ends + starts) / 2
+
+
+def reconstruct_table(index: SpatialIndex,
+                      identify_header: Callable[[List[str]], Dict[str, int]],
+                      stop_fields: Sequence[str] = ()) -> Optional[Table]:
+    """
+    Rebuild the line-item table of a page from its word boxes.
+
+    Rows come from vertical overlap, the header is the first row that
+    `identify_header` maps to at least two known columns, and the body runs
+    until a row that starts with a label of `stop_fields` (from the page's
+    label table) or a run of rows without amounts.
+    Columns are the gaps in the x-projection of header and body; when body text
+    bridges a gap, the header cells decide instead. Rows that only add text to
+    the description column are folded into the previous row.
+    """
+    rows = cluster_rows(index)
+    stop_words = {hit.first for hit in index.label_hits(*stop_fields)} if stop_fields else set()
+
+    header_pos = None
+    for position, row in enumerate(rows):
+        cells = [index.line_text(segment) for segment in _segments(index, row)]
+        if len(identify_header(cells)) >= 2 and not any(is_amount_token(index.words[int(idx)]) for idx in row):
+            header_pos = position
+            break
+    if header_pos is None:
+        return None
+
+    body = []
+    rows_without_amount = 0
+    for row in rows[header_pos + 1:]:
+        if int(row[0]) in stop_words:
+            break
+        if any(is_amount_token(index.words[int(idx)]) for idx in row):
+            rows_without_amount = 0
+        else:
+            rows_without_amount += 1
+            if rows_without_amount > MAX_ROWS_WITHOUT_AMOUNT:
+                break
+        body.append(row)
+    while body and not any(is_amount_token(index.words[int(idx)]) for idx in body[-1]):
+        body.pop()
+    if not body:
+        return None
+
+    header_row = rows[header_pos]
+    bounds = column_bounds(index, [header_row] + body)
+    header = split_cells(index, header_row, bounds)
+    header_map = identify_header(header)
+    if len(header_map) < 2:
+        bounds = _header_bounds(index, header_row)
+        header = split_cells(index, header_row, bounds)
+        header_map = identify_header(header)
+    if len(header_map) < 2:
+        return None
+
+    description_col = header_map.get('description', 0)
+    table = Table(header=header, header_map=header_map)
+    for row in body:
+        cells = split_cells(index, row, bounds)
+        continuation = all(not cell for col, cell in enumerate(cells) if col != description_col)
+        if continuation and table.rows and cells[description_col]:
+            previous = table.rows[-1]
+            previous[description_col] = f"{previous[description_col]} {cells[description_col]}".strip()
+        elif not continuation:
+            table.rows.append(cells)
+    return table
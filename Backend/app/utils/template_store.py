@@ -0,0 +1,449 @@
+import re
+import hashlib
+import threading
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+import numpy as np
+from app.config import settings
+from app.models import Invoice
+from app.utils.anomaly_engine import vendor_key
+from app.utils.date_engine import parse_date_string
+from app.utils.parsing_service import parsing_service
+from app.utils.spatial_index import SpatialIndex, is_amount_token, is_identifier_token, normalize_token
+from app.utils.state_store import StateStore, get_state_store
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_NAMESPACE = 'vendor_templates'
+TEMPLATE_FIELDS = ('invoice_number', 'invoice_date', 'grand_total', 'taxes', 'final_total')
+
+HEADER_FRACTION = 0.2
+MAX_HEADER_TOKENS = 40
+LOGO_HASH_BITS = 64
+MAX_LOGO_DISTANCE = 10
+# Search margin around a learned field box, as a fraction of the page size
+POSITION_TOLERANCE = 0.02
+# A VAT number match still needs this much header-token or logo agreement to win
+VAT_MIN_AGREEMENT = 0.2
+
+# Words that appear in every invoice header and say nothing about the vendor
+GENERIC_HEADER_TOKENS = {
+    'invoice', 'tax', 'date', 'number', 'page', 'bill', 'ship', 'sold', 'from', 'the', 'and',
+    'total', 'due', 'amount', 'customer', 'account', 'reference', 'order', 'phone', 'fax',
+    'email', 'www', 'com', 'street', 'road', 'suite', 'inv', 'facture', 'rechnung', 'factura',
+}
+
+# The country prefix and any letters in the number are upper case and stand alone, so the
+# "eg" of "VAT Reg 123 456 789" or a following "Date" are never read into the number
+VAT_NUMBER_RE = re.compile(
+    r'\b(?:vat|tva|iva|ust|mwst|uid|nif|cif|abn|gst|tin)\b[^\n\d]{0,25}?'
+    r'((?<![A-Za-z])(?-i:[A-Z]{2} ?)?\d(?-i:[\dA-Z]|[ \-]\d){6,16})',
+    re.IGNORECASE
+)
+# Labels of the buyer's block: a VAT number there is the customer's, not the vendor's
+BUYER_LABEL_RE = re.compile(
+    r'\b(?:bill(?:ed)?\s*to|sold\s*to|ship\s*to|invoice\s*to|customer|client|buyer|purchaser|recipient|'
+    r'your\s*(?:vat|tax)|kunde|kunden|empf[aä]nger|destinataire|cliente)\b',
+    re.IGNORECASE
+)
+# Lines under a buyer heading that still belong to the buyer's block
+BUYER_BLOCK_LINES = 5
+SELLER_LABEL_RE = re.compile(r'\b(?:from|seller|supplier|vendor|issued\s*by|lieferant|fournisseur|proveedor)\b',
+                             re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class VendorFingerprint:
+    header_tokens: FrozenSet[str]
+    logo_hash: Optional[str] = None
+    vat_number: Optional[str] = None
+
+    @classmethod
+    def from_page(cls, index: SpatialIndex, text: str, image_bytes: Optional[bytes] = None) -> 'VendorFingerprint':
+        return cls(
+            header_tokens=header_tokens(index),
+            logo_hash=logo_hash(image_bytes) if image_bytes else None,
+            vat_number=find_vat_number(text),
+        )
+
+
+@dataclass
+class VendorTemplate:
+    template_id: str
+    vendor: Dict
+    token_counts: Dict[str, int]
+    logo_hash: Optional[str]
+    vat_number: Optional[str]
+    fields: Dict[str, List[float]]
+    samples: int = 1
+    # Templates are learned and matched within one project; None for uploads outside projects
+    project_id: Optional[int] = None
+
+    @property
+    def header_tokens(self) -> Set[str]:
+        """Tokens seen on at least half of the learned pages."""
+        return {token for token, count in self.token_counts.items() if count * 2 >= self.samples}
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'VendorTemplate':
+        return cls(**data)
+
+
+def header_tokens(index: SpatialIndex) -> FrozenSet[str]:
+    if len(index) == 0:
+        return frozenset()
+    limit = index.page_y0 + (index.page_y1 - index.page_y0) * HEADER_FRACTION
+    tokens = []
+    for idx in np.flatnonzero(index.cy <= limit):
+        token = normalize_token(index.words[int(idx)])
+        if len(token) >= 3 and token.isalpha() and token not in GENERIC_HEADER_TOKENS:
+            tokens.append(token)
+            if len(tokens) >= MAX_HEADER_TOKENS:
+                break
+    return frozenset(tokens)
+
+
+def logo_hash(image_bytes: bytes) -> Optional[str]:
+    """64-bit average hash of the top band of the page, where logos sit."""
+    try:
+        import cv2
+        image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            return None
+        band = image[:max(int(image.shape[0] * HEADER_FRACTION), 1)]
+        small = cv2.resize(band, (16, 4), interpolation=cv2.INTER_AREA)
+        bits = (small > small.mean()).flatten()
+        return f"{int(''.join('1' if bit else '0' for bit in bits), 2):016x}"
+    except Exception as e:
+        logger.warning(f"Could not hash logo region: {str(e)}")
+        return None
+
+
+def find_vat_number(text: str) -> Optional[str]:
+    """
+    The vendor's VAT number: the first one not labelled as the buyer's, on
+    its own line ("Customer VAT: ...") or in the few lines under a buyer
+    heading ("Bill to:"), up to a blank line or seller label.
+    """
+    buyer_lines = 0
+    for line in (text or '').splitlines():
+        if not line.strip():
+            buyer_lines = 0
+            continue
+        buyer = BUYER_LABEL_RE.search(line)
+        if SELLER_LABEL_RE.search(line) and not buyer:
+            buyer_lines = 0
+        matches = list(VAT_NUMBER_RE.finditer(line))
+        for match in matches:
+            if buyer_lines or (buyer and buyer.start() < match.start()):
+                continue
+            return re.sub(r'[\s\-]', '', match.group(1)).upper()
+        if buyer and not matches:
+            buyer_lines = BUYER_BLOCK_LINES
+        elif buyer_lines:
+            buyer_lines -= 1
+    return None
+
+
+def same_vendor(a: Optional[str], b: Optional[str]) -> bool:
+    """Two vendor names read off pages name the same vendor (case, punctuation and OCR spacing aside)."""
+    a, b = vendor_key(a), vendor_key(b)
+    return bool(a and b) and a.replace(' ', '') == b.replace(' ', '')
+
+
+def template_key(project_id: Optional[int], digest: str) -> str:
+    return f"{project_id or 0}:{digest}"
+
+
+def _hamming(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+# Field positions
+
+def _normalized_box(index: SpatialIndex, ids: List[int]) -> List[float]:
+    width = max(index.page_x1 - index.page_x0, 1.0)
+    height = max(index.page_y1 - index.page_y0, 1.0)
+    return [
+        (float(index.x0[ids].min()) - index.page_x0) / width,
+        (float(index.y0[ids].min()) - index.page_y0) / height,
+        (float(index.x1[ids].max()) - index.page_x0) / width,
+        (float(index.y1[ids].max()) - index.page_y0) / height,
+    ]
+
+
+def _field_matches(field_name: str, text: str, value) -> bool:
+    if field_name == 'invoice_number':
+        return normalize_token(text) == normalize_token(str(value))
+    if field_name == 'invoice_date':
+        return parse_date_string(text) == value
+    return is_amount_token(text) and parsing_service.parse_amount(text) == value
+
+
+def locate_fields(index: SpatialIndex, invoice: Invoice, max_words: int = 3) -> Dict[str, List[float]]:
+    """Normalized boxes of the words that carry each extracted value (bottom-most match wins)."""
+    located = {}
+    lines = index.lines()
+    for field_name in TEMPLATE_FIELDS:
+        value = getattr(invoice, field_name)
+        if value is None or value == '':
+            continue
+        for line in reversed(lines):
+            line = [int(idx) for idx in line]
+            match = None
+            # Shortest word span first so the box does not swallow the label
+            for count in range(1, max_words + 1):
+                for start in range(len(line) - count + 1):
+                    ids = line[start:start + count]
+                    if _field_matches(field_name, index.line_text(ids), value):
+                        match = ids
+                        break
+                if match:
+                    break
+            if match:
+                located[field_name] = _normalized_box(index, match)
+                break
+    return located
+
+
+def read_field(index: SpatialIndex, box: List[float], field_name: str):
+    """Parse the value found at a learned position on a new page."""
+    width = max(index.page_x1 - index.page_x0, 1.0)
+    height = max(index.page_y1 - index.page_y0, 1.0)
+    pad_x = POSITION_TOLERANCE * width
+    pad_y = POSITION_TOLERANCE * height + index.line_height * 0.5
+    x0 = index.page_x0 + box[0] * width - pad_x
+    y0 = index.page_y0 + box[1] * height - pad_y
+    x1 = index.page_x0 + box[2] * width + pad_x
+    y1 = index.page_y0 + box[3] * height + pad_y
+    ids = index.query_rect(x0, y0, x1, y1)
+    if ids.size == 0:
+        return None
+
+    # Closest to the learned centre first
+    cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+    ids = ids[np.argsort((index.cx[ids] - cx) ** 2 + (index.cy[ids] - cy) ** 2, kind='stable')]
+    words = [index.words[int(idx)] for idx in ids]
+
+    if field_name == 'invoice_number':
+        return next((word for word in words if is_identifier_token(word) and parse_date_string(word) is None), None)
+    if field_name == 'invoice_date':
+        reading_order = [index.words[int(idx)] for idx in ids[np.lexsort((index.cx[ids], index.cy[ids]))]]
+        return parse_date_string(' '.join(reading_order)) or next(
+            (parsed for parsed in (parse_date_string(word) for word in words) if parsed), None)
+    for word in words:
+        if is_amount_token(word):
+            amount = parsing_service.parse_amount(word, convention=index.amount_convention)
+            if amount is not None:
+                return amount
+    return None
+
+
+class TemplateStore:
+    """
+    Learned vendor layouts per project, looked up by fingerprint.
+
+    Each template keeps the vendor, the header tokens seen on its pages, a logo
+    hash, the VAT number and the normalized box of every field. Lookups go
+    through inverted indexes (VAT number, logo hash, header token) so only
+    templates sharing something with the page are scored. A VAT number only
+    decides between templates whose header tokens or logo agree with the page.
+    Every index is keyed by project as well, so one tenant's templates are
+    never matched against another's pages. Learned templates are written to
+    the state store behind the caller, on a writer thread of their own.
+    """
+
+    def __init__(self, state_store: Optional[StateStore] = None):
+        self._state_store = state_store
+        self.templates: Dict[str, VendorTemplate] = {}
+        # (project, token / VAT number / logo hash) -> template IDs
+        self._token_index: Dict[Tuple[int, str], Set[str]] = {}
+        self._vat_index: Dict[Tuple[int, str], Set[str]] = {}
+        self._logo_index: Dict[Tuple[int, str], Set[str]] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        # Template ID -> serialized template not yet written; the write lock orders writes and deletes
+        self._dirty: Dict[str, Dict] = {}
+        self._write_lock = threading.Lock()
+        self._writer: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def state_store(self) -> StateStore:
+        if self._state_store is None:
+            self._state_store = get_state_store()
+        return self._state_store
+
+    def load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            for template_id, data in self.state_store.items(TEMPLATE_NAMESPACE):
+                try:
+                    self._index(VendorTemplate.from_dict(data))
+                except TypeError as e:
+                    logger.warning(f"Skipping unreadable vendor template {template_id}: {str(e)}")
+            self._loaded = True
+            logger.info(f"Loaded {len(self.templates)} vendor templates")
+
+    def __len__(self) -> int:
+        return len(self.templates)
+
+    def match(self, fingerprint: VendorFingerprint,
+              project_id: Optional[int] = None) -> Optional[Tuple[VendorTemplate, float]]:
+        self.load()
+        project = project_id or 0
+        with self._lock:
+            if fingerprint.vat_number:
+                scored = [(self._score(self.templates[template_id], fingerprint), template_id)
+                          for template_id in self._vat_index.get((project, fingerprint.vat_number), ())]
+                score, template_id = max(scored, default=(0.0, None))
+                if template_id is not None and score >= VAT_MIN_AGREEMENT:
+                    return self.templates[template_id], 1.0
+
+            candidates = Counter()
+            for token in fingerprint.header_tokens:
+                candidates.update(self._token_index.get((project, token), ()))
+            if fingerprint.logo_hash:
+                candidates.update(self._logo_index.get((project, fingerprint.logo_hash), ()))
+
+            best, best_score = None, 0.0
+            for template_id in candidates:
+                score = self._score(self.templates[template_id], fingerprint)
+                if score > best_score:
+                    best, best_score = self.templates[template_id], score
+
+        if best is None or best_score < settings.TEMPLATE_MATCH_THRESHOLD:
+            return None
+        return best, best_score
+
+    def learn(self, fingerprint: VendorFingerprint, invoice: Invoice, index: SpatialIndex,
+              project_id: Optional[int] = None) -> Optional[VendorTemplate]:
+        """Record (or refresh) the template for a confidently extracted page."""
+        fields = locate_fields(index, invoice)
+        if 'invoice_number' not in fields or 'final_total' not in fields or len(fields) < 3:
+            return None
+
+        matched = self.match(fingerprint, project_id)
+        if matched and not same_vendor(matched[0].vendor.get('name'), invoice.vendor.name):
+            # Another vendor's layout: learn this one separately instead of overwriting it
+            matched = None
+        with self._lock:
+            if matched:
+                template = matched[0]
+                self._unindex(template)
+                template.samples += 1
+                template.token_counts = dict(Counter(template.token_counts) + Counter(fingerprint.header_tokens))
+                template.fields.update(fields)
+                template.logo_hash = fingerprint.logo_hash or template.logo_hash
+                template.vat_number = fingerprint.vat_number or template.vat_number
+            else:
+                seed = f"{vendor_key(invoice.vendor.name)}|{fingerprint.vat_number or ' '.join(sorted(fingerprint.header_tokens))}"
+                template = VendorTemplate(
+                    template_id=template_key(project_id, hashlib.sha1(seed.encode('utf-8')).hexdigest()[:16]),
+                    vendor=invoice.vendor.dict(),
+                    token_counts={token: 1 for token in fingerprint.header_tokens},
+                    logo_hash=fingerprint.logo_hash,
+                    vat_number=fingerprint.vat_number,
+                    fields=fields,
+                    project_id=project_id,
+                )
+            self._index(template)
+            self._schedule_write(template)
+        return template
+
+    def read(self, template: VendorTemplate, index: SpatialIndex) -> Dict[str, object]:
+        values = {}
+        for field_name, box in template.fields.items():
+            try:
+                values[field_name] = read_field(index, box, field_name)
+            except Exception as e:
+                logger.warning(f"Could not read {field_name} from template {template.template_id}: {str(e)}")
+                values[field_name] = None
+        return values
+
+    def forget(self, template_id: str):
+        with self._write_lock:
+            with self._lock:
+                template = self.templates.get(template_id)
+                if template:
+                    self._unindex(template)
+                self._dirty.pop(template_id, None)
+            self.state_store.delete(TEMPLATE_NAMESPACE, template_id)
+
+    def forget_project(self, project_id: int):
+        """Drop a deleted project's templates."""
+        with self._write_lock:
+            with self._lock:
+                for template in [template for template in self.templates.values() if template.project_id == project_id]:
+                    self._unindex(template)
+                    self._dirty.pop(template.template_id, None)
+            self.state_store.delete_prefix(TEMPLATE_NAMESPACE, template_key(project_id, ''))
+
+    def flush(self):
+        """Write the templates learned since the last flush."""
+        with self._write_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, {}
+            if not dirty:
+                return
+            try:
+                self.state_store.put_many(TEMPLATE_NAMESPACE, dirty)
+            except Exception as e:
+                logger.error(f"Could not persist {len(dirty)} vendor templates: {str(e)}")
+
+    def shutdown(self):
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.shutdown(wait=True)
+        self.flush()
+
+    # Helpers
+
+    def _schedule_write(self, template: VendorTemplate):
+        # Under self._lock: a flush already queued picks this template up too
+        pending = bool(self._dirty)
+        self._dirty[template.template_id] = template.to_dict()
+        if not pending:
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='template-store')
+            self._writer.submit(self.flush)
+
+    def _score(self, template: VendorTemplate, fingerprint: VendorFingerprint) -> float:
+        tokens = template.header_tokens
+        union = tokens | fingerprint.header_tokens
+        similarity = len(tokens & fingerprint.header_tokens) / len(union) if union else 0.0
+        if template.logo_hash and fingerprint.logo_hash:
+            distance = _hamming(template.logo_hash, fingerprint.logo_hash)
+            logo_similarity = 1.0 - distance / LOGO_HASH_BITS if distance <= MAX_LOGO_DISTANCE else 0.0
+            return 0.7 * similarity + 0.3 * logo_similarity
+        return similarity
+
+    def _index(self, template: VendorTemplate):
+        self.templates[template.template_id] = template
+        project = template.project_id or 0
+        for token in template.header_tokens:
+            self._token_index.setdefault((project, token), set()).add(template.template_id)
+        if template.vat_number:
+            self._vat_index.setdefault((project, template.vat_number), set()).add(template.template_id)
+        if template.logo_hash:
+            self._logo_index.setdefault((project, template.logo_hash), set()).add(template.template_id)
+
+    def _unindex(self, template: VendorTemplate):
+        self.templates.pop(template.template_id, None)
+        project = template.project_id or 0
+        for token in template.header_tokens:
+            self._token_index.get((project, token), set()).discard(template.template_id)
+        if template.vat_number:
+            self._vat_index.get((project, template.vat_number), set()).discard(template.template_id)
+        if template.logo_hash:
+            self._logo_index.get((project, template.logo_hash), set()).discard(template.template_id)
+
+
+template_store = TemplateStore()
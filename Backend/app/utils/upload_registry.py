@@ -0,0 +1,135 @@
+import os
+import hashlib
+import threading
+import logging
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Tuple
+from fastapi.encoders import jsonable_encoder
+from app.utils.state_store import StateStore, get_state_store
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_NAMESPACE = 'upload_results'
+OUTCOMES = ('hits', 'joins', 'misses', 'forced')
+
+
+def upload_digest(files: Iterable[Tuple[str, str]]) -> str:
+    """
+    One key for a task's uploads, from (filename, SHA-256) pairs in upload
+    order. Names are part of it because invoice IDs are built from them.
+    """
+    digest = hashlib.sha256()
+    for filename, sha256 in files:
+        digest.update(f"{os.path.basename(filename)}\0{sha256}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def registry_key(digest: str, project_id: Optional[int] = None) -> str:
+    return f"{project_id or 0}:{digest}"
+
+
+class UploadMatch(NamedTuple):
+    task_id: str
+    project_id: Optional[int]
+    # None while the task is still running
+    result: Optional[Dict[str, Any]]
+
+
+class UploadRegistry:
+    """
+    Which task processed a given set of uploads in a project, by the content
+    hashes taken while they were spooled. Results are only reused within the
+    project that produced them: their anomaly and duplicate flags were
+    computed against that project's vendor statistics and duplicate index.
+
+    Finished tasks are kept in the state store with their results, so an
+    identical re-upload is answered without running the pipeline again, also
+    after a restart; tasks still running are kept in memory, so a re-upload
+    joins them instead of starting a second run. A finished entry is only
+    reused while its CSV and Excel artifacts still exist. Lookup outcomes are
+    counted for the metrics endpoint.
+    """
+
+    def __init__(self, state_store: Optional[StateStore] = None):
+        self._state_store = state_store
+        self._running: Dict[str, Tuple[str, Optional[int]]] = {}
+        self._counts = dict.fromkeys(OUTCOMES, 0)
+        self._lock = threading.Lock()
+
+    @property
+    def state_store(self) -> StateStore:
+        if self._state_store is None:
+            self._state_store = get_state_store()
+        return self._state_store
+
+    def lookup(self, digest: str, project_id: Optional[int] = None) -> Optional[UploadMatch]:
+        """The task to answer these uploads with, or None to process them."""
+        key = registry_key(digest, project_id)
+        with self._lock:
+            running = self._running.get(key)
+        if running:
+            self.record('joins')
+            return UploadMatch(running[0], running[1], None)
+
+        try:
+            entry = self.state_store.get(UPLOAD_NAMESPACE, key)
+        except Exception as e:
+            logger.error(f"Could not read the upload registry: {str(e)}")
+            entry = None
+        if entry and all(os.path.exists(entry['result'].get(key) or '') for key in ('csv_path', 'excel_path')):
+            self.record('hits')
+            return UploadMatch(entry['task_id'], entry.get('project_id'), entry['result'])
+        self.record('misses')
+        return None
+
+    def start(self, digest: str, task_id: str, project_id: Optional[int] = None):
+        with self._lock:
+            self._running[registry_key(digest, project_id)] = (task_id, project_id)
+
+    def finish(self, digest: str, task_id: str, project_id: Optional[int], result: Dict[str, Any]):
+        key = registry_key(digest, project_id)
+        with self._lock:
+            if self._running.get(key, (None,))[0] == task_id:
+                del self._running[key]
+        try:
+            self.state_store.put(UPLOAD_NAMESPACE, key, {
+                'task_id': task_id,
+                'project_id': project_id,
+                # As the API returns it: Decimals as numbers, dates as ISO strings
+                'result': jsonable_encoder(result),
+            })
+        except Exception as e:
+            logger.error(f"Could not record upload results for task {task_id}: {str(e)}")
+
+    def abandon(self, digest: str, task_id: str, project_id: Optional[int] = None):
+        key = registry_key(digest, project_id)
+        with self._lock:
+            if self._running.get(key, (None,))[0] == task_id:
+                del self._running[key]
+
+    def forget(self, digest: str, project_id: Optional[int] = None):
+        key = registry_key(digest, project_id)
+        with self._lock:
+            self._running.pop(key, None)
+        self.state_store.delete(UPLOAD_NAMESPACE, key)
+
+    def forget_project(self, project_id: int):
+        """Drop a deleted project's uploads."""
+        self.state_store.delete_prefix(UPLOAD_NAMESPACE, registry_key('', project_id))
+
+    def record(self, outcome: str):
+        with self._lock:
+            self._counts[outcome] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+            running = len(self._running)
+        lookups = counts['hits'] + counts['joins'] + counts['misses']
+        return {
+            **counts,
+            'running': running,
+            'hit_rate': round((counts['hits'] + counts['joins']) / lookups, 4) if lookups else 0.0,
+        }
+
+
+upload_registry = UploadRegistry()
@@ -0,0 +1,190 @@
+import re
+import logging
+from datetime import date
+from decimal import Decimal
+from typing import Callable, Dict, List, NamedTuple, Union
+import numpy as np
+from app.utils.invoice_batch import InvoiceBatch, LineItems, blank
+
+logger = logging.getLogger(__name__)
+
+INVOICE_NUMBER_RE = re.compile(r'^[A-Za-z0-9-]{5,}$')
+TOTALS_TOLERANCE = Decimal('0.01')
+# Float pre-filter for the Decimal comparison: loose enough never to miss a real mismatch
+TOTALS_TOLERANCE_FLOAT = 0.01 - 1e-6
+
+WARNING_CATEGORIES = ('filename', 'invoice_number', 'vendor', 'invoice_date', 'grand_total', 'taxes',
+                      'final_total', 'totals', 'pages', 'items')
+
+
+class Rule(NamedTuple):
+    """
+    One validation check over a whole batch. `mask` returns a boolean array with
+    True for the failing rows; `message` is the warning text, or a function of
+    (batch, row) for texts that quote the row's values. It is only called for
+    rows that fail.
+    """
+    category: str
+    mask: Callable[[InvoiceBatch], np.ndarray]
+    message: Union[str, Callable[[InvoiceBatch, int], str]]
+
+
+class ItemRule(NamedTuple):
+    """A check over the line-item child table; warnings read 'Item <n>: <message>'."""
+    mask: Callable[[LineItems], np.ndarray]
+    message: str
+
+
+def _today() -> np.datetime64:
+    return np.datetime64(date.today(), 'D')
+
+
+def _unusual_invoice_number(batch: InvoiceBatch) -> np.ndarray:
+    matches = np.fromiter(
+        (INVOICE_NUMBER_RE.match(number) is not None for number in batch.invoice_number),
+        dtype=bool, count=len(batch)
+    )
+    return ~blank(batch.invoice_number) & ~matches
+
+
+def _confirm(candidates: np.ndarray, exact: Callable[[int], bool]) -> np.ndarray:
+    # Floats only narrow the candidates down; the Decimals decide
+    mask = np.zeros(len(candidates), dtype=bool)
+    for row in np.flatnonzero(candidates).tolist():
+        mask[row] = exact(row)
+    return mask
+
+
+def _totals_mismatch(batch: InvoiceBatch) -> np.ndarray:
+    grand_total, taxes, final_total = (batch.amounts[column] for column in ('grand_total', 'taxes', 'final_total'))
+    decimals = batch.decimals
+    return _confirm(
+        np.abs(grand_total + taxes - final_total) > TOTALS_TOLERANCE_FLOAT,
+        lambda row: abs(decimals['grand_total'][row] + decimals['taxes'][row] - decimals['final_total'][row])
+        > TOTALS_TOLERANCE
+    )
+
+
+def _item_total_mismatch(items: LineItems) -> np.ndarray:
+    def exact(row: int) -> bool:
+        item = items.objects[row]
+        return abs(round(item.quantity * item.unit_price, 2) - item.total) > TOTALS_TOLERANCE
+    return _confirm(np.abs(np.round(items.quantity * items.unit_price, 2) - items.total) > TOTALS_TOLERANCE_FLOAT, exact)
+
+
+def _address_rule(column: str, label: str) -> Rule:
+    return Rule('vendor', lambda batch: batch.has_address & blank(batch.address[column]), f"Vendor {label} is missing")
+
+
+def _amount_rules(column: str, field_name: str) -> List[Rule]:
+    return [
+        Rule(column, lambda batch: np.isnan(batch.amounts[column]), f"{field_name} is missing"),
+        Rule(column, lambda batch: batch.amounts[column] < 0, f"{field_name} is negative"),
+    ]
+
+
+# In report order: by category, then as InvoiceValidator.validate_invoice lists them
+RULES: List[Rule] = [
+    Rule('filename', lambda batch: blank(batch.filename), "Filename is missing"),
+    Rule('invoice_number', lambda batch: blank(batch.invoice_number), "Invoice number is missing"),
+    Rule('invoice_number', _unusual_invoice_number,
+         lambda batch, row: f"Unusual invoice number format: {batch.invoice_number[row]}"),
+    Rule('vendor', lambda batch: blank(batch.vendor_name), "Vendor name is missing"),
+    Rule('vendor', lambda batch: ~batch.has_address, "Vendor address is missing"),
+    _address_rule('street', 'street'),
+    _address_rule('city', 'city'),
+    _address_rule('state', 'state'),
+    _address_rule('postal_code', 'postal code'),
+    _address_rule('country', 'country'),
+    Rule('invoice_date', lambda batch: np.isnat(batch.invoice_date), "Invoice date is missing"),
+    Rule('invoice_date', lambda batch: batch.invoice_date > _today(),
+         lambda batch, row: f"Invoice date {batch.invoices[row].invoice_date} is in the future"),
+    *_amount_rules('grand_total', "Grand total"),
+    *_amount_rules('taxes', "Taxes"),
+    *_amount_rules('final_total', "Final total"),
+    Rule('totals', _totals_mismatch,
+         lambda batch, row: "Total amounts may not match: {} + {} ≈ {}".format(
+             *(batch.decimals[column][row] for column in ('grand_total', 'taxes', 'final_total')))),
+    Rule('pages', lambda batch: np.isnan(batch.pages), "Number of pages is missing"),
+    Rule('pages', lambda batch: batch.pages < 1,
+         lambda batch, row: f"Unusual number of pages: {batch.invoices[row].pages}"),
+    Rule('items', lambda batch: batch.item_count == 0, "No line items found in the invoice"),
+]
+
+# Per item, in this order, after the invoice-level 'items' rules
+ITEM_RULES: List[ItemRule] = [
+    ItemRule(lambda items: blank(items.description), "Description is missing"),
+    ItemRule(lambda items: np.isnan(items.quantity), "Quantity is missing"),
+    ItemRule(lambda items: items.quantity <= 0, "Unusual quantity"),
+    ItemRule(lambda items: np.isnan(items.unit_price), "Unit price is missing"),
+    ItemRule(lambda items: items.unit_price < 0, "Unusual unit price"),
+    ItemRule(lambda items: np.isnan(items.total), "Total is missing"),
+    ItemRule(lambda items: items.total < 0, "Unusual total"),
+    ItemRule(_item_total_mismatch, "Total may not match quantity * unit price"),
+]
+
+
+class ValidationReport:
+    """
+    Rule results for a batch as boolean masks. Nothing is formatted until
+    warnings are asked for, and then only for failing rows; counts and the
+    set of failing invoices come straight from the masks.
+    """
+
+    def __init__(self, batch: InvoiceBatch, masks: np.ndarray, item_masks: np.ndarray):
+        self.batch = batch
+        self.masks = masks  # (rules, invoices)
+        self.item_masks = item_masks  # (items, item rules)
+        item_failures = np.bincount(batch.items.invoice[item_masks.any(axis=1)], minlength=len(batch))
+        self.failure_counts = masks.sum(axis=0) + item_failures if len(batch) else np.zeros(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.batch)
+
+    def is_valid(self) -> np.ndarray:
+        return self.failure_counts == 0
+
+    def _message(self, rule: Rule, row: int) -> str:
+        return rule.message if isinstance(rule.message, str) else rule.message(self.batch, row)
+
+    def _item_warnings(self, item_rows: np.ndarray) -> List[str]:
+        hit_rows, hit_rules = np.nonzero(self.item_masks[item_rows])
+        positions = self.batch.items.position[item_rows][hit_rows].tolist()
+        return [f"Item {position}: {ITEM_RULES[rule].message}" for position, rule in zip(positions, hit_rules.tolist())]
+
+    def warnings_for(self, row: int) -> Dict[str, List[str]]:
+        """Categorized warnings of one invoice, as InvoiceValidator.validate_invoice gives them."""
+        warnings = {category: [] for category in WARNING_CATEGORIES}
+        for rule, mask in zip(RULES, self.masks):
+            if mask[row]:
+                warnings[rule.category].append(self._message(rule, row))
+        items = self.batch.items.invoice
+        start, end = np.searchsorted(items, row, 'left'), np.searchsorted(items, row, 'right')
+        warnings['items'].extend(self._item_warnings(np.arange(start, end)))
+        return warnings
+
+    def warnings(self) -> List[Dict[str, List[str]]]:
+        """Categorized warnings of every invoice, formatted rule by rule for the failing rows only."""
+        warnings = [{category: [] for category in WARNING_CATEGORIES} for _ in range(len(self.batch))]
+        for rule, mask in zip(RULES, self.masks):
+            for row in np.flatnonzero(mask).tolist():
+                warnings[row][rule.category].append(self._message(rule, row))
+
+        # Hits in item order, then rule order, as _validate_items reports them
+        hit_rows, hit_rules = np.nonzero(self.item_masks)
+        parents = self.batch.items.invoice[hit_rows].tolist()
+        positions = self.batch.items.position[hit_rows].tolist()
+        for parent, position, rule in zip(parents, positions, hit_rules.tolist()):
+            warnings[parent]['items'].append(f"Item {position}: {ITEM_RULES[rule].message}")
+        return warnings
+
+
+def evaluate_rules(batch: InvoiceBatch) -> ValidationReport:
+    """Evaluate every registered rule over the batch as column operations."""
+    masks = np.stack([rule.mask(batch) for rule in RULES]) if len(batch) else np.zeros((len(RULES), 0), dtype=bool)
+    items = batch.items
+    if len(items):
+        item_masks = np.stack([rule.mask(items) for rule in ITEM_RULES], axis=1)
+    else:
+        item_masks = np.zeros((0, len(ITEM_RULES)), dtype=bool)
+    return ValidationReport(batch, masks, item_masks)
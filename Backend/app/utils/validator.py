@@ -1,14 +1,23 @@
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime, date
 from decimal import Decimal
 from app.models import Invoice, Vendor, Address, InvoiceItem
 from app.config import settings
+from app.utils.anomaly_engine import anomaly_engine
+from app.utils.duplicate_index import duplicate_index
+from app.utils.invoice_batch import InvoiceBatch
+from app.utils.validation_rules import INVOICE_NUMBER_RE, TOTALS_TOLERANCE, evaluate_rules
+from app.utils.pipeline import InvoiceSet
+import numpy as np
 import re
 import logging
 from pydantic import ValidationError
 
 logger = logging.getLogger(__name__)
 
+HIGH_TOTAL = Decimal('10000.00')
+MAX_LINE_ITEMS = 20
+
 class InvoiceValidator:
     def __init__(self):
         self.date_format = "%Y-%m-%d"
@@ -33,11 +42,9 @@ class InvoiceValidator:
         return is_valid, all_warnings, warnings
     
     def validate_invoices(self, invoices: List[Invoice]) -> List[Tuple[Invoice, List[str], Dict[str, List[str]]]]:
-        results = []
-        for invoice in invoices:
-            is_valid, warnings, categorized_warnings = self.validate_invoice(invoice)
-            results.append((invoice, warnings, categorized_warnings))
-        return results
+        # The rule registry over the whole list; validate_invoice stays as the per-invoice reference
+        return [(invoice, [w for sublist in categorized_warnings.values() for w in sublist], categorized_warnings)
+                for invoice, categorized_warnings in zip(invoices, evaluate_rules(InvoiceBatch(invoices)).warnings())]
 
     def _validate_filename(self, filename: str) -> List[str]:
         warnings = []
@@ -49,7 +56,7 @@ class InvoiceValidator:
         warnings = []
         if not invoice_number or not invoice_number.strip():
             warnings.append("Invoice number is missing")
-        elif not re.match(r'^[A-Za-z0-9-]{5,}$', invoice_number):
+        elif not INVOICE_NUMBER_RE.match(invoice_number):
             warnings.append(f"Unusual invoice number format: {invoice_number}")
         return warnings
 
@@ -95,7 +102,7 @@ class InvoiceValidator:
     def _validate_totals(self, grand_total: Decimal, taxes: Decimal, final_total: Decimal) -> List[str]:
         warnings = []
         if all(amount is not None for amount in [grand_total, taxes, final_total]):
-            if abs((grand_total + taxes) - final_total) > Decimal('0.01'):
+            if abs((grand_total + taxes) - final_total) > TOTALS_TOLERANCE:
                 warnings.append(f"Total amounts may not match: {grand_total} + {taxes} ≈ {final_total}")
         return warnings
 
@@ -127,7 +134,7 @@ class InvoiceValidator:
             elif item.total < 0:
                 warnings.append(f"Item {idx}: Unusual total")
             if all(value is not None for value in [item.quantity, item.unit_price, item.total]):
-                if abs(round(item.quantity * item.unit_price, 2) - item.total) > Decimal('0.01'):
+                if abs(round(item.quantity * item.unit_price, 2) - item.total) > TOTALS_TOLERANCE:
                     warnings.append(f"Item {idx}: Total may not match quantity * unit price")
         return warnings
 
@@ -149,25 +156,59 @@ def validate_invoice_batch(invoices: List[Dict]) -> List[Tuple[Dict, bool, List[
 
 
 def flag_anomalies(invoices: List[Invoice]) -> List[Dict]:
-    flagged_invoices = []
-    for invoice in invoices:
-        flags = []
-        
-        # Check for future date with null check
-        if invoice.invoice_date is not None and invoice.invoice_date > date.today():
-            flags.append("Future date")
-
-        # Check for high total amount with null check
-        if invoice.final_total is not None and invoice.final_total > Decimal('10000.00'):
-            flags.append("Unusually high total amount")
-
-        # Check for large number of line items with null check
-        if invoice.items is not None and len(invoice.items) > 20:
-            flags.append("Large number of line items")
-
-        # Only add to flagged_invoices if there are flags
-        if flags:
-            flagged_invoices.append({**invoice.dict(), 'flags': flags})
-
-    return flagged_invoices
-
+    # Only invoices with flags are returned
+    return [{**invoice.dict(), 'flags': flags}
+            for invoice, flags in zip(invoices, anomaly_flags_batch(InvoiceBatch(invoices))) if flags]
+
+
+def anomaly_flags_batch(batch: InvoiceBatch, thresholds: Optional[np.ndarray] = None) -> List[List[str]]:
+    """
+    Future dates, unusually high totals and long line-item lists, for every
+    invoice of a columnar batch, one pass per check.
+    The fixed total and line-item thresholds only apply where `thresholds` is
+    True (default: everywhere); the future-date check always does.
+    """
+    flags = [[] for _ in range(len(batch))]
+    if thresholds is None:
+        thresholds = np.ones(len(batch), dtype=bool)
+    future = batch.invoice_date > np.datetime64(date.today(), 'D')
+    # Floats narrow the candidates down, the Decimal decides at the boundary
+    high = np.flatnonzero(thresholds & (batch.amounts['final_total'] >= float(HIGH_TOTAL)))
+    high = high[[batch.decimals['final_total'][row] > HIGH_TOTAL for row in high]] if len(high) else high
+    many_items = thresholds & (batch.item_count > MAX_LINE_ITEMS)
+    for rows, flag in ((np.flatnonzero(future), "Future date"), (high, "Unusually high total amount"),
+                       (np.flatnonzero(many_items), "Large number of line items")):
+        for row in rows:
+            flags[row].append(flag)
+    return flags
+
+
+def annotate_invoices(invoice_set: InvoiceSet, project_id: Optional[int] = None,
+                      task_id: Optional[str] = None) -> InvoiceSet:
+    """
+    Evaluate the validation rules and anomaly checks over the columnar batch.
+    Warnings stay a ValidationReport of masks until someone reads them.
+
+    Invoices from vendors with enough history in the project are judged
+    against that vendor's statistics; the fixed thresholds only cover the rest.
+    Every invoice is also looked up in the project's duplicate index; the
+    task adds its own invoices to the index and the vendor statistics once
+    its results are saved.
+    """
+    batch = invoice_set.batch
+    try:
+        statistical = anomaly_engine.flag_batch(batch, project_id, update=False)
+    except Exception as e:
+        logger.error(f"Statistical anomaly detection failed, using fixed thresholds: {str(e)}")
+        statistical = None
+    flags = anomaly_flags_batch(batch, None if statistical is None else ~statistical.profiled)
+    if statistical is not None:
+        for row_flags, vendor_flags in zip(flags, statistical.flags):
+            row_flags.extend(vendor_flags)
+    try:
+        for row_flags, duplicate_flags in zip(flags, duplicate_index.check(invoice_set, project_id, task_id)):
+            row_flags.extend(duplicate_flags)
+    except Exception as e:
+        logger.error(f"Duplicate invoice check failed: {str(e)}")
+    invoice_set.annotate(evaluate_rules(batch), flags)
+    return invoice_set
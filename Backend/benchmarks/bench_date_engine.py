@@ -0,0 +1,124 @@
+"""
+Micro-benchmark for invoice date extraction.
+
+Compares the single-pass date engine with the previous keyword x pattern x
+dateparser loops over a synthetic corpus of OCR page texts.
+
+    cd Backend && python -m benchmarks.bench_date_engine --pages 500
+"""
+import argparse
+import importlib.util
+import random
+import re
+import time
+from datetime import datetime
+
+from app.utils.date_engine import find_date
+
+LEGACY_PATTERNS = [
+    r'\b(\d{1,2}[/\.-]\d{1,2}[/\.-]\d{2,4})\b',
+    r'\b(\d{4}[/\.-]\d{1,2}[/\.-]\d{1,2})\b',
+    r'\b(\d{8})\b',
+    r'\b(\d{1,2}\s+[A-Za-z]{3,9}\.?\s+\d{2,4})\b',
+    r'\b([A-Za-z]{3,9}\.?\s+\d{1,2},?\s+\d{2,4})\b',
+    r'\b([A-Za-z]{3}\.?\s+[A-Za-z]{3}\.?\s+\d{2,4})\b',
+    r'\b(\d{1,2}\.\d{1,2}\.\d{2,4})\b',
+    r'\b(\d{1,2}-\d{1,2}-\d{2,4})\b',
+    r'\b(\d{1,2}\s+\d{1,2}\s+\d{2,4})\b',
+    r'\b(\d{4}\d{2}\d{2})\b',
+    r'\b(\d{2}\d{2}\d{4})\b'
+]
+
+LEGACY_KEYWORDS = [
+    'date', 'invoice date', 'issue date', 'dated', 'invoice',
+    'issued', 'due date', 'billing date', 'transaction date',
+    'document date', 'statement date', 'posting date'
+]
+
+DATE_STYLES = [
+    lambda d: d.strftime('%d/%m/%Y'),
+    lambda d: d.strftime('%m/%d/%Y'),
+    lambda d: d.strftime('%Y-%m-%d'),
+    lambda d: d.strftime('%d.%m.%y'),
+    lambda d: d.strftime('%d %B %Y'),
+    lambda d: d.strftime('%b %d, %Y'),
+]
+
+FILLER = [
+    "Widget assembly kit {n} x {p:.2f} {t:.2f}",
+    "Consulting services hours {n} rate {p:.2f}",
+    "Ref {r} Account {a}",
+    "Phone +1 555 {r} Fax 555 {a}",
+    "Thank you for your business",
+]
+
+
+def build_corpus(pages: int, lines_per_page: int, seed: int = 7):
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(pages):
+        issued = datetime(rng.randint(2018, 2024), rng.randint(1, 12), rng.randint(1, 28))
+        lines = ["ACME Supplies Ltd", "42 Industrial Way, Springfield, IL 62701"]
+        for _ in range(lines_per_page):
+            template = rng.choice(FILLER)
+            lines.append(template.format(
+                n=rng.randint(1, 50), p=rng.uniform(1, 500), t=rng.uniform(1, 5000),
+                r=rng.randint(1000, 9999), a=rng.randint(100000, 999999)))
+        label = rng.choice(['Invoice Date:', 'Date', 'Issued', 'Statement date'])
+        lines.insert(rng.randint(2, len(lines)), f"{label} {rng.choice(DATE_STYLES)(issued)}")
+        corpus.append('\n'.join(lines))
+    return corpus
+
+
+def legacy_extract_date(text: str, use_dateparser: bool):
+    """The previous nested loops, kept here as the baseline."""
+    parse = None
+    if use_dateparser:
+        import dateparser
+        parse = dateparser.parse
+    for keyword in LEGACY_KEYWORDS:
+        for match in re.finditer(rf'(?i){re.escape(keyword)}[:\s]*(.{{0,50}})', text):
+            nearby_text = match.group(1)
+            for pattern in LEGACY_PATTERNS:
+                for date_match in re.finditer(pattern, nearby_text):
+                    if parse is None:
+                        return date_match.group(0)
+                    for date_order in ['DMY', 'MDY', 'YMD']:
+                        parsed = parse(date_match.group(0), settings={'DATE_ORDER': date_order})
+                        if parsed:
+                            return parsed.date()
+    return None
+
+
+def run(label: str, fn, corpus, repeat: int):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in corpus:
+            fn(text)
+        best = min(best, time.perf_counter() - start)
+    per_page_us = best / len(corpus) * 1e6
+    print(f"{label:<32} {best * 1000:10.2f} ms total  {per_page_us:10.1f} us/page")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=300)
+    parser.add_argument('--lines', type=int, default=60, help='filler lines per page')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.pages, args.lines)
+    print(f"{args.pages} pages, ~{sum(len(t) for t in corpus) // args.pages} chars/page")
+
+    engine = run("date_engine.find_date", lambda t: find_date(t, use_fallback=False), corpus, args.repeat)
+    if importlib.util.find_spec('dateparser'):
+        legacy = run("legacy loops + dateparser", lambda t: legacy_extract_date(t, True), corpus, args.repeat)
+    else:
+        legacy = run("legacy loops (regex only)", lambda t: legacy_extract_date(t, False), corpus, args.repeat)
+    print(f"speedup: {legacy / engine:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
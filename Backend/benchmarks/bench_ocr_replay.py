@@ -0,0 +1,68 @@
+"""
+Benchmark for the OCR and extraction stages, offline and reproducible.
+
+Renders a synthetic invoice PDF (the same pages as bench_rasterizer) and
+runs every page through OCREngine.process_page and extract_pages, the path
+extract_uploads takes. Google calls go through the response cassette:
+record once against the live APIs, then replay as often as needed with a
+synthetic latency distribution and, optionally, injected failures to
+exercise retries and the OCR fallback. Replay needs no credentials.
+
+    cd Backend && python -m benchmarks.bench_ocr_replay --mode record --pages 10
+    cd Backend && python -m benchmarks.bench_ocr_replay --mode replay --pages 10 --latency lognormal:0.6,0.4
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from app.config import settings
+from benchmarks.bench_rasterizer import build_pdf
+
+
+async def run(path: str, pages: int, backend: str):
+    from app.utils.ocr_engine import ocr_engine
+    from app.utils.rasterizer import RasterOptions, render_shard
+
+    images = render_shard(path, 0, pages, RasterOptions.from_settings())
+    start = time.perf_counter()
+    ocr_results = [await ocr_engine.process_page(f"invoice_page{index}", image, backend)
+                   for index, image in enumerate(images, 1)]
+    ocr_time = time.perf_counter() - start
+    start = time.perf_counter()
+    invoices = await ocr_engine.extract_pages(ocr_results)
+    return ocr_time, time.perf_counter() - start, invoices
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['record', 'replay'], default='replay')
+    parser.add_argument('--cassette', default=settings.GOOGLE_CASSETTE_PATH)
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--latency', default='recorded', help="replay latency, see cassette.LatencyModel")
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', default='vision')
+    args = parser.parse_args()
+
+    # Before the engine creates its clients
+    settings.GOOGLE_CASSETTE_MODE = args.mode
+    settings.GOOGLE_CASSETTE_PATH = args.cassette
+    settings.GOOGLE_REPLAY_LATENCY = args.latency
+    settings.GOOGLE_REPLAY_ERROR_RATE = args.error_rate
+    settings.GOOGLE_REPLAY_SEED = args.seed
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f"invoice_{args.pages}.pdf")
+        build_pdf(path, args.pages)
+        ocr_time, extract_time, invoices = asyncio.run(run(path, args.pages, args.backend))
+
+    print(f"{args.pages} pages, {args.backend} OCR, cassette {args.mode} ({args.cassette}), latency {args.latency}")
+    print(f"  OCR          {ocr_time * 1000:10.1f} ms   {ocr_time / args.pages * 1000:8.1f} ms/page")
+    print(f"  extraction   {extract_time * 1000:10.1f} ms   {extract_time / args.pages * 1000:8.1f} ms/page")
+    print(f"  invoices with a number: {sum(1 for invoice in invoices if invoice.invoice_number)}/{len(invoices)}")
+
+
+if __name__ == '__main__':
+    main()
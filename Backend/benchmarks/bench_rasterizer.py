@@ -0,0 +1,87 @@
+"""
+Benchmark for PDF rasterization.
+
+Renders synthetic invoice PDFs of 1, 10 and 200 pages (text, a table grid
+and a filled logo per page) sequentially in one thread, as
+FileHandler._process_pdf_content did, and through the sharded process-pool
+rasterizer with 1..N workers. Every run checks that the pages come back in
+order and identical to the sequential render. Pool start-up is excluded:
+the pool is warmed once per worker count.
+
+    cd Backend && python -m benchmarks.bench_rasterizer --pages 1 10 200 --workers 1 2 4 --dpi 150
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import fitz  # PyMuPDF
+
+from app.config import settings
+from app.utils.rasterizer import PdfRasterizer, RasterOptions, render_shard
+
+
+def build_pdf(path: str, pages: int):
+    doc = fitz.open()
+    for page_number in range(1, pages + 1):
+        page = doc.new_page()
+        page.draw_rect(fitz.Rect(40, 40, 140, 90), color=(0.1, 0.3, 0.6), fill=(0.2, 0.4, 0.8))
+        page.insert_text((160, 70), f"ACME Corp - Invoice INV-{page_number:06d}", fontsize=16)
+        for row in range(30):
+            y = 120 + row * 20
+            page.draw_line((40, y), (560, y), color=(0.7, 0.7, 0.7))
+            page.insert_text((45, y + 14), f"Item {row + 1:02d}   Consulting services   {row + 1} x 125.00   "
+                                           f"{(row + 1) * 125:,.2f}", fontsize=10)
+        page.insert_text((380, 760), f"Total due: {sum(range(1, 31)) * 125:,.2f} USD", fontsize=12)
+    doc.save(path)
+    doc.close()
+
+
+async def render_all(rasterizer: PdfRasterizer, path: str, options: RasterOptions):
+    return [image async for _, image in rasterizer.render(path, options)]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, nargs='+', default=[1, 10, 200])
+    parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, 2, os.cpu_count() or 1}))
+    parser.add_argument('--dpi', type=int, default=150)
+    parser.add_argument('--colorspace', choices=['rgb', 'gray'], default='rgb')
+    parser.add_argument('--shard-pages', type=int, default=8)
+    args = parser.parse_args()
+
+    options = RasterOptions(args.dpi, args.colorspace)
+    rasterizers = {workers: PdfRasterizer(workers, args.shard_pages, options) for workers in args.workers}
+    print(f"{os.cpu_count()} CPUs, {args.dpi} dpi {args.colorspace}, shards of up to {args.shard_pages} pages")
+
+    with tempfile.TemporaryDirectory() as directory:
+        warmup = os.path.join(directory, 'warmup.pdf')
+        build_pdf(warmup, max(args.workers) * 4)
+        for rasterizer in rasterizers.values():
+            asyncio.run(render_all(rasterizer, warmup, options))
+
+        for pages in args.pages:
+            path = os.path.join(directory, f"invoice_{pages}.pdf")
+            build_pdf(path, pages)
+            sequential, expected = timed(lambda: render_shard(path, 0, pages, options))
+            print(f"{pages} pages, {sum(len(image) for image in expected) / 1e6:.1f} MB of PNG")
+            print(f"  sequential, one thread        {sequential * 1000:10.1f} ms")
+            for workers, rasterizer in rasterizers.items():
+                elapsed, images = timed(lambda: asyncio.run(render_all(rasterizer, path, options)))
+                assert images == expected, "sharded render differs from the sequential one"
+                inline = " (inline)" if pages <= settings.RASTER_INLINE_PAGES else ""
+                print(f"  {workers} worker(s){inline:<19} {elapsed * 1000:10.1f} ms   {sequential / elapsed:5.2f}x")
+
+    for rasterizer in rasterizers.values():
+        rasterizer.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Micro-benchmark for invoice validation.
+
+Compares the per-invoice InvoiceValidator.validate_invoice loop with the rule
+registry evaluated as masks over an InvoiceBatch, at 10k and 100k synthetic
+invoices (mostly clean, some with missing fields and total mismatches).
+Reports the mask pass alone and with every warning formatted.
+
+    cd Backend && python -m benchmarks.bench_validation --invoices 10000 100000
+"""
+import argparse
+import random
+import time
+from datetime import date
+from decimal import Decimal
+
+from app.models import Address, Invoice, InvoiceItem, Vendor
+from app.utils.invoice_batch import InvoiceBatch
+from app.utils.validation_rules import evaluate_rules
+from app.utils.validator import invoice_validator
+
+DISTINCT_INVOICES = 2_000
+
+
+def build_invoices(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    distinct = []
+    for idx in range(min(count, DISTINCT_INVOICES)):
+        items = []
+        for _ in range(rng.randint(0, 8)):
+            quantity = rng.choice([1, 2, 5, None])
+            unit_price = Decimal(rng.randint(100, 50_000)) / 100
+            total = quantity * unit_price if quantity else None
+            if total is not None and rng.random() < 0.05:
+                total += Decimal('1.00')
+            items.append(InvoiceItem(description=rng.choice(['Widget', 'Consulting', '']),
+                                     quantity=quantity, unit_price=unit_price, total=total))
+        grand_total = Decimal(rng.randint(1_000, 2_000_000)) / 100
+        taxes = (grand_total * Decimal('0.2')).quantize(Decimal('0.01'))
+        final_total = grand_total + taxes + (Decimal('0.50') if rng.random() < 0.05 else 0)
+        distinct.append(Invoice(
+            filename=f"invoice_{idx}.pdf",
+            invoice_number=rng.choice([f"INV-{idx:06d}", f"{idx}", None]),
+            vendor=Vendor(name=rng.choice(['ACME Corp', '']), address=Address(
+                street='1 Main St', city='Springfield', state=rng.choice(['IL', '']),
+                postal_code='62701', country=rng.choice(['US', '']))),
+            invoice_date=rng.choice([date(2024, 3, 1), None]),
+            grand_total=grand_total, taxes=rng.choice([taxes, None]), final_total=final_total,
+            items=items,
+        ))
+    # Repeat the distinct invoices: building 100k pydantic models is not what is measured
+    return [distinct[idx % len(distinct)] for idx in range(count)]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--invoices', type=int, nargs='+', default=[10_000, 100_000])
+    args = parser.parse_args()
+
+    for count in args.invoices:
+        invoices = build_invoices(count)
+        loop, expected = timed(lambda: [invoice_validator.validate_invoice(invoice)[2] for invoice in invoices])
+        build, batch = timed(lambda: InvoiceBatch(invoices))
+        masks, report = timed(lambda: evaluate_rules(batch))
+        messages, warnings = timed(report.warnings)
+        assert warnings == expected, "rule registry and validate_invoice disagree"
+
+        print(f"{count} invoices, {len(batch.items)} line items, {int((~report.is_valid()).sum())} with warnings")
+        print(f"  validate_invoice loop          {loop * 1000:10.1f} ms")
+        print(f"  InvoiceBatch build             {build * 1000:10.1f} ms")
+        print(f"  rule masks                     {masks * 1000:10.1f} ms   {loop / masks:5.1f}x")
+        print(f"  masks + all warnings           {(masks + messages) * 1000:10.1f} ms   "
+              f"{loop / (masks + messages):5.1f}x")
+
+
+if __name__ == '__main__':
+    main()
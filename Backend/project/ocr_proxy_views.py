@@ -1,5 +1,6 @@
 import os
 import uuid
+import shutil
 import tempfile
 import asyncio
 import io
@@ -14,14 +15,19 @@ from .models import Project, ProcessedFile, Anomaly, ProjectHistory
 
 # Import OCR Engine components directly
 from app.utils.ocr_engine import ocr_engine
-from app.utils.file_handler import FileHandler
+from app.utils.file_handler import (FileHandler, FileProcessingError, SPOOL_CHUNK_SIZE, UnsupportedFileTypeError,
+                                     UploadTooLargeError)
 from app.utils.validator import invoice_validator, flag_anomalies
 from app.utils.exporter import export_invoices
 from app.utils.data_extractor import DataExtractor
 from app.models import ProcessingStatus, Invoice
 
+from app.utils.upload_registry import upload_digest, upload_registry
+from app.utils.preflight import BULK_QUEUE, QuotaExceededError, admit, inspect_uploads
+from app.utils.ocr_backends import resolve_ocr_backend
+
 # Access the global dictionaries from the OCR Engine
-from app.main import processing_tasks, direct_results
+from app.main import processing_tasks, direct_results, reuse_upload, run_queued
 
 # Initialize file handler
 file_handler = FileHandler()
@@ -49,32 +55,80 @@ class ProjectOCRView(APIView):
         # Create a temporary directory for processing
         temp_dir = tempfile.mkdtemp()
         file_paths = []
+        file_hashes = []
+        # The background task owns temp_dir once started; until then every exit removes it
+        started = False
         
         try:
-            # Save uploaded files to temp directory
+            # Stream uploaded files to temp directory, hashing and sniffing them on the way
             for file_obj in request.FILES.getlist('files'):
-                file_path = os.path.join(temp_dir, file_obj.name)
-                with open(file_path, 'wb') as f:
-                    for chunk in file_obj.chunks():
-                        f.write(chunk)
-                file_paths.append(file_path)
+                try:
+                    upload = file_handler.spool_chunks(file_obj.chunks(SPOOL_CHUNK_SIZE), file_obj.name,
+                                                       temp_dir, file_obj.size)
+                    file_paths.append(upload.path)
+                    file_hashes.append((upload.filename, upload.sha256))
+                except UploadTooLargeError as e:
+                    return Response({'error': str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+                except UnsupportedFileTypeError as e:
+                    return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            
+            # Identical uploads are answered from the task that processed them, unless forced
+            digest = upload_digest(file_hashes)
+            force = str(request.data.get('force', request.query_params.get('force', ''))).lower() in ('true', '1', 't')
+            if force:
+                upload_registry.record('forced')
+            else:
+                reused_task_id = reuse_upload(digest, pk)
+                if reused_task_id:
+                    ProjectHistory.objects.create(
+                        project=project,
+                        action='process',
+                        description=f"Reused the results of an identical upload as task {reused_task_id}",
+                        performed_by=request.user
+                    )
+                    return Response({
+                        'task_id': reused_task_id,
+                        'message': 'Identical upload already processed'
+                    })
+            
+            # Pages are counted without rendering; jobs over quota are refused before any API call
+            try:
+                report = inspect_uploads(file_paths)
+                admit(report)
+            except QuotaExceededError as e:
+                return Response({'error': str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            except FileProcessingError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            
+            # OCR backend asked for with the upload, else the project's, else the queue's default
+            try:
+                backend = resolve_ocr_backend(request.data.get('ocr_backend') or request.query_params.get('ocr_backend'),
+                                              pk, report.queue)
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            report.price(backend)
+            upload_registry.start(digest, task_id, pk)
             
             # Initialize task status with project_id
-            status_info = ProcessingStatus(status="Queued", progress=0, message="Task queued")
+            message = "Waiting for a bulk processing slot" if report.queue == BULK_QUEUE else "Task queued"
+            status_info = ProcessingStatus(status="Queued", progress=0, message=message)
             status_info.project_id = pk
             processing_tasks[task_id] = status_info
             
-            # Start processing in background using threading
+            # Start processing in background using threading; bulk jobs wait for a slot first
             if len(file_paths) == 1:
                 threading.Thread(
                     target=self._run_async_task,
-                    args=(self.process_file_directly, task_id, file_paths[0], temp_dir, pk)
+                    args=(run_queued, report.queue, self.process_file_directly, task_id, file_paths[0], temp_dir, pk, digest,
+                          backend)
                 ).start()
             else:
                 threading.Thread(
                     target=self._run_async_task,
-                    args=(self.process_multiple_files_directly, task_id, file_paths, temp_dir, pk)
+                    args=(run_queued, report.queue, self.process_multiple_files_directly, task_id, file_paths, temp_dir,
+                          pk, digest, backend)
                 ).start()
+            started = True
             
             # Create a processing record in the project
             ProjectHistory.objects.create(
@@ -86,7 +140,8 @@ class ProjectOCRView(APIView):
             
             return Response({
                 'task_id': task_id,
-                'message': 'Processing started'
+                'message': 'Processing started',
+                'estimate': report.to_dict()
             })
                 
         except Exception as e:
@@ -94,6 +149,9 @@ class ProjectOCRView(APIView):
                 {'error': f"Failed to process files: {str(e)}"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+        finally:
+            if not started:
+                shutil.rmtree(temp_dir, ignore_errors=True)
     
     def _run_async_task(self, async_func, *args):
         """Run an async function in a new event loop"""
@@ -104,11 +162,11 @@ class ProjectOCRView(APIView):
         finally:
             loop.close()
     
-    async def process_file_directly(self, task_id, file_path, temp_dir, project_id):
+    async def process_file_directly(self, task_id, file_path, temp_dir, project_id, digest=None, ocr_backend=None):
         """Process a single file directly using OCR Engine functions"""
         from app.main import process_file_directly
         try:
-            await process_file_directly(task_id, file_path, temp_dir, project_id)
+            await process_file_directly(task_id, file_path, temp_dir, project_id, digest, ocr_backend)
         except Exception as e:
             processing_tasks[task_id] = ProcessingStatus(
                 status="Failed", 
@@ -117,11 +175,12 @@ class ProjectOCRView(APIView):
                 project_id=project_id
             )
     
-    async def process_multiple_files_directly(self, task_id, file_paths, temp_dir, project_id):
+    async def process_multiple_files_directly(self, task_id, file_paths, temp_dir, project_id, digest=None,
+                                              ocr_backend=None):
         """Process multiple files directly using OCR Engine functions"""
         from app.main import process_multiple_files_directly
         try:
-            await process_multiple_files_directly(task_id, file_paths, temp_dir, project_id)
+            await process_multiple_files_directly(task_id, file_paths, temp_dir, project_id, digest, ocr_backend)
         except Exception as e:
             processing_tasks[task_id] = ProcessingStatus(
                 status="Failed", 
@@ -1,3 +1,4 @@
+import logging
 from django.shortcuts import get_object_or_404
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -7,11 +8,17 @@ from django.db.models import Q
 from datetime import datetime, timedelta
 
 from .models import Project, ProjectHistory, ProcessedFile, Anomaly
+from app.utils.anomaly_engine import anomaly_engine
+from app.utils.duplicate_index import duplicate_index
+from app.utils.template_store import template_store
+from app.utils.upload_registry import upload_registry
 from .serializers import (
     ProjectSerializer, ProjectDetailSerializer, 
     ProcessedFileSerializer, AnomalySerializer
 )
 
+logger = logging.getLogger(__name__)
+
 class ProjectListCreateView(APIView):
     """
     API endpoint for listing and creating projects
@@ -80,6 +87,22 @@ class ProjectDetailView(APIView):
         """Delete a project"""
         project = self.get_object(pk)
         project.delete()
+        try:
+            duplicate_index.forget_project(pk)
+        except Exception as e:
+            logger.error(f"Could not drop project {pk} from the duplicate index: {str(e)}")
+        try:
+            anomaly_engine.forget_project(pk)
+        except Exception as e:
+            logger.error(f"Could not drop the vendor statistics of project {pk}: {str(e)}")
+        try:
+            upload_registry.forget_project(pk)
+        except Exception as e:
+            logger.error(f"Could not drop the uploads of project {pk} from the upload registry: {str(e)}")
+        try:
+            template_store.forget_project(pk)
+        except Exception as e:
+            logger.error(f"Could not drop the vendor templates of project {pk}: {str(e)}")
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 